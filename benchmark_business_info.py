@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+מיקרו-בנצ'מרק להיוריסטיקות המידע העסקי בשיחות של 100 הודעות.
+משווה את המימוש הישן (חיבור וסריקה של כל ההיסטוריה בכל סבב) מול המצב המצטבר
+(ConversationState שמתעדכן רק מההודעה החדשה), ומוודא שהתוצאות זהות בכל סבב.
+
+הרצה:
+    python benchmark_business_info.py [conversations] [messages_per_conversation]
+
+השיחות מורכבות מהודעות אמיתיות מתוך conversations/*.txt (אם יש), חצי מהן עם
+ה-agent prompt בתחילתן וחצי בלעדיו - כדי לעבור גם במסלול של "מה חסר".
+"""
+
+import glob
+import os
+import random
+import sys
+import time
+
+from benchmark_context import parse_transcript
+from business_info import has_enough_business_info, get_next_action_message, BUSINESS_KEYWORDS
+from conversation_state import ConversationState
+
+FALLBACK_MESSAGES = [
+    "היי, יש לי עסק קטן של עוגות", "אני רוצה דף נחיתה", "המטרה היא מכירה אונליין",
+    "יש לי לוגו ותמונות", "סגנון נקי ומודרני", "הלקוחות שלי בגיל 25-40", "בסדר", "אוקיי, בוא נתקדם",
+    "מה המחיר?", "ספר לי עוד", "מה מבדיל אותנו? השירות האישי", "אני לא בטוח",
+]
+
+
+# --- המימוש הישן (כפי שהיה ב-chatbot.py) לצורך השוואה ---
+
+def legacy_has_enough_business_info(conversation_history):
+    user_messages = [msg for msg in conversation_history if msg["role"] == "user"]
+    if len(user_messages) < 6:
+        return False
+    conversation_text = " ".join([msg["content"].lower() for msg in conversation_history])
+    found_keywords = sum(1 for keyword in BUSINESS_KEYWORDS if keyword in conversation_text)
+    return found_keywords >= 3
+
+
+def legacy_should_proceed_to_sale(conversation_history):
+    if not legacy_has_enough_business_info(conversation_history):
+        return False
+    recent_messages = conversation_history[-4:]
+    user_messages = [msg["content"].lower() for msg in recent_messages if msg["role"] == "user"]
+    readiness_phrases = [
+        "אני מעוניין", "אני רוצה", "אני מוכן", "בוא נתקדם", "אוקיי", "בסדר",
+        "אני אקנה", "אני אתחיל", "בואו נתחיל", "אני מסכים", "זה נשמע טוב"
+    ]
+    return any(phrase in message for message in user_messages for phrase in readiness_phrases)
+
+
+def legacy_get_missing_business_info(conversation_history):
+    conversation_text = " ".join([msg["content"].lower() for msg in conversation_history])
+    missing_items = []
+    if "עסק" not in conversation_text and "מוצר" not in conversation_text and "שירות" not in conversation_text:
+        missing_items.append("מה בדיוק העסק שלך עושה")
+    if "מטרה" not in conversation_text and "מכירה" not in conversation_text:
+        missing_items.append("מה המטרה של הדף - מה אתה רוצה שהלקוחות יעשו")
+    if "לוגו" not in conversation_text and "תמונות" not in conversation_text:
+        missing_items.append("איזה חומרים יש לך כבר - לוגו, תמונות")
+    if "עיצוב" not in conversation_text and "סגנון" not in conversation_text:
+        missing_items.append("איזה סגנון עיצוב אתה אוהב")
+    if "מבדיל" not in conversation_text and "יתרון" not in conversation_text:
+        missing_items.append("מה מבדל אותך מהמתחרים")
+    if "לקוחות" not in conversation_text and "גיל" not in conversation_text:
+        missing_items.append("מי הלקוחות שלך - גיל, מגדר, תחומי עניין")
+    if len(missing_items) == 0:
+        return "מעולה! יש לי את כל המידע שאני צריך על העסק שלך."
+    elif len(missing_items) == 1:
+        return f"אני צריך להבין {missing_items[0]}."
+    elif len(missing_items) == 2:
+        return f"אני צריך להבין {missing_items[0]} ו{missing_items[1]}."
+    return f"אני צריך להבין עוד כמה דברים: {', '.join(missing_items[:-1])} ו{missing_items[-1]}."
+
+
+def legacy_get_next_action_message(conversation_history):
+    if not legacy_has_enough_business_info(conversation_history):
+        missing_info = legacy_get_missing_business_info(conversation_history)
+        return f"אני רוצה לוודא שאני מבין בדיוק מה אתה צריך. {missing_info}"
+    if legacy_should_proceed_to_sale(conversation_history):
+        return "מעולה! יש לי תמונה ברורה של מה שאתה צריך. בואו נסגור את זה?"
+    return "אני רואה שיש לך עסק מעניין. בואו נדבר קצת יותר על איך הדף הזה יעזור לך להשיג את המטרות שלך."
+
+
+def load_pool():
+    """הודעות משתמש/סוכן ו-system prompt מתוך השיחות השמורות"""
+    system_prompt = ""
+    pool = {"user": [], "assistant": []}
+    for path in sorted(glob.glob(os.path.join("conversations", "*.txt"))):
+        for m in parse_transcript(path):
+            if m["role"] == "system":
+                system_prompt = system_prompt or m["content"]
+            elif m["role"] in pool and m["content"]:
+                pool[m["role"]].append(m["content"])
+    for role in pool:
+        pool[role] = pool[role] or FALLBACK_MESSAGES
+    return system_prompt, pool
+
+
+def build_conversation(rng, system_prompt, pool, length, with_system):
+    messages = [{"role": "system", "content": system_prompt}] if with_system and system_prompt else []
+    while len(messages) < length:
+        role = "user" if len(messages) % 2 == (1 if messages and messages[0]["role"] == "system" else 0) else "assistant"
+        messages.append({"role": role, "content": rng.choice(pool[role])})
+    return messages
+
+
+def run_legacy(conversation):
+    """בכל סבב משתמש: סריקה מלאה של ההיסטוריה עד אותו רגע"""
+    results = []
+    history = []
+    for message in conversation:
+        history.append(message)
+        if message["role"] == "user":
+            results.append((legacy_has_enough_business_info(history), legacy_get_next_action_message(history)))
+    return results
+
+
+def run_incremental(conversation):
+    """בכל סבב משתמש: המצב מתעדכן רק מההודעה החדשה"""
+    results = []
+    history = []
+    state = ConversationState.from_messages(history)
+    for message in conversation:
+        history.append(message)
+        state.record(message["role"], message["content"])
+        if message["role"] == "user":
+            results.append((has_enough_business_info(history, state), get_next_action_message(history, state)))
+    return results
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    length = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    rng = random.Random(42)
+    system_prompt, pool = load_pool()
+    conversations = [build_conversation(rng, system_prompt, pool, length, with_system=(i % 2 == 0))
+                     for i in range(count)]
+
+    print(f"📊 בנצ'מרק מידע עסקי: {count} שיחות × {length} הודעות")
+    print("=" * 60)
+
+    started = time.perf_counter()
+    legacy = [run_legacy(c) for c in conversations]
+    legacy_sec = time.perf_counter() - started
+
+    started = time.perf_counter()
+    incremental = [run_incremental(c) for c in conversations]
+    incremental_sec = time.perf_counter() - started
+
+    turns = sum(len(r) for r in legacy)
+    mismatches = sum(1 for a, b in zip(legacy, incremental) for x, y in zip(a, b) if x != y)
+    print(f"סריקה מלאה:   {legacy_sec * 1000:8.1f}ms  ({legacy_sec * 1e6 / turns:7.1f}µs לסבב)")
+    print(f"מצב מצטבר:   {incremental_sec * 1000:8.1f}ms  ({incremental_sec * 1e6 / turns:7.1f}µs לסבב)")
+    print(f"האצה: x{legacy_sec / incremental_sec:.1f} | סבבים שנבדקו: {turns} | אי-התאמות: {mismatches}")
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
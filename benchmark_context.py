@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+בנצ'מרק לבניית הקשר בתקציב טוקנים על השיחות השמורות ב-conversations/.
+משחזר כל שיחה סבב אחרי סבב ומשווה טוקנים לבקשה: כל ההיסטוריה מול ContextBuilder.
+
+הרצה:
+    python benchmark_context.py [token_budget] [recent_turns] [--live]
+
+בלי --live הסיכום המתגלגל מוחלף בתקציר חילוצי דטרמיניסטי (ללא קריאות רשת), כך שנמדדים
+רק טוקנים. עם --live (דורש OPENAI_API_KEY) הסיכומים נוצרים ב-GPT ונמדדת גם השהיית
+הבקשה בפועל (עד הטוקן הראשון ועד הסוף) לבקשה המלאה מול המתוקצבת בסבב האחרון של כל שיחה.
+"""
+
+import glob
+import os
+import re
+import sys
+import time
+
+from context_builder import ContextBuilder, count_tokens, TIKTOKEN_AVAILABLE
+from metrics import percentile
+
+_ROLE_LINE = re.compile(r'^(SYSTEM|USER|ASSISTANT): ?', re.MULTILINE)
+# בתקציר החילוצי נשמרות רק הודעות המשתמש, מקוצרות
+EXTRACTIVE_CHARS_PER_MESSAGE = 120
+EXTRACTIVE_MAX_CHARS = 1200
+
+
+def parse_transcript(path):
+    """קריאת קובץ txt בפורמט של save_conversation_to_file לרשימת הודעות"""
+    with open(path, "r", encoding="utf-8-sig") as f:
+        text = f.read()
+    matches = list(_ROLE_LINE.finditer(text))
+    messages = []
+    for i, m in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        messages.append({"role": m.group(1).lower(), "content": text[m.end():end].strip()})
+    return messages
+
+
+def extractive_summary(previous, messages):
+    """תחליף לא-מקוון לסיכום GPT: שורות המשתמש בקיצור"""
+    lines = [previous] if previous else []
+    for m in messages:
+        if m["role"] == "user":
+            lines.append("- " + m["content"][:EXTRACTIVE_CHARS_PER_MESSAGE])
+    return "\n".join(lines)[-EXTRACTIVE_MAX_CHARS:]
+
+
+def replay(builder, user_id, messages):
+    """שחזור סבב-סבב: בקשה לפני כל תשובת סוכן. מחזיר זוגות (מלא, מתוקצב)"""
+    samples = []
+    for i, m in enumerate(messages):
+        if m["role"] != "assistant" or i == 0:
+            continue
+        history = messages[:i]
+        full = count_tokens(history)
+        built = builder.build(user_id, history)
+        samples.append((full, count_tokens(built), history, built))
+        # במקום ה-worker ברקע: הדחיסה "מספיקה" להסתיים לפני הסבב הבא
+        if _needs_compaction(builder, user_id, history):
+            builder.compact_now(user_id, history)
+    return samples
+
+
+def _needs_compaction(builder, user_id, history):
+    body_start = 1 if history and history[0]["role"] == "system" else 0
+    recent_start = builder._recent_start(history, body_start)
+    summary = builder._valid_summary(user_id, history)
+    covered = summary["covered"] if summary else body_start
+    return count_tokens(history[covered:recent_start]) >= builder.compact_threshold_tokens
+
+
+def timed_request(client, model, messages):
+    """השהיית בקשה בפועל: עד הטוקן הראשון ועד סוף התשובה"""
+    started = time.time()
+    ttfb = None
+    stream = client.chat.completions.create(model=model, messages=messages, stream=True)
+    for chunk in stream:
+        if ttfb is None and chunk.choices and chunk.choices[0].delta.content:
+            ttfb = time.time() - started
+    return ttfb or 0.0, time.time() - started
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    live = "--live" in sys.argv
+    budget = int(args[0]) if len(args) > 0 else 6000
+    recent_turns = int(args[1]) if len(args) > 1 else 6
+
+    summarize_fn = extractive_summary
+    client = model = None
+    if live:
+        import chatbot
+        summarize_fn = chatbot.summarize_for_context
+        client, model = chatbot.client, chatbot.CHAT_MODEL
+
+    builder = ContextBuilder(budget, recent_turns, compact_threshold_tokens=400, summarize_fn=summarize_fn)
+    paths = sorted(glob.glob(os.path.join("conversations", "*.txt")))
+    if not paths:
+        print("⚠️ אין שיחות ב-conversations/")
+        return
+
+    counting = "tiktoken" if TIKTOKEN_AVAILABLE else "הערכה לפי תווים"
+    print(f"📊 בנצ'מרק הקשר: {len(paths)} שיחות, תקציב {budget} טוקנים, {recent_turns} סבבים אחרונים ({counting})")
+    print("=" * 78)
+
+    all_full, all_built, latency = [], [], []
+    for path in paths:
+        user_id = os.path.basename(path)[:-4]
+        samples = replay(builder, user_id, parse_transcript(path))
+        if not samples:
+            continue
+        full = [s[0] for s in samples]
+        built = [s[1] for s in samples]
+        all_full += full
+        all_built += built
+        saved = 100.0 * (1 - sum(built) / sum(full))
+        print(f"{user_id:<28} סבבים={len(samples):<3} אחרון: {full[-1]:>5} → {built[-1]:>5} טוקנים | "
+              f"סה\"כ חיסכון {saved:5.1f}%")
+
+        if live:
+            _, _, history, built_messages = samples[-1]
+            latency.append((timed_request(client, model, history), timed_request(client, model, built_messages)))
+
+    print("=" * 78)
+    print(f"טוקנים לבקשה - מלא:     p50={percentile(all_full, 50):.0f} p95={percentile(all_full, 95):.0f} "
+          f"סה\"כ={sum(all_full)}")
+    print(f"טוקנים לבקשה - מתוקצב:  p50={percentile(all_built, 50):.0f} p95={percentile(all_built, 95):.0f} "
+          f"סה\"כ={sum(all_built)} ({100.0 * (1 - sum(all_built) / sum(all_full)):.1f}% פחות)")
+
+    if latency:
+        full_ttfb = [f[0] for f, _ in latency]
+        built_ttfb = [b[0] for _, b in latency]
+        full_total = [f[1] for f, _ in latency]
+        built_total = [b[1] for _, b in latency]
+        print(f"השהייה (סבב אחרון) - מלא:     TTFB p50={percentile(full_ttfb, 50):.2f}s סה\"כ p50={percentile(full_total, 50):.2f}s")
+        print(f"השהייה (סבב אחרון) - מתוקצב:  TTFB p50={percentile(built_ttfb, 50):.2f}s סה\"כ p50={percentile(built_total, 50):.2f}s")
+    else:
+        print("להשוואת השהייה מול OpenAI הרץ עם --live")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+בנצ'מרק למנגנון הצבירה (debounce): threading.Timer לכל הודעה מול מתזמן יחיד + executor חסום.
+מודד מספר threads מקסימלי והשהיית flush (מהמועד המתוכנן ועד תחילת הריצה) עבור 1000 שולחים.
+
+הרצה:
+    python benchmark_debounce.py [senders] [messages_per_sender] [flush_workers]
+
+השהיית ה-flush במתזמן החדש כוללת המתנה בתור ה-executor החסום (זה המחיר של הגבלת
+המקביליות); "dispatch" מודד רק את הדיוק של thread המתזמן עצמו.
+"""
+
+import random
+import sys
+import threading
+import time
+
+from timer_wheel import DeadlineScheduler
+from work_queue import BoundedWorkQueue
+
+WINDOW_SEC = 0.5        # חלון צבירה מקוצר לצורך הבנצ'מרק
+GAP_SEC = (0.01, 0.2)   # מרווח בין הודעות של אותו שולח
+FLUSH_WORK_SEC = 0.05   # הדמיית עבודת GPT/שליחה בתוך ה-flush
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+class Harness:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.due = {}
+        self.latencies = []
+        self.dispatch = []
+        self.flushes = 0
+        self.peak_threads = threading.active_count()
+        self.done = threading.Event()
+
+    def flush(self, sender):
+        started = time.monotonic()
+        with self.lock:
+            due = self.due.pop(sender, None)
+            if due is None:
+                return
+            self.latencies.append(started - due)
+            self.flushes += 1
+        time.sleep(FLUSH_WORK_SEC)
+
+    def sample_threads(self):
+        while not self.done.is_set():
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+            time.sleep(0.005)
+
+
+def run_legacy(senders, per_sender):
+    """המימוש הקודם: ביטול ויצירת threading.Timer בכל הודעה"""
+    h = Harness()
+    timers = {}
+    timers_lock = threading.Lock()
+
+    def on_message(sender):
+        with timers_lock:
+            existing = timers.get(sender)
+            if existing is not None:
+                existing.cancel()
+            t = threading.Timer(WINDOW_SEC, h.flush, args=(sender,))
+            t.daemon = True
+            timers[sender] = t
+            with h.lock:
+                h.due[sender] = time.monotonic() + WINDOW_SEC
+            t.start()
+
+    return drive(h, senders, per_sender, on_message)
+
+
+class _TimedExecutor:
+    """עוטף executor ורושם מתי המתזמן שיגר כל flush"""
+
+    def __init__(self, inner, h):
+        self.inner = inner
+        self.h = h
+
+    def submit(self, fn, sender):
+        with self.h.lock:
+            due = self.h.due.get(sender)
+            if due is not None:
+                self.h.dispatch.append(time.monotonic() - due)
+        return self.inner.submit(fn, sender)
+
+
+def run_scheduler(senders, per_sender, workers=16):
+    """המימוש החדש: מתזמן יחיד + executor חסום"""
+    h = Harness()
+    executor = BoundedWorkQueue("bench_flush", senders * 2, workers)
+    scheduler = DeadlineScheduler("bench_debounce", _TimedExecutor(executor, h))
+
+    def on_message(sender):
+        with h.lock:
+            h.due[sender] = time.monotonic() + WINDOW_SEC
+        scheduler.schedule(sender, WINDOW_SEC, h.flush, sender)
+
+    return drive(h, senders, per_sender, on_message)
+
+
+def drive(h, senders, per_sender, on_message):
+    sampler = threading.Thread(target=h.sample_threads, daemon=True)
+    sampler.start()
+
+    # הודעות של כל השולחים משולבות על ציר זמן אחד
+    rng = random.Random(42)
+    events = []
+    for s in range(senders):
+        t = rng.uniform(0, 0.5)
+        for _ in range(per_sender):
+            events.append((t, f"sender-{s}"))
+            t += rng.uniform(*GAP_SEC)
+    events.sort()
+
+    start = time.monotonic()
+    for at, sender in events:
+        delay = start + at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        on_message(sender)
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        with h.lock:
+            if h.flushes >= senders:
+                break
+        time.sleep(0.05)
+
+    h.done.set()
+    sampler.join()
+    return {
+        "flushes": h.flushes,
+        "peak_threads": h.peak_threads,
+        "p50_ms": percentile(h.latencies, 50) * 1000,
+        "p95_ms": percentile(h.latencies, 95) * 1000,
+        "max_ms": max(h.latencies) * 1000 if h.latencies else 0.0,
+        "dispatch_p95_ms": percentile(h.dispatch, 95) * 1000 if h.dispatch else None,
+    }
+
+
+def main():
+    senders = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    per_sender = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+
+    print(f"📊 בנצ'מרק צבירה: {senders} שולחים × {per_sender} הודעות, חלון {WINDOW_SEC}s, "
+          f"flush של {FLUSH_WORK_SEC * 1000:.0f}ms")
+    print("=" * 60)
+    runs = (
+        ("threading.Timer", lambda: run_legacy(senders, per_sender)),
+        (f"Scheduler/{workers}w", lambda: run_scheduler(senders, per_sender, workers)),
+    )
+    for name, fn in runs:
+        r = fn()
+        line = (f"{name:<18} flushes={r['flushes']:<5} peak_threads={r['peak_threads']:<5} "
+                f"flush-start p50={r['p50_ms']:.1f}ms p95={r['p95_ms']:.1f}ms max={r['max_ms']:.1f}ms")
+        if r["dispatch_p95_ms"] is not None:
+            line += f" | dispatch p95={r['dispatch_p95_ms']:.1f}ms"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+בנצ'מרק להתאמת הטקסט המקומפלת (text_matching.py) מול המימושים הקודמים של
+ההיוריסטיקות: ספירת שאלות, ברכה, סיום שיחה, מין, שם ושיפור טקסט לקול.
+כל היוריסטיקה מורצת על כל ההודעות מ-conversations/*.txt (ועל וריאציות שלהן), התוצאות
+מושוות אחת-אחת, וזמן ה-CPU נמדד לכל צד.
+
+הרצה:
+    python benchmark_text_matching.py [rounds]
+
+יוצא עם קוד 1 אם נמצאה אי-התאמה כלשהי.
+"""
+
+import glob
+import os
+import random
+import sys
+import time
+
+import text_matching as tm
+from benchmark_context import parse_transcript
+
+EXTRA_SAMPLES = [
+    "היי, קוראים לי דני ואני בן 30", "שלום לכם! שמי רותי", "אני אישה עם עסק קטן", "קוראים לו משה",
+    "כן", "בסדר", "אוקיי ביי", "מה קורה? אני צריך דף נחיתה", "אני", "לא לא כן כן אבל אולי",
+    "אז מה המחיר? נכון שזה זול! בוא נראה", "תודה רבה, מעולה", "יש לי בעיה עם האתר...",
+    "אז בסדר. אוקיי נתקדם, אבל גם או לא", "😊 מצחיק", "הי", "אני גבר, קוראים לי יוסי",
+]
+
+
+# --- המימושים הקודמים (כפי שהיו ב-chatbot.py / conversation_summaries.py / whatsapp_webhook.py) ---
+
+def legacy_count_questions_in_reply(reply):
+    question_marks = reply.count('?')
+    question_words = ['איך', 'מה', 'איפה', 'מתי', 'למה', 'מי', 'כמה', 'איזה', 'האם']
+    words = reply.split()
+    question_word_count = sum(1 for word in words if any(q_word in word for q_word in question_words))
+    return max(question_marks, question_word_count)
+
+
+def legacy_is_greeting_message(message):
+    message_lower = message.lower().strip()
+    greetings = ['היי', 'הי', 'שלום לך', 'שלום לכם', 'שלום עליכם', 'מה נשמע', 'מה קורה']
+    for greeting in greetings:
+        if message_lower.startswith(greeting) or message_lower == greeting:
+            return True
+    return False
+
+
+def legacy_is_ending(message):
+    user_message_lower = message.lower().strip()
+    for phrase in [" ביי"]:
+        if phrase in user_message_lower:
+            return True
+    return user_message_lower in ["כן", "לא", "אוקיי", "בסדר", "בטח"]
+
+
+def legacy_detect_gender(message):
+    message_lower = message.lower()
+    if any(word in message_lower for word in ["אני גבר", "אני בן", "זכר", "גבר"]):
+        return "זכר"
+    elif any(word in message_lower for word in ["אני אישה", "אני בת", "נקבה", "אישה"]):
+        return "נקבה"
+    return None
+
+
+def legacy_extract_name(message):
+    if "קוראים לי" in message or "שמי" in message or "אני" in message:
+        words = message.split()
+        for i, word in enumerate(words):
+            if word in ["קוראים", "שמי", "אני"] and i + 1 < len(words):
+                return words[i + 1]
+    return None
+
+
+def legacy_enhance_for_voice(text):
+    enhanced_text = text
+    if not any(emoji in text for emoji in ["😊", "😄", "🙂", "😁"]):
+        if len(text) > 50:
+            enhanced_text = enhanced_text + " 😊"
+        else:
+            enhanced_text = "😊 " + enhanced_text
+    happy_transitions = [
+        ("אז", "אז בטח"), ("כן", "כן בהחלט!"), ("לא", "לא, אבל"), ("אבל", "אבל יש לי רעיון טוב!"),
+        ("אוקיי", "אוקיי מעולה!"), ("בסדר", "בסדר גמור!"), ("נכון", "נכון לגמרי!"),
+    ]
+    for old, new in happy_transitions:
+        if f" {old} " in enhanced_text:
+            enhanced_text = enhanced_text.replace(f" {old} ", f" {new} ")
+        elif enhanced_text.startswith(f"{old} "):
+            enhanced_text = enhanced_text.replace(f"{old} ", f"{new} ", 1)
+    if any(word in enhanced_text.lower() for word in ["מצחיק", "הומור", "בדיחה", "צחוק", "מעניין"]):
+        enhanced_text = enhanced_text + " זה באמת מעניין."
+    elif any(word in enhanced_text.lower() for word in ["מעולה", "נהדר", "פנטסטי", "אחלה"]):
+        enhanced_text = enhanced_text + " זה נשמע טוב."
+    elif any(word in enhanced_text.lower() for word in ["בוא נראה", "אולי", "יכול להיות"]):
+        enhanced_text = enhanced_text.replace("בוא נראה", "בוא נראה...")
+        enhanced_text = enhanced_text.replace("אולי", "אולי...")
+        enhanced_text = enhanced_text.replace("יכול להיות", "יכול להיות...")
+    voice_enhancements = [
+        ("!", "."), ("?", "?"), (".", ". "), ("כמובן", "כמובן"), ("בהחלט", "בהחלט"), ("מעולה", "מעולה"),
+        ("נהדר", "נהדר"), ("וואו", "וואו"), ("אמת", "אמת"), ("בטח", "בטח"), ("ברור", "ברור"),
+        ("מאוד", "מאוד"), ("ממש", "ממש"), ("טוב", "טוב"), ("יפה", "יפה"), ("נחמד", "נחמד"), ("מגניב", "מגניב"),
+    ]
+    for old, new in voice_enhancements:
+        enhanced_text = enhanced_text.replace(old, new)
+    if len(enhanced_text) > 100:
+        human_fillers = [
+            (". ", ". אממ... "), (", ", ", נו... "), (" אבל ", " אבל רגע... "),
+            (" גם ", " גם כן... "), (" או ", " או שמא... "),
+        ]
+        if random.random() < 0.3:
+            filler = random.choice(human_fillers)
+            if filler[0] in enhanced_text:
+                enhanced_text = enhanced_text.replace(filler[0], filler[1], 1)
+    if any(word in enhanced_text.lower() for word in ["תעזור", "עזרה", "בעיה", "קושי"]):
+        enhanced_text = enhanced_text + " אני כאן לעזור לך."
+    elif any(word in enhanced_text.lower() for word in ["תודה", "מעולה", "נהדר"]):
+        enhanced_text = enhanced_text + " אני שמחה לעזור."
+    if not enhanced_text.endswith((".", "?", "...")):
+        if "?" in enhanced_text[-10:]:
+            pass
+        else:
+            enhanced_text = enhanced_text + "."
+    return enhanced_text
+
+
+def new_is_ending(message):
+    lowered = message.lower().strip()
+    return tm.ENDING_PHRASES.contains(lowered) or lowered in tm.SHORT_RESPONSES
+
+
+def seeded(fn, seed):
+    """שיפור הטקסט לקול אקראי חלקית - אותו seed לשני הצדדים"""
+    def run(text):
+        random.seed(seed)
+        return fn(text)
+    return run
+
+
+# (שם, מימוש קודם, מימוש חדש, קלטים: user / assistant / הכל)
+CASES = [
+    ("count_questions", legacy_count_questions_in_reply, tm.count_questions, "assistant"),
+    ("is_greeting", legacy_is_greeting_message, tm.is_greeting, "user"),
+    ("ending", legacy_is_ending, new_is_ending, "user"),
+    ("detect_gender", legacy_detect_gender, tm.detect_gender, "user"),
+    ("extract_name", legacy_extract_name, tm.extract_name, "user"),
+    ("enhance_for_voice", seeded(legacy_enhance_for_voice, 7), seeded(tm.enhance_for_voice, 7), "assistant"),
+]
+
+
+def load_messages():
+    messages = {"user": list(EXTRA_SAMPLES), "assistant": list(EXTRA_SAMPLES)}
+    for path in sorted(glob.glob(os.path.join("conversations", "*.txt"))):
+        for m in parse_transcript(path):
+            if m["role"] in messages and m["content"]:
+                messages[m["role"]].append(m["content"])
+    # וריאציות: חיתוך באמצע מילה, רווחים בקצוות, שרשור הודעות
+    for role, texts in messages.items():
+        rng = random.Random(role)
+        extra = []
+        for text in texts:
+            extra.append(" " + text[:rng.randint(1, max(1, len(text)))] + " ")
+            extra.append(text + " " + rng.choice(texts))
+        texts.extend(extra)
+    return messages
+
+
+def timed(fn, inputs, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for text in inputs:
+            fn(text)
+    return time.perf_counter() - started
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    messages = load_messages()
+
+    print(f"📊 בנצ'מרק התאמת טקסט: {len(messages['user'])} הודעות משתמש, "
+          f"{len(messages['assistant'])} תשובות, {rounds} סבבים")
+    print("=" * 78)
+
+    total_mismatches = 0
+    for name, legacy_fn, new_fn, role in CASES:
+        inputs = messages[role]
+        mismatches = [t for t in inputs if legacy_fn(t) != new_fn(t)]
+        total_mismatches += len(mismatches)
+        legacy_sec = timed(legacy_fn, inputs, rounds)
+        new_sec = timed(new_fn, inputs, rounds)
+        calls = len(inputs) * rounds
+        print(f"{name:<18} קודם {legacy_sec * 1e6 / calls:7.2f}µs | מקומפל {new_sec * 1e6 / calls:7.2f}µs | "
+              f"x{legacy_sec / new_sec:4.1f} | אי-התאמות: {len(mismatches)}")
+        for text in mismatches[:3]:
+            print(f"   ❌ {text[:60]!r}: {legacy_fn(text)!r} != {new_fn(text)!r}")
+
+    print("=" * 78)
+    print("✅ תוצאות זהות" if not total_mismatches else f"❌ {total_mismatches} אי-התאמות")
+    if total_mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
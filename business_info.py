@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+היוריסטיקות מידע עסקי (האם נאסף מספיק מידע, מה חסר, האם להתקדם למכירה).
+מילות המפתח שנראו בשיחה נשמרות במצב המצטבר (ConversationState) ומתעדכנות רק מההודעה
+החדשה, במקום לחבר ולסרוק את כל ההיסטוריה בכל סבב.
+"""
+
+from typing import FrozenSet, Iterable, List
+
+# מילות מפתח שמעידות על מידע עסקי - צריך לפחות 3 שונות
+BUSINESS_KEYWORDS = (
+    "עסק", "מוצר", "שירות", "חברה", "חנות", "מטרה", "מכירה",
+    "לקוחות", "לוגו", "תמונות", "עיצוב", "סגנון", "מבדיל", "תחושה"
+)
+MIN_BUSINESS_KEYWORDS = 3
+# מינימום הודעות משתמש לפני שבכלל בודקים
+MIN_USER_MESSAGES = 6
+
+# נושאים שחסרים כל עוד אף אחת ממילות המפתח שלהם לא הופיעה
+MISSING_INFO_TOPICS = (
+    (("עסק", "מוצר", "שירות"), "מה בדיוק העסק שלך עושה"),
+    (("מטרה", "מכירה"), "מה המטרה של הדף - מה אתה רוצה שהלקוחות יעשו"),
+    (("לוגו", "תמונות"), "איזה חומרים יש לך כבר - לוגו, תמונות"),
+    (("עיצוב", "סגנון"), "איזה סגנון עיצוב אתה אוהב"),
+    (("מבדיל", "יתרון"), "מה מבדל אותך מהמתחרים"),
+    (("לקוחות", "גיל"), "מי הלקוחות שלך - גיל, מגדר, תחומי עניין"),
+)
+
+# מילות שמעידות על מוכנות
+READINESS_PHRASES = (
+    "אני מעוניין", "אני רוצה", "אני מוכן", "בוא נתקדם", "אוקיי", "בסדר",
+    "אני אקנה", "אני אתחיל", "בואו נתחיל", "אני מסכים", "זה נשמע טוב"
+)
+
+# כל מילות המפתח שנעקבות במצב המצטבר
+TRACKED_KEYWORDS: FrozenSet[str] = frozenset(BUSINESS_KEYWORDS).union(
+    *(keywords for keywords, _ in MISSING_INFO_TOPICS)
+)
+
+
+def _state_for(conversation_history: list, state):
+    """המצב המצטבר; בלעדיו (קריאה ישירה עם רשימה) נבנה מצב זמני במעבר אחד"""
+    if state is not None:
+        return state
+    from conversation_state import ConversationState
+    return ConversationState.from_messages(conversation_history)
+
+
+def has_enough_business_info(conversation_history: list, state=None) -> bool:
+    """בדוק אם יש מספיק מידע על העסק כדי להתקדם למכירה"""
+    state = _state_for(conversation_history, state)
+    # נדרש לפחות 6 הודעות משתמש כדי לאסוף מידע בסיסי
+    if state.user_count < MIN_USER_MESSAGES:
+        return False
+
+    found_keywords = sum(1 for keyword in BUSINESS_KEYWORDS if keyword in state.keywords_seen)
+    return found_keywords >= MIN_BUSINESS_KEYWORDS
+
+
+def should_proceed_to_sale(conversation_history: list, state=None) -> bool:
+    """בדוק אם אפשר להתקדם למכירה"""
+    state = _state_for(conversation_history, state)
+    # צריך מספיק מידע על העסק
+    if not has_enough_business_info(conversation_history, state):
+        return False
+
+    # בדוק אם המשתמש הביע עניין או מוכנות ב-4 ההודעות האחרונות
+    recent_messages = conversation_history[-4:]
+    user_messages = [msg["content"].lower() for msg in recent_messages if msg["role"] == "user"]
+    return any(phrase in message for message in user_messages for phrase in READINESS_PHRASES)
+
+
+def get_next_action_message(conversation_history: list, state=None) -> str:
+    """קבל הודעה מתאימה לשלב הבא בשיחה"""
+    state = _state_for(conversation_history, state)
+
+    # בדוק אם יש מספיק מידע על העסק
+    if not has_enough_business_info(conversation_history, state):
+        # חסר מידע - המשך לאסוף
+        missing_info = get_missing_business_info(conversation_history, state)
+        return f"אני רוצה לוודא שאני מבין בדיוק מה אתה צריך. {missing_info}"
+
+    # יש מספיק מידע - בדוק אם אפשר להתקדם למכירה
+    if should_proceed_to_sale(conversation_history, state):
+        return "מעולה! יש לי תמונה ברורה של מה שאתה צריך. בואו נסגור את זה?"
+
+    # יש מידע אבל הלקוח לא מוכן - המשך לבנות אמון
+    return "אני רואה שיש לך עסק מעניין. בואו נדבר קצת יותר על איך הדף הזה יעזור לך להשיג את המטרות שלך."
+
+
+def missing_topics(keywords_seen: Iterable[str]) -> List[str]:
+    """תיאורי הנושאים שעוד לא הוזכרו"""
+    seen = set(keywords_seen)
+    return [description for keywords, description in MISSING_INFO_TOPICS
+            if not any(keyword in seen for keyword in keywords)]
+
+
+def get_missing_business_info(conversation_history: list, state=None) -> str:
+    """קבל הודעה על מה חסר מידע"""
+    state = _state_for(conversation_history, state)
+    missing_items = missing_topics(state.keywords_seen)
+
+    if len(missing_items) == 0:
+        return "מעולה! יש לי את כל המידע שאני צריך על העסק שלך."
+    elif len(missing_items) == 1:
+        return f"אני צריך להבין {missing_items[0]}."
+    elif len(missing_items) == 2:
+        return f"אני צריך להבין {missing_items[0]} ו{missing_items[1]}."
+    else:
+        return f"אני צריך להבין עוד כמה דברים: {', '.join(missing_items[:-1])} ו{missing_items[-1]}."
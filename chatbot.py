@@ -1,8 +1,22 @@
 import os
-from openai import OpenAI
+import re
+import time
 from dotenv import load_dotenv
 from datetime import datetime
 
+from metrics import metrics
+from http_clients import http_clients
+from work_queue import BoundedWorkQueue
+from context_builder import ContextBuilder
+from conversation_state import ConversationState
+from conversation_journal import conversation_journal
+from conversation_cache import ConversationCache
+from prompt_registry import PromptRegistry
+from state_backend import state_backend
+from write_behind import WriteBehindFlusher
+from text_matching import count_questions, is_greeting, ENDING_PHRASES, SHORT_RESPONSES
+from business_info import has_enough_business_info, get_next_action_message
+
 # טען משתני סביבה
 load_dotenv()
 
@@ -10,13 +24,59 @@ load_dotenv()
 try:
     OPENAI_API_KEY = os.environ["OPENAI_API_KEY"]
     print("✅ chatbot.py - OPENAI_API_KEY נטען בהצלחה")
-    client = OpenAI(api_key=OPENAI_API_KEY)
+    client = http_clients.openai_client(OPENAI_API_KEY)
 except KeyError as e:
     print(f"❌ שגיאה ב-chatbot.py: משתנה סביבה חסר: {e}")
     raise
 
-# שיחות לכל משתמש (לפי מזהה = מספר טלפון)
-conversations = {}
+CHAT_MODEL = "gpt-5-chat-latest"
+
+# סטרימינג של תשובות GPT: כשהתשובה מתארכת, המשפט/הפסקה הראשונים נשלחים לפני שהיא מסתיימת
+CHAT_STREAMING = os.environ.get("CHAT_STREAMING", "1") == "1"
+STREAM_EARLY_SEND_MIN_CHARS = int(os.environ.get("STREAM_EARLY_SEND_MIN_CHARS", "160"))
+# בדיקת "הגיעו הודעות חדשות" בזמן סטרימינג לכל היותר פעם בכך (עם מאגר משותף כל בדיקה היא שאילתה)
+STREAM_ABORT_CHECK_SEC = float(os.environ.get("STREAM_ABORT_CHECK_SEC", "0.25"))
+
+# הקשר בתקציב טוקנים: פרומפט המערכת + הסבבים האחרונים במלואם, וסיכום מתגלגל במקום הישנים
+CONTEXT_BUDGET_ENABLED = os.environ.get("CONTEXT_BUDGET_ENABLED", "1") == "1"
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "6000"))
+CONTEXT_RECENT_TURNS = int(os.environ.get("CONTEXT_RECENT_TURNS", "6"))
+CONTEXT_COMPACT_THRESHOLD_TOKENS = int(os.environ.get("CONTEXT_COMPACT_THRESHOLD_TOKENS", "800"))
+CONTEXT_COMPACTION_WORKERS = int(os.environ.get("CONTEXT_COMPACTION_WORKERS", "2"))
+
+# שמירת שיחות ברקע: סבב רק מסמן את המשתמש, והיומן נכתב לכל היותר פעם אחת בכל מרווח
+PERSIST_WRITE_BEHIND = os.environ.get("PERSIST_WRITE_BEHIND", "1") == "1"
+PERSIST_FLUSH_INTERVAL_SEC = float(os.environ.get("PERSIST_FLUSH_INTERVAL_SEC", "2"))
+
+# מטמון שיחות חסום: משתמשים בסרק מפונים מהזיכרון ונטענים מחדש מהיומן כשחוזרים
+CONVERSATION_CACHE_MAX_USERS = int(os.environ.get("CONVERSATION_CACHE_MAX_USERS", "5000"))
+CONVERSATION_CACHE_MAX_MB = float(os.environ.get("CONVERSATION_CACHE_MAX_MB", "0"))
+CONVERSATION_CACHE_IDLE_SEC = float(os.environ.get("CONVERSATION_CACHE_IDLE_SEC", str(6 * 3600)))
+CONVERSATION_CACHE_MIN_IDLE_SEC = float(os.environ.get("CONVERSATION_CACHE_MIN_IDLE_SEC", "300"))
+
+# סוף משפט: סימן פיסוק שאחריו רווח/שורה חדשה (כדי לא לחתוך באמצע "1.5" או כתובת אתר)
+_SENTENCE_END = re.compile(r'[.!?…](?=\s)|\n')
+
+# מאגר השיחות: file = יומן מקומי (תהליך יחיד), mongo = wa_conversations משותף לכמה workers/מופעים
+CONVERSATION_STORE = os.environ.get("CONVERSATION_STORE", "file")
+if CONVERSATION_STORE == "mongo":
+    from conversation_store import create_mongo_conversation_store
+    # שיחות שעוד נמצאות רק ביומן המקומי מועתקות ל-Mongo בגישה הראשונה
+    conversation_store = create_mongo_conversation_store(fallback=conversation_journal)
+else:
+    conversation_store = conversation_journal
+
+# שיחות לכל משתמש (לפי מזהה = מספר טלפון) - מטמון חסום שמתנהג כמו מילון;
+# עם מאגר משותף הוא read-through: גם משתמש שתהליך אחר התחיל נטען מהמאגר
+conversations = ConversationCache(
+    loader=lambda user_id: load_conversation_from_json(user_id),
+    before_evict=lambda user_id: _flush_before_evict(user_id),
+    max_users=CONVERSATION_CACHE_MAX_USERS,
+    max_bytes=int(CONVERSATION_CACHE_MAX_MB * 1024 * 1024),
+    idle_sec=CONVERSATION_CACHE_IDLE_SEC,
+    min_idle_sec=CONVERSATION_CACHE_MIN_IDLE_SEC,
+    read_through=conversation_store.shared,
+)
 
 # מעקב אחרי זמני הודעות אחרונות
 last_message_times = {}
@@ -24,14 +84,41 @@ last_message_times = {}
 # מעקב אחרי מספר שאלות לכל משתמש
 question_count = {}
 
+# דגלים לכל משתמש במאגר המצב (בזיכרון, או משותף לכל ה-workers לפי STATE_BACKEND)
 # מעקב אחרי משתמשים שקיבלו הודעת העברה ליועץ
-transferred_to_advisor = {}
+transferred_to_advisor = state_backend.map("transferred_to_advisor")
 
 # מעקב אחרי משתמשים שהגיעו למגבלת ההודעות וקיבלו הודעה על זה
-users_at_message_limit = {}
+users_at_message_limit = state_backend.map("users_at_message_limit")
 
 # בקרה על סיכומי שיחה (מניעת כפילויות והגבלה לסיכום נוסף לאחר המשך)
-summary_control = {}
+summary_control = state_backend.map("summary_control")
+
+# מצב מצטבר לכל משתמש (מונים וזמנים) - מתעדכן בכל הוספת הודעה דרך append_message
+conversation_states = {}
+
+def get_conversation_state(user_id: str) -> ConversationState:
+    """
+    המצב המצטבר של השיחה. אם רשימת ההודעות הוחלפה או שונתה שלא דרך append_message
+    (טעינה מקובץ, שיחה חדשה, ביטול תור) המצב נבנה מחדש פעם אחת.
+    """
+    messages = conversations.get(user_id)
+    if messages is None:
+        return ConversationState()
+    state = conversation_states.get(user_id)
+    if state is None or not state.matches(messages):
+        state = ConversationState.from_messages(messages, question_count.get(user_id, 0),
+                                                prompt_text=prompt_registry.text)
+        conversation_states[user_id] = state
+        metrics.incr("conversation_state.rebuilds")
+    return state
+
+def append_message(user_id: str, role: str, content: str) -> None:
+    """הוספת הודעה להיסטוריה ועדכון המצב המצטבר"""
+    state = get_conversation_state(user_id)
+    conversations[user_id].append({"role": role, "content": content})
+    state.record(role, content)
+    conversations.touch(user_id)
 
 # פונקציה לטעינת הפרומפט מקובץ חיצוני
 def load_system_prompt():
@@ -85,14 +172,16 @@ def load_system_prompt():
         print(f"❌ שגיאה בטעינת הפרומפט: {e}")
         return "שגיאה בטעינת הפרומפט"
 
-# זהות הסוכן - נטען מהקובץ החיצוני
-system_prompt = load_system_prompt()
+# זהות הסוכן - נטען מהקובץ החיצוני; ההיסטוריה מחזיקה רק הפניה לגרסה (נפתרת בבניית הבקשה)
+prompt_registry = PromptRegistry(load_system_prompt)
+system_prompt = prompt_registry.text
 
 def reload_system_prompt():
-    """רענן את הפרומפט מהקובץ החיצוני"""
+    """רענן את הפרומפט מהקובץ החיצוני - חל מיד גם על שיחות קיימות"""
     global system_prompt
-    system_prompt = load_system_prompt()
-    print("✅ הפרומפט רוענן מהקובץ החיצוני")
+    version = prompt_registry.reload()
+    system_prompt = prompt_registry.text
+    print(f"✅ הפרומפט רוענן מהקובץ החיצוני (גרסה {version})")
     return system_prompt
 
 def _build_summary_document(user_id: str, summary_text: str) -> dict:
@@ -104,8 +193,7 @@ def _build_summary_document(user_id: str, summary_text: str) -> dict:
         def _extract_customer_name(*_args, **_kwargs): return ""
         def _detect_customer_gender(*_args, **_kwargs): return "לא ידוע"
 
-    msgs = conversations.get(user_id, [])
-    total_user_msgs = len([m for m in msgs if m.get("role") == "user"])
+    total_user_msgs = get_conversation_state(user_id).user_count
     safe_summary = (summary_text or "").strip()
 
     # נסה לקרוא לפי החתימות הקיימות בקובץ conversation_summaries.py
@@ -130,81 +218,89 @@ def _build_summary_document(user_id: str, summary_text: str) -> dict:
     }
 
 def ensure_system_prompt_for_user(user_id: str) -> None:
-    """ודא שהיסטוריית השיחה למשתמש מתחילה בהודעת system עם ה-agent prompt."""
+    """ודא שהיסטוריית השיחה למשתמש מתחילה בהודעת system שמפנה ל-agent prompt."""
     if user_id not in conversations or not conversations[user_id]:
-        conversations[user_id] = [{"role": "system", "content": system_prompt}]
+        conversations[user_id] = [prompt_registry.reference()]
         return
     first_message = conversations[user_id][0]
     if first_message.get("role") != "system":
-        conversations[user_id].insert(0, {"role": "system", "content": system_prompt})
+        conversations[user_id].insert(0, prompt_registry.reference())
 
-# יצירת תיקייה לשמירת שיחות
+# שמירת שיחה ליומן (append-only) - נכתבות רק ההודעות שנוספו מאז השמירה הקודמת
 def save_conversation_to_file(user_id: str):
-    folder = "conversations"
-    os.makedirs(folder, exist_ok=True)
-
-    filepath = os.path.join(folder, f"{user_id}.txt")
-    with open(filepath, "w", encoding="utf-8-sig") as f:
-        for msg in conversations[user_id]:
-            role = msg["role"].upper()
-            content = msg["content"]
-            
-            # בדוק אם זו הודעת תמונה
-            if "[תמונה]" in content and "🔗 קישור לתמונה:" in content:
-                f.write(f"{role}: {content}\n\n")
-            else:
-                f.write(f"{role}: {content}\n\n")
-    
-    # שמור גם בפורמט JSON לטעינה קלה יותר
-    save_conversation_to_json(user_id)
+    if PERSIST_WRITE_BEHIND and not conversation_store.shared:
+        # התשובה לא מחכה לדיסק; כמה שמירות באותו סבב מתאחדות לכתיבה אחת
+        conversation_persistence.mark_dirty(user_id)
+    else:
+        _persist_conversation(user_id)
 
-def save_conversation_to_json(user_id: str):
-    """שמור שיחה בפורמט JSON לטעינה קלה יותר"""
-    try:
-        import json
-        folder = "conversations"
-        os.makedirs(folder, exist_ok=True)
-        
-        json_filepath = os.path.join(folder, f"{user_id}.json")
-        conversation_data = {
-            "user_id": user_id,
-            "last_updated": datetime.now().isoformat(),
-            "messages": conversations.get(user_id, []),
-            "question_count": question_count.get(user_id, 0)
-        }
-        
-        with open(json_filepath, "w", encoding="utf-8-sig") as f:
-            json.dump(conversation_data, f, ensure_ascii=False, indent=2)
-            
-        print(f"💾 שיחה נשמרה ל-JSON: {user_id}")
-        
-    except Exception as e:
-        print(f"⚠️ שגיאה בשמירת שיחה ל-JSON: {e}")
+def _persist_conversation(user_id: str):
+    """כתיבת השינויים של המשתמש למאגר (מה-thread של השמירה ברקע, או ישירות)"""
+    messages = conversations.peek(user_id)
+    if messages is None:
+        return
+    conversation_store.sync(user_id, messages, question_count.get(user_id, 0))
+    if conversation_store.shared and conversation_store.needs_reload(user_id):
+        # הסבב נוסף אחרי הודעות של תהליך אחר - העותק המקומי מוחלף במסמך המאוחד
+        load_conversation_from_json(user_id)
+
+conversation_persistence = WriteBehindFlusher("persist", _persist_conversation, PERSIST_FLUSH_INTERVAL_SEC)
+
+def _flush_before_evict(user_id: str):
+    """לפני פינוי מהמטמון: כל מה שבזיכרון חייב להיות ביומן"""
+    conversation_persistence.flush(user_id)
+    _persist_conversation(user_id)
+
+def _forget_user_state(user_id: str):
+    """ניקוי המצב הנלווה למשתמש שפונה; מונה השאלות נשמר ביומן ונטען איתו"""
+    for per_user in (question_count, conversation_states, last_message_times):
+        per_user.pop(user_id, None)
+    # במאגר משותף משתחרר רק העותק המקומי
+    for flags in (summary_control, customer_pushnames):
+        flags.forget(user_id)
+    context_builder.forget(user_id)
+    conversation_store.forget(user_id)
+
+conversations.add_evict_listener(_forget_user_state)
 
 def load_conversation_from_json(user_id: str) -> bool:
-    """טען שיחה מקובץ JSON"""
+    """טען שיחה מהמאגר (יומן: snapshot + זנב או קובץ ה-JSON הישן; Mongo: המסמך של המשתמש)"""
     try:
-        import json
-        folder = "conversations"
-        json_filepath = os.path.join(folder, f"{user_id}.json")
-        
-        if not os.path.exists(json_filepath):
+        conversation_data = conversation_store.load(user_id)
+        if conversation_data is None:
             return False
-            
-        with open(json_filepath, "r", encoding="utf-8-sig") as f:
-            conversation_data = json.load(f)
         
         # טען את השיחה
-        conversations[user_id] = conversation_data.get("messages", [])
+        messages = conversation_data.get("messages", [])
         question_count[user_id] = conversation_data.get("question_count", 0)
+        if prompt_registry.normalize(messages):
+            # שיחה ישנה עם הפרומפט המלא - נשמרת מחדש פעם אחת עם הפניה בלבד
+            conversation_store.compact(user_id, messages, question_count[user_id])
+        conversations[user_id] = messages
         
-        print(f"📂 שיחה נטענה מ-JSON: {user_id} ({len(conversations[user_id])} הודעות, {question_count[user_id]} שאלות)")
+        print(f"📂 שיחה נטענה מהמאגר: {user_id} ({len(conversations[user_id])} הודעות, {question_count[user_id]} שאלות)")
         return True
         
     except Exception as e:
-        print(f"⚠️ שגיאה בטעינת שיחה מ-JSON: {e}")
+        print(f"⚠️ שגיאה בטעינת שיחה מהיומן: {e}")
         return False
 
+def refresh_conversation(user_id: str) -> None:
+    """
+    מאגר משותף, בתחילת סבב: אם תהליך אחר הוסיף הודעות מאז שהשיחה נכתבה/נטענה כאן - טען אותה
+    מחדש. משתמש שלא בזיכרון נטען בגישה הבאה גם אם נרשם לו פספוס - ייתכן שתהליך אחר יצר אותו מאז.
+    """
+    if not conversation_store.shared:
+        return
+    if conversations.peek(user_id) is None:
+        conversations.forget_miss(user_id)
+        return
+    known = conversation_store.synced_length(user_id)
+    stored = conversation_store.stored_length(user_id)
+    if known is not None and stored is not None and stored != known:
+        metrics.incr("conversation_store.stale_reloads")
+        load_conversation_from_json(user_id)
+
 def should_continue_existing_conversation(user_id: str) -> bool:
     """בדוק אם צריך להמשיך שיחה קיימת"""
     # אם יש שיחה פעילה בזיכרון - המשך אותה
@@ -215,15 +311,10 @@ def should_continue_existing_conversation(user_id: str) -> bool:
     if load_conversation_from_json(user_id):
         # בדוק אם השיחה לא ישנה מדי (יותר מ-24 שעות)
         try:
-            folder = "conversations"
-            json_filepath = os.path.join(folder, f"{user_id}.json")
-            
-            if os.path.exists(json_filepath):
-                # בדוק מתי הקובץ עודכן לאחרונה
-                import time
-                file_time = os.path.getmtime(json_filepath)
-                current_time = time.time()
-                hours_since_update = (current_time - file_time) / 3600
+            # בדוק מתי השיחה עודכנה לאחרונה
+            file_time = conversation_store.last_updated(user_id)
+            if file_time is not None:
+                hours_since_update = (time.time() - file_time) / 3600
                 
                 # הבוט יזכור שיחות לנצח - ללא הגבלת זמן
                 print(f"🔄 ממשיך שיחה קיימת: {user_id} (עודכנה לפני {hours_since_update:.1f} שעות)")
@@ -236,7 +327,8 @@ def should_continue_existing_conversation(user_id: str) -> bool:
 # סיכום שיחה קצר
 def summarize_conversation(user_id: str) -> str:
     history = conversations.get(user_id, [])
-    text = "\n".join([f"{msg['role']}: {msg['content']}" for msg in history])
+    # בלי פרומפט המערכת - הסיכום לא צריך לשלם על הטוקנים שלו
+    text = "\n".join([f"{msg['role']}: {msg['content']}" for msg in history if msg.get("role") != "system"])
 
     response = client.chat.completions.create(
         model="gpt-5-chat-latest",
@@ -277,11 +369,11 @@ def summarize_conversation(user_id: str) -> str:
 # הפונקציות לחילוץ שם ומין עברו ל-conversation_summaries.py
 
 # משתנה גלובלי לשמירת שמות מ-UltraMsg
-customer_pushnames = {}
+customer_pushnames = state_backend.map("customer_pushnames")
 
 def set_customer_pushname(user_id: str, pushname: str):
     """שמור שם לקוח מ-UltraMsg"""
-    if pushname and pushname.strip():
+    if pushname and pushname.strip() and customer_pushnames.get(user_id) != pushname.strip():
         customer_pushnames[user_id] = pushname.strip()
 
 # שמירת סיכום שיחה עם פרטי לקוח
@@ -308,13 +400,14 @@ def save_conversation_summary(user_id: str, summary: str):
     from conversation_summaries import summaries_manager, extract_customer_name, detect_customer_gender
 
     # ספירת הודעות משתמש עדכנית
-    current_user_msg_count = len([m for m in conversations.get(user_id, []) if m.get("role") == "user"])
+    current_user_msg_count = get_conversation_state(user_id).user_count
 
     # אתחל/טען מצב עבור המשתמש
     state = summary_control.get(user_id)
     if state is None:
         try:
-            existing = summaries_manager.get_summary(user_id)
+            # שדות הבקרה בלבד (summary_count, user_message_count) - בלי טקסט הסיכום
+            existing = summaries_manager.get_summary_meta(user_id)
         except Exception:
             existing = None
         if existing:
@@ -333,46 +426,14 @@ def save_conversation_summary(user_id: str, summary: str):
         print(f"⛔ דילוג על סיכום: אין המשך שיחה מאז הסיכום האחרון עבור {user_id}")
         return
 
-    # שמור בקובץ המקורי
-    folder = "conversations"
-    os.makedirs(folder, exist_ok=True)
-
     # חלץ פרטי לקוח (כולל שם מ-UltraMsg)
     pushname = customer_pushnames.get(user_id, "")
     customer_name = extract_customer_name(user_id, conversations, pushname)
     customer_gender = detect_customer_gender(user_id, conversations)
 
-    # קרא את הקובץ הקיים אם יש
-    filepath = os.path.join(folder, f"{user_id}.txt")
-    existing_content = ""
-    if os.path.exists(filepath):
-        try:
-            with open(filepath, "r", encoding="utf-8-sig") as f:
-                existing_content = f.read()
-        except UnicodeDecodeError:
-            # אם יש בעיה עם הקידוד, ננסה קידוד אחר
-            with open(filepath, "r", encoding="utf-8") as f:
-                existing_content = f.read()
-
-    # הוסף סיכום עם פרטי לקוח
-    summary_section = f"""
-{'='*50}
-📋 סיכום שיחה
-{'='*50}
-📱 מספר טלפון: {user_id}
-👤 שם לקוח: {customer_name}
-👥 מין: {customer_gender}
-📅 תאריך: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-{'='*50}
-
-{summary_data.get('summary','')}
-
-{'='*50}
-"""
-
-    # שמור הכל לקובץ
-    with open(filepath, "w", encoding="utf-8-sig") as f:
-        f.write(existing_content + summary_section)
+    # רשומת סיכום ביומן (תוצג בקובץ ה-txt אחרי ההודעה האחרונה הנוכחית)
+    conversation_store.append_summary(user_id, summary_data.get('summary',''), customer_name,
+                                      customer_gender, len(conversations.get(user_id, [])))
 
     # שמור במסד הנתונים (MongoDB) עם מסמך יציב שמכיל תמיד "summary"
     try:
@@ -386,14 +447,17 @@ def save_conversation_summary(user_id: str, summary: str):
             print(f"[save_conversation_summary] saved OK for {user_id}")
     except Exception as e:
         print(f"⚠️ טעינת mongodb_manager נכשלה: {e}")
+    # המסמך השתנה - "אין סיכום" (או summary_count ישן) במטמון כבר לא נכון
+    summaries_manager.invalidate_summary_status(user_id)
 
     # שמור במערכת הסיכומים (תעד user_message_count ו-summary_count)
     try:
         # ודא שהמחרוזת שנשמרת במערכות הנלוות היא זו מתוך summary_data
-        summaries_manager.add_summary(user_id, summary_data.get('summary',''), conversations, pushname)
-        # עדכן מצב בקרת סיכומים
-        summary_control[user_id]["count"] = state.get("count", 0) + 1
-        summary_control[user_id]["user_msg_count_at_last"] = current_user_msg_count
+        summaries_manager.add_summary(user_id, summary_data.get('summary',''), conversations, pushname,
+                                      state=get_conversation_state(user_id))
+        # עדכן מצב בקרת סיכומים (הצבה מחדש - כך שגם מאגר משותף מתעדכן)
+        summary_control[user_id] = {"count": state.get("count", 0) + 1,
+                                    "user_msg_count_at_last": current_user_msg_count}
         print(f"✅ סיכום נשמר עבור {customer_name} ({user_id})")
         # לוג הצלחה עם מספר התווים בסיכום
         try:
@@ -410,8 +474,7 @@ def is_user_at_limit(user_id: str) -> bool:
         return False
     
     # ספור רק הודעות משתמש וסוכן (לא system)
-    user_assistant_messages = [m for m in conversations[user_id] if m["role"] in ["user", "assistant"]]
-    return len(user_assistant_messages) >= 100
+    return get_conversation_state(user_id).total_messages >= 100
 
 # בדיקה אם עבר זמן רב מההודעה האחרונה
 # פונקציה זו עברה ל-whatsapp_webhook.py
@@ -430,21 +493,14 @@ def should_end_conversation_naturally(user_message: str, conversation_history: l
     """בדוק אם השיחה צריכה להסתיים באופן טבעי"""
     user_message_lower = user_message.lower().strip()
     
-    # מילות סיום מפורשות - רק ביטויים ברורים מאוד
-    ending_phrases = [
-     " ביי"
-    ]
-    
     # בדוק אם יש ביטוי סיום מפורש
-    for phrase in ending_phrases:
-        if phrase in user_message_lower:
-            return True
+    if ENDING_PHRASES.contains(user_message_lower):
+        return True
     
     # בדוק אם השיחה ארוכה מאוד (יותר מ-40 הודעות) ויש סימנים של סיום
     if len(conversation_history) > 40:
         # אם המשתמש נותן תשובות קצרות מאוד ברציפות
-        short_responses = ["כן", "לא", "אוקיי", "בסדר", "בטח"]
-        if user_message_lower in short_responses:
+        if user_message_lower in SHORT_RESPONSES:
             # בדוק אם היו 4 תשובות קצרות ברציפות (במקום 3)
             recent_user_messages = [
                 msg["content"].lower().strip() 
@@ -452,7 +508,7 @@ def should_end_conversation_naturally(user_message: str, conversation_history: l
                 if msg["role"] == "user"
             ]
             if len(recent_user_messages) >= 4 and all(
-                msg in short_responses or len(msg) < 5 
+                msg in SHORT_RESPONSES or len(msg) < 5 
                 for msg in recent_user_messages[-4:]
             ):
                 return True
@@ -465,110 +521,11 @@ def should_end_conversation_abruptly(user_message: str, conversation_history: li
     # מבוטל זמנית כדי למנוע סגירת שיחות מיותרות
     return False
 
-def has_enough_business_info(conversation_history: list) -> bool:
-    """בדוק אם יש מספיק מידע על העסק כדי להתקדם למכירה"""
-    # נדרש לפחות 6 הודעות משתמש כדי לאסוף מידע בסיסי
-    user_messages = [msg for msg in conversation_history if msg["role"] == "user"]
-    if len(user_messages) < 6:
-        return False
-    
-    # בדוק אם השיחה מכילה מידע על העסק
-    conversation_text = " ".join([msg["content"].lower() for msg in conversation_history])
-    
-    # מילות מפתח שמעידות על מידע עסקי
-    business_keywords = [
-        "עסק", "מוצר", "שירות", "חברה", "חנות", "מטרה", "מכירה", 
-        "לקוחות", "לוגו", "תמונות", "עיצוב", "סגנון", "מבדיל", "תחושה"
-    ]
-    
-    # צריך לפחות 3 מילות מפתח שונות
-    found_keywords = sum(1 for keyword in business_keywords if keyword in conversation_text)
-    
-    return found_keywords >= 3
-
-def should_proceed_to_sale(conversation_history: list) -> bool:
-    """בדוק אם אפשר להתקדם למכירה"""
-    # צריך מספיק מידע על העסק
-    if not has_enough_business_info(conversation_history):
-        return False
-    
-    # בדוק אם המשתמש הביע עניין או מוכנות
-    recent_messages = conversation_history[-4:]  # 4 ההודעות האחרונות
-    user_messages = [msg["content"].lower() for msg in recent_messages if msg["role"] == "user"]
-    
-    # מילות שמעידות על מוכנות
-    readiness_phrases = [
-        "אני מעוניין", "אני רוצה", "אני מוכן", "בוא נתקדם", "אוקיי", "בסדר",
-        "אני אקנה", "אני אתחיל", "בואו נתחיל", "אני מסכים", "זה נשמע טוב"
-    ]
-    
-    for message in user_messages:
-        for phrase in readiness_phrases:
-            if phrase in message:
-                return True
-    
-    return False
-
-def get_next_action_message(conversation_history: list) -> str:
-    """קבל הודעה מתאימה לשלב הבא בשיחה"""
-    
-    # בדוק אם יש מספיק מידע על העסק
-    if not has_enough_business_info(conversation_history):
-        # חסר מידע - המשך לאסוף
-        missing_info = get_missing_business_info(conversation_history)
-        return f"אני רוצה לוודא שאני מבין בדיוק מה אתה צריך. {missing_info}"
-    
-    # יש מספיק מידע - בדוק אם אפשר להתקדם למכירה
-    if should_proceed_to_sale(conversation_history):
-        return "מעולה! יש לי תמונה ברורה של מה שאתה צריך. בואו נסגור את זה?"
-    
-    # יש מידע אבל הלקוח לא מוכן - המשך לבנות אמון
-    return "אני רואה שיש לך עסק מעניין. בואו נדבר קצת יותר על איך הדף הזה יעזור לך להשיג את המטרות שלך."
-
-def get_missing_business_info(conversation_history: list) -> str:
-    """קבל הודעה על מה חסר מידע"""
-    conversation_text = " ".join([msg["content"].lower() for msg in conversation_history])
-    
-    missing_items = []
-    
-    if "עסק" not in conversation_text and "מוצר" not in conversation_text and "שירות" not in conversation_text:
-        missing_items.append("מה בדיוק העסק שלך עושה")
-    
-    if "מטרה" not in conversation_text and "מכירה" not in conversation_text:
-        missing_items.append("מה המטרה של הדף - מה אתה רוצה שהלקוחות יעשו")
-    
-    if "לוגו" not in conversation_text and "תמונות" not in conversation_text:
-        missing_items.append("איזה חומרים יש לך כבר - לוגו, תמונות")
-    
-    if "עיצוב" not in conversation_text and "סגנון" not in conversation_text:
-        missing_items.append("איזה סגנון עיצוב אתה אוהב")
-    
-    if "מבדיל" not in conversation_text and "יתרון" not in conversation_text:
-        missing_items.append("מה מבדל אותך מהמתחרים")
-    
-    if "לקוחות" not in conversation_text and "גיל" not in conversation_text:
-        missing_items.append("מי הלקוחות שלך - גיל, מגדר, תחומי עניין")
-    
-    if len(missing_items) == 0:
-        return "מעולה! יש לי את כל המידע שאני צריך על העסק שלך."
-    elif len(missing_items) == 1:
-        return f"אני צריך להבין {missing_items[0]}."
-    elif len(missing_items) == 2:
-        return f"אני צריך להבין {missing_items[0]} ו{missing_items[1]}."
-    else:
-        return f"אני צריך להבין עוד כמה דברים: {', '.join(missing_items[:-1])} ו{missing_items[-1]}."
+# היוריסטיקות המידע העסקי עברו ל-business_info.py (מבוססות על המצב המצטבר של השיחה)
 
 def count_questions_in_reply(reply: str) -> int:
-    """ספור כמה שאלות יש בתגובה של הבוט"""
-    question_marks = reply.count('?')
-    question_words = ['איך', 'מה', 'איפה', 'מתי', 'למה', 'מי', 'כמה', 'איזה', 'האם']
-    
-    # ספור שאלות לפי מילות שאלה
-    words = reply.split()
-    question_word_count = sum(1 for word in words if any(q_word in word for q_word in question_words))
-    
-    # החזר את המקסימום בין סימני שאלה למילות שאלה
-    return max(question_marks, question_word_count)
+    """ספור כמה שאלות יש בתגובה של הבוט (המקסימום בין סימני שאלה למילים עם מילת שאלה)"""
+    return count_questions(reply)
 
 def should_transfer_to_advisor(user_id: str) -> bool:
     """בדוק אם צריך להעביר ליועץ - מינימום 5 הודעות משתמש + שעה ללא הודעות"""
@@ -580,8 +537,7 @@ def should_transfer_to_advisor(user_id: str) -> bool:
         return False
     
     # ספור הודעות משתמש
-    user_messages = [m for m in conversations[user_id] if m["role"] == "user"]
-    if len(user_messages) < 5:
+    if get_conversation_state(user_id).user_count < 5:
         return False
     
     # בדוק אם עבר יותר משעה מההודעה האחרונה
@@ -608,18 +564,169 @@ def check_and_summarize_old_conversations():
 # פונקציית שיחה
 def is_greeting_message(message: str) -> bool:
     """בדוק אם זו הודעת פתיחה עם שלום"""
-    message_lower = message.lower().strip()
-    greetings = ['היי', 'הי', 'שלום לך', 'שלום לכם', 'שלום עליכם', 'מה נשמע', 'מה קורה']
-    # בדוק אם ההודעה מתחילה עם ברכה או מכילה רק ברכה
-    for greeting in greetings:
-        if message_lower.startswith(greeting) or message_lower == greeting:
-            return True
-    
-    return False
+    return is_greeting(message)
 
 
 
-def chat_with_gpt(user_message: str, user_id: str = "default") -> str:
+def summarize_for_context(previous_summary: str, messages: list) -> str:
+    """עדכון הסיכום המתגלגל של ההקשר עם הודעות שיצאו מחלון הסבבים האחרונים"""
+    text = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    response = client.chat.completions.create(
+        model=CHAT_MODEL,
+        messages=[
+            {"role": "system", "content": (
+                "אתה מתחזק זיכרון קצר של שיחת מכירה בוואטסאפ. "
+                "עדכן את הסיכום הקיים עם ההודעות החדשות. שמור כל עובדה על הלקוח והעסק "
+                "(שם, תחום, מטרת הדף, פרטי קשר, חומרים, סגנון, התנגדויות, מה כבר נשאל ונענה). "
+                "כתוב בעברית, בנקודות קצרות, בלי הקדמות."
+            )},
+            {"role": "user", "content": f"סיכום קיים:\n{previous_summary or '(אין)'}\n\nהודעות חדשות:\n{text}"}
+        ]
+    )
+    return response.choices[0].message.content
+
+context_builder = ContextBuilder(
+    token_budget=CONTEXT_TOKEN_BUDGET,
+    recent_turns=CONTEXT_RECENT_TURNS,
+    compact_threshold_tokens=CONTEXT_COMPACT_THRESHOLD_TOKENS,
+    summarize_fn=summarize_for_context,
+    executor=BoundedWorkQueue("context_compaction", 500, CONTEXT_COMPACTION_WORKERS),
+)
+
+def build_request_messages(user_id: str) -> list:
+    """ההודעות שנשלחות ל-GPT: כל ההיסטוריה, או הקשר בתקציב טוקנים כשהאפשרות פעילה"""
+    history = prompt_registry.resolve(conversations[user_id])
+    if not CONTEXT_BUDGET_ENABLED:
+        return history
+    return context_builder.build(user_id, history)
+
+def find_early_send_point(text: str) -> int:
+    """
+    נקודת החיתוך לשליחה מוקדמת: סוף הפסקה הראשונה אם כבר הגיעה, אחרת סוף המשפט הראשון.
+    מחזיר -1 אם עוד אין משפט שלם.
+    """
+    paragraph_end = text.find("\n\n")
+    if paragraph_end > 0:
+        return paragraph_end
+    match = _SENTENCE_END.search(text)
+    return match.end() if match else -1
+
+class TurnSuperseded(Exception):
+    """המשתמש שלח הודעות חדשות לפני שהתשובה נשלחה - התור בוטל וההודעות יאוחדו לתור הבא"""
+
+def complete_reply(user_id: str, on_early_chunk=None, should_abort=None) -> str:
+    """
+    בקשת השלמה מ-GPT על היסטוריית המשתמש והחזרת התשובה המלאה.
+    במצב סטרימינג, כשהתשובה עוברת STREAM_EARLY_SEND_MIN_CHARS התווים הראשונים שלמים
+    (משפט/פסקה ראשונים) מועברים ל-on_early_chunk לפני שהתשובה מסתיימת.
+    should_abort - אופציונלי: כל עוד שום חלק לא נשלח, אם הוא מחזיר True נזרק TurnSuperseded
+    (לפני הבקשה = קריאה שנחסכה, באמצע/בסוף = קריאה מבוזבזת).
+    זמן עד הטוקן הראשון נמדד ב-llm.ttfb_sec, וזמן התשובה המלאה ב-llm.total_sec.
+    """
+    if should_abort and should_abort():
+        metrics.incr("llm.calls_saved")
+        raise TurnSuperseded()
+
+    started = time.time()
+
+    if not CHAT_STREAMING:
+        response = client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=build_request_messages(user_id)
+        )
+        # בלי סטרימינג הבייט הראשון מגיע יחד עם התשובה המלאה
+        elapsed = time.time() - started
+        metrics.observe("llm.ttfb_sec", elapsed)
+        metrics.observe("llm.total_sec", elapsed)
+        if should_abort and should_abort():
+            metrics.incr("llm.calls_wasted")
+            raise TurnSuperseded()
+        return response.choices[0].message.content
+
+    stream = client.chat.completions.create(
+        model=CHAT_MODEL,
+        messages=build_request_messages(user_id),
+        stream=True
+    )
+
+    parts = []
+    buffered = 0
+    early_sent = False
+    cancelled = False
+    abort_checked_at = started
+    try:
+        for chunk in stream:
+            # כל עוד לא נשלח כלום ללקוח אפשר לוותר על התשובה ולחסוך את שאר הטוקנים
+            if should_abort and not early_sent and time.time() - abort_checked_at >= STREAM_ABORT_CHECK_SEC:
+                abort_checked_at = time.time()
+                if should_abort():
+                    cancelled = True
+                    break
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            if not parts:
+                ttfb = time.time() - started
+                metrics.observe("llm.ttfb_sec", ttfb)
+                print(f"⚡ טוקן ראשון מ-GPT עבור {user_id} אחרי {ttfb:.2f} שניות")
+            parts.append(delta)
+            buffered += len(delta)
+
+            # שליחה מוקדמת רק כשהתשובה ארוכה - תשובה קצרה יוצאת בשלמותה
+            if on_early_chunk and not early_sent and buffered >= STREAM_EARLY_SEND_MIN_CHARS:
+                text = "".join(parts)
+                cut = find_early_send_point(text)
+                if cut > 0 and should_abort and should_abort():
+                    # בדיקה אחרונה לפני שמשהו יוצא ללקוח (הבדיקות בלולאה מדוללות)
+                    cancelled = True
+                    break
+                if cut > 0:
+                    early_sent = True
+                    metrics.incr("llm.early_chunks")
+                    on_early_chunk(text[:cut].rstrip())
+    except Exception as e:
+        if not early_sent:
+            raise
+        # חלק מהתשובה כבר נשלח ללקוח - נשמור את מה שהתקבל כדי שההיסטוריה תתאים למה שראה
+        print(f"⚠️ הסטרימינג נקטע אחרי שליחה מוקדמת עבור {user_id}: {e}")
+        metrics.incr("llm.stream_errors")
+
+    if cancelled or (should_abort and not early_sent and should_abort()):
+        if cancelled:
+            metrics.incr("llm.calls_cancelled")
+            close = getattr(stream, "close", None)
+            if close:
+                close()
+        metrics.incr("llm.calls_wasted")
+        print(f"✂️ תשובה ל-{user_id} בוטלה - הגיעו הודעות חדשות לפני השליחה")
+        raise TurnSuperseded()
+
+    metrics.observe("llm.total_sec", time.time() - started)
+    return "".join(parts)
+
+def chat_with_gpt(user_message: str, user_id: str = "default", on_early_chunk=None, should_abort=None) -> str:
+    """
+    on_early_chunk - אופציונלי: נקרא פעם אחת עם המשפט/הפסקה הראשונים של תשובה ארוכה (במצב סטרימינג).
+    should_abort - אופציונלי: אם מחזיר True לפני שנשלח משהו, התור מבוטל, הודעת המשתמש מוסרת
+    מההיסטוריה ונזרק TurnSuperseded (הקורא מחזיר את ההודעות למאגר כדי שיאוחדו לתור הבא).
+    הערך המוחזר הוא תמיד התשובה המלאה, שנשמרת בהיסטוריה ובקובץ.
+    """
+    refresh_conversation(user_id)
+    existed = user_id in conversations
+    history_before = list(conversations[user_id]) if existed and should_abort else None
+    try:
+        return _run_chat_turn(user_message, user_id, on_early_chunk, should_abort)
+    except TurnSuperseded:
+        # החזר את ההיסטוריה למצב שלפני התור (במקום - אותו אובייקט רשימה)
+        if existed:
+            conversations[user_id][:] = history_before
+        else:
+            conversations.pop(user_id, None)
+        raise
+
+def _run_chat_turn(user_message: str, user_id: str, on_early_chunk=None, should_abort=None) -> str:
     # בדיקת שיחות ישנות נעשית אוטומטית ב-whatsapp_webhook.py
     # כל 30 דקות ושעה
     # ודא שפרומפט המערכת קיים בראש ההיסטוריה
@@ -632,11 +739,11 @@ def chat_with_gpt(user_message: str, user_id: str = "default") -> str:
         
         # הוסף הודעה שמאשרת המשך השיחה
         if user_id not in conversations:
-            conversations[user_id] = [{"role": "system", "content": system_prompt}]
+            conversations[user_id] = [prompt_registry.reference()]
         
-        conversations[user_id].append({"role": "user", "content": user_message})
+        append_message(user_id, "user", user_message)
         continue_response = "אוקיי, אני כאן להמשיך לעזור לך! מה עוד אתה רוצה לדעת על דף הנחיתה?"
-        conversations[user_id].append({"role": "assistant", "content": continue_response})
+        append_message(user_id, "assistant", continue_response)
         save_conversation_to_file(user_id)
         return continue_response
     
@@ -667,46 +774,36 @@ def chat_with_gpt(user_message: str, user_id: str = "default") -> str:
             # השיחה נטענה - תן הודעה שמתאימה להמשך השיחה
             if is_greeting_message(user_message):
                 # אם הלקוח מתחיל עם שלום אבל יש שיחה קיימת - תן לGPT לטפל בזה
-                conversations[user_id].append({"role": "user", "content": user_message})
+                append_message(user_id, "user", user_message)
                 
                 # שלח ל-GPT לקבלת תגובה מותאמת אישית במקום טמפלייט קבוע
-                response = client.chat.completions.create(
-                    model="gpt-5-chat-latest",
-                    messages=conversations[user_id]
-                )
-                
-                personalized_response = response.choices[0].message.content
-                conversations[user_id].append({"role": "assistant", "content": personalized_response})
+                personalized_response = complete_reply(user_id, on_early_chunk, should_abort)
+                append_message(user_id, "assistant", personalized_response)
                 save_conversation_to_file(user_id)
                 return personalized_response
         else:
             # התחל שיחה חדשה
-            conversations[user_id] = [{"role": "system", "content": system_prompt}]
+            conversations[user_id] = [prompt_registry.reference()]
             
             # בשיחה חדשה, תמיד שלח את ההודעה הראשונה ל-GPT לתגובה מותאמת
-            conversations[user_id].append({"role": "user", "content": user_message})
+            append_message(user_id, "user", user_message)
             
             # שלח ל-GPT לקבלת תגובה מותאמת אישית להודעה הראשונה
-            response = client.chat.completions.create(
-                model="gpt-5-chat-latest",
-                messages=conversations[user_id]
-            )
-            
-            personalized_response = response.choices[0].message.content
-            conversations[user_id].append({"role": "assistant", "content": personalized_response})
+            personalized_response = complete_reply(user_id, on_early_chunk, should_abort)
+            append_message(user_id, "assistant", personalized_response)
             save_conversation_to_file(user_id)
             return personalized_response
 
     # הוסף הודעת משתמש
     ensure_system_prompt_for_user(user_id)
-    conversations[user_id].append({"role": "user", "content": user_message})
+    append_message(user_id, "user", user_message)
     
     # עדכון זמן הודעה אחרונה נעשה ב-whatsapp_webhook.py
     
     # בדוק אם השיחה צריכה להסתיים באופן טבעי
     if should_end_conversation_naturally(user_message, conversations[user_id]):
         # בדוק אם יש מספיק מידע על העסק
-        if has_enough_business_info(conversations[user_id]):
+        if has_enough_business_info(conversations[user_id], get_conversation_state(user_id)):
             summary = summarize_conversation(user_id)
             save_conversation_summary(user_id, summary)
             save_conversation_to_file(user_id)
@@ -718,7 +815,7 @@ def chat_with_gpt(user_message: str, user_id: str = "default") -> str:
             )
         else:
             # אם אין מספיק מידע, אל תסיים את השיחה - תן הודעה מתאימה
-            return get_next_action_message(conversations[user_id])
+            return get_next_action_message(conversations[user_id], get_conversation_state(user_id))
     
     # בדוק אם השיחה נעצרה פתאום
     if should_end_conversation_abruptly(user_message, conversations[user_id]):
@@ -733,7 +830,7 @@ def chat_with_gpt(user_message: str, user_id: str = "default") -> str:
         )
 
     # בדיקה אם עברנו את מגבלת ההודעות
-    total_messages = len([m for m in conversations[user_id] if m["role"] in ["user", "assistant"]])
+    total_messages = get_conversation_state(user_id).total_messages
     if total_messages >= 100:
         summary = summarize_conversation(user_id)
         save_conversation_summary(user_id, summary)
@@ -761,12 +858,7 @@ def chat_with_gpt(user_message: str, user_id: str = "default") -> str:
         )
 
     # שלח ל־GPT
-    response = client.chat.completions.create(
-        model="gpt-5-chat-latest",
-        messages=conversations[user_id]
-    )
-
-    reply = response.choices[0].message.content
+    reply = complete_reply(user_id, on_early_chunk, should_abort)
 
     # ספור שאלות בתגובה של הבוט ועדכן מונה
     questions_in_reply = count_questions_in_reply(reply)
@@ -774,10 +866,11 @@ def chat_with_gpt(user_message: str, user_id: str = "default") -> str:
         if user_id not in question_count:
             question_count[user_id] = 0
         question_count[user_id] += questions_in_reply
+        get_conversation_state(user_id).question_total = question_count[user_id]
         print(f"🔢 ספרתי {questions_in_reply} שאלות עבור {user_id}. סה\"כ: {question_count[user_id]}")
 
     # הוסף תגובת הסוכן להיסטוריה
-    conversations[user_id].append({"role": "assistant", "content": reply})
+    append_message(user_id, "assistant", reply)
 
     # שמור את השיחה לקובץ
     save_conversation_to_file(user_id)
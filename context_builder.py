@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+בניית הקשר ל-GPT בתקציב טוקנים: פרומפט המערכת ו-N הסבבים האחרונים נשמרים כמו שהם,
+וסבבים ישנים יותר מוחלפים בסיכום מתגלגל שמתעדכן ברקע (לא בזמן המענה).
+"""
+
+import math
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from metrics import metrics
+
+# tiktoken אופציונלי - בלעדיו משתמשים בהערכה לפי אורך
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+    TIKTOKEN_AVAILABLE = True
+except Exception:
+    _ENCODING = None
+    TIKTOKEN_AVAILABLE = False
+
+# תקורה קבועה לכל הודעה (role, מפרידים) לפי פורמט ה-chat
+MESSAGE_OVERHEAD_TOKENS = 4
+# הערכה גסה לעברית מעורבת: בערך 3 תווים לטוקן
+CHARS_PER_TOKEN = 3.0
+
+SUMMARY_HEADER = "סיכום החלק המוקדם של השיחה (הודעות ישנות הוחלפו בסיכום הזה):\n"
+
+
+def estimate_tokens(text: str) -> int:
+    """מספר טוקנים (מדויק עם tiktoken, אחרת הערכה לפי תווים)"""
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return int(math.ceil(len(text) / CHARS_PER_TOKEN))
+
+
+def message_tokens(message: Dict) -> int:
+    """טוקנים של הודעה בודדת כולל תקורה"""
+    return estimate_tokens(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS
+
+
+def count_tokens(messages: List[Dict]) -> int:
+    """סך הטוקנים של רשימת הודעות"""
+    return sum(message_tokens(m) for m in messages)
+
+
+class ContextBuilder:
+    def __init__(self, token_budget: int, recent_turns: int, compact_threshold_tokens: int,
+                 summarize_fn: Callable[[str, List[Dict]], str], executor=None):
+        """
+        token_budget - תקרת טוקנים לבקשה (פרומפט המערכת והסבבים האחרונים לא נחתכים).
+        recent_turns - כמה סבבים (משתמש+סוכן) אחרונים נשלחים תמיד במלואם.
+        compact_threshold_tokens - כמה טוקנים ישנים שעוד לא סוכמו מפעילים דחיסה ברקע.
+        summarize_fn(previous_summary, messages) - מחזיר סיכום מעודכן.
+        executor - תור עם submit(fn, *args); בלעדיו הדחיסה רצה ב-thread נפרד.
+        """
+        self.token_budget = token_budget
+        self.recent_turns = recent_turns
+        self.compact_threshold_tokens = compact_threshold_tokens
+        self.summarize_fn = summarize_fn
+        self.executor = executor
+        self._lock = threading.Lock()
+        # user_id -> {"text": סיכום, "covered": כמה הודעות מההיסטוריה הוא מכסה, "anchor": ההודעה האחרונה שכוסתה}
+        self._summaries: Dict[str, Dict] = {}
+        self._pending = set()
+
+        metrics.register_gauge("context.summaries", lambda: len(self._summaries))
+        metrics.register_gauge("context.compactions_pending", lambda: len(self._pending))
+
+    def build(self, user_id: str, history: List[Dict]) -> List[Dict]:
+        """רשימת ההודעות שנשלחת ל-GPT עבור ההיסטוריה הנוכחית של המשתמש"""
+        if not history:
+            return []
+
+        pinned = [history[0]] if history[0].get("role") == "system" else []
+        body_start = len(pinned)
+        recent_start = max(body_start, self._recent_start(history, body_start))
+
+        summary = self._valid_summary(user_id, history)
+        covered = body_start
+        if summary and summary["covered"] <= recent_start:
+            covered = summary["covered"]
+
+        older = history[covered:recent_start]
+        recent = history[recent_start:]
+
+        head = list(pinned)
+        if summary and covered > body_start:
+            head.append({"role": "system", "content": SUMMARY_HEADER + summary["text"]})
+
+        # הודעות ישנות שעוד לא סוכמו נכנסות כל עוד יש מקום; החדשות מביניהן קודמות
+        budget_left = self.token_budget - count_tokens(head) - count_tokens(recent)
+        kept_older: List[Dict] = []
+        for message in reversed(older):
+            cost = message_tokens(message)
+            if cost > budget_left:
+                break
+            kept_older.append(message)
+            budget_left -= cost
+        kept_older.reverse()
+
+        dropped = len(older) - len(kept_older)
+        if dropped:
+            metrics.incr("context.dropped_messages", dropped)
+
+        messages = head + kept_older + recent
+        tokens = count_tokens(messages)
+        metrics.observe("context.tokens_per_request", tokens)
+        metrics.observe("context.full_history_tokens", count_tokens(history))
+
+        if count_tokens(older) >= self.compact_threshold_tokens:
+            self._schedule_compaction(user_id, history, covered, recent_start)
+
+        return messages
+
+    def summary_for(self, user_id: str) -> Optional[str]:
+        """הסיכום המתגלגל הנוכחי של המשתמש (אם יש)"""
+        with self._lock:
+            entry = self._summaries.get(user_id)
+            return entry["text"] if entry else None
+
+    def forget(self, user_id: str) -> None:
+        """מחיקת הסיכום המתגלגל (למשל כשהשיחה מתחילה מחדש)"""
+        with self._lock:
+            self._summaries.pop(user_id, None)
+
+    def compact_now(self, user_id: str, history: List[Dict]) -> None:
+        """דחיסה סינכרונית של כל מה שמחוץ לסבבים האחרונים (לבנצ'מרק/כלי ניהול)"""
+        body_start = 1 if history and history[0].get("role") == "system" else 0
+        recent_start = self._recent_start(history, body_start)
+        summary = self._valid_summary(user_id, history)
+        covered = summary["covered"] if summary else body_start
+        if recent_start > covered:
+            self._compact(user_id, list(history[:recent_start]), covered, recent_start)
+
+    def _recent_start(self, history: List[Dict], body_start: int) -> int:
+        """אינדקס תחילת N הסבבים האחרונים (סבב מתחיל בהודעת משתמש)"""
+        turns = 0
+        idx = len(history)
+        for i in range(len(history) - 1, body_start - 1, -1):
+            if history[i].get("role") == "user":
+                turns += 1
+                idx = i
+                if turns >= self.recent_turns:
+                    break
+        return idx
+
+    def _valid_summary(self, user_id: str, history: List[Dict]) -> Optional[Dict]:
+        """הסיכום השמור, רק אם הוא עדיין מתאים להיסטוריה (לא התחילה שיחה חדשה)"""
+        with self._lock:
+            entry = self._summaries.get(user_id)
+            if not entry:
+                return None
+            covered = entry["covered"]
+            if covered > len(history) or history[covered - 1].get("content") != entry["anchor"]:
+                # ההיסטוריה הוחלפה/אופסה - הסיכום כבר לא רלוונטי
+                self._summaries.pop(user_id, None)
+                metrics.incr("context.summary_invalidated")
+                return None
+            return entry
+
+    def _schedule_compaction(self, user_id: str, history: List[Dict], covered: int, upto: int) -> None:
+        with self._lock:
+            if user_id in self._pending:
+                return
+            self._pending.add(user_id)
+
+        # צילום ההודעות עכשיו - ההיסטוריה ממשיכה לגדול במקביל
+        snapshot = list(history[:upto])
+        if self.executor is not None:
+            if self.executor.submit(self._compact, user_id, snapshot, covered, upto):
+                return
+            with self._lock:
+                self._pending.discard(user_id)
+            return
+        threading.Thread(target=self._compact, args=(user_id, snapshot, covered, upto), daemon=True).start()
+
+    def _compact(self, user_id: str, snapshot: List[Dict], covered: int, upto: int) -> None:
+        started = time.time()
+        try:
+            previous = self.summary_for(user_id) or ""
+            new_messages = [m for m in snapshot[covered:upto] if m.get("role") in ("user", "assistant")]
+            if not new_messages:
+                return
+            text = self.summarize_fn(previous, new_messages)
+            if not text:
+                return
+            with self._lock:
+                entry = self._summaries.get(user_id)
+                # דחיסה מקבילה/ישנה יותר לא דורסת סיכום שמכסה יותר
+                if entry and entry["covered"] >= upto:
+                    return
+                self._summaries[user_id] = {
+                    "text": text.strip(),
+                    "covered": upto,
+                    "anchor": snapshot[upto - 1].get("content"),
+                }
+            metrics.incr("context.compactions")
+            metrics.observe("context.compaction_sec", time.time() - started)
+            print(f"🗜️ הקשר נדחס עבור {user_id}: {upto} הודעות מכוסות בסיכום")
+        except Exception as e:
+            metrics.incr("context.compaction_errors")
+            print(f"⚠️ שגיאה בדחיסת הקשר עבור {user_id}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(user_id)
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+מטמון שיחות חסום בזיכרון: מתנהג כמו המילון conversations (user_id -> רשימת הודעות),
+אבל מפנה משתמשים לא פעילים (LRU לפי פעילות אחרונה, תקרת משתמשים/גודל וזמן סרק),
+וטוען אותם מחדש בעצלות מהיומן בפעם הבאה שניגשים אליהם.
+
+פעילות = כתיבה (הצבת שיחה או touch בהוספת הודעה); קריאות לא מרעננות את המיקום ב-LRU,
+כדי שסריקות רקע (בדיקת חוסר פעילות) לא ישאירו את כולם "חמים" לנצח.
+"""
+
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, List, MutableMapping, Optional, Set
+
+from metrics import metrics
+
+
+def estimate_bytes(messages: List[Dict]) -> int:
+    """הערכה גסה לגודל שיחה בזיכרון (תוכן + תקורה קבועה לכל הודעה)"""
+    return sum(len(m.get("content") or "") * 2 + 200 for m in messages)
+
+
+class ConversationCache(MutableMapping):
+    def __init__(self, loader: Callable[[str], bool], before_evict: Callable[[str], None],
+                 max_users: int, max_bytes: int, idle_sec: float, min_idle_sec: float,
+                 sweep_interval_sec: float = 60.0, read_through: bool = False, miss_ttl_sec: float = 5.0):
+        """
+        loader(user_id) - טוען את המשתמש מהיומן (ומציב אותו במטמון); מחזיר True בהצלחה.
+        before_evict(user_id) - שמירה לדיסק לפני הפינוי.
+        משתמש שהיה פעיל ב-min_idle_sec האחרונות לא מפונה גם מעל התקרה (סבב באמצע).
+        read_through - גם משתמש שמעולם לא היה בזיכרון של התהליך נטען מהמאגר (מאגר משותף
+        לכמה תהליכים); משתמש שלא נמצא לא נבדק שוב במשך miss_ttl_sec.
+        """
+        self.loader = loader
+        self.before_evict = before_evict
+        self.max_users = max(1, int(max_users))
+        self.max_bytes = int(max_bytes)
+        self.idle_sec = float(idle_sec)
+        self.min_idle_sec = float(min_idle_sec)
+        self.sweep_interval_sec = max(1.0, float(sweep_interval_sec))
+        self.read_through = read_through
+        self.miss_ttl_sec = float(miss_ttl_sec)
+        self._lock = threading.RLock()
+        # לפי סדר פעילות: הראשון הוא הפחות פעיל לאחרונה
+        self._data: "OrderedDict[str, list]" = OrderedDict()
+        self._active_at: Dict[str, float] = {}
+        self._evicted: Set[str] = set()
+        # user_id -> מתי הטעינה האחרונה לא מצאה אותו (רק ב-read_through)
+        self._misses: Dict[str, float] = {}
+        self._evict_listeners: List[Callable[[str], None]] = []
+        # user_id -> [נעילת טעינה, כמה threads משתמשים בה]: טעינה רצה מחוץ לנעילה הכללית,
+        # ופניות מקבילות לאותו משתמש ממתינות לטעינה אחת
+        self._loading: Dict[str, list] = {}
+        self._sweeper = None
+        self._sweep_now = threading.Event()
+
+        metrics.register_gauge("conversation_cache.resident_users", lambda: len(self._data))
+        metrics.register_gauge("conversation_cache.evicted_users", lambda: len(self._evicted))
+        metrics.register_gauge("conversation_cache.hit_ratio", self.hit_ratio)
+
+    # --- ממשק מילון ---
+
+    def __getitem__(self, user_id: str) -> list:
+        with self._lock:
+            messages = self._data.get(user_id)
+            if messages is not None:
+                metrics.incr("conversation_cache.hits")
+                return messages
+        if self._load(user_id):
+            messages = self._data.get(user_id)
+            if messages is not None:
+                return messages
+        raise KeyError(user_id)
+
+    def __contains__(self, user_id) -> bool:
+        with self._lock:
+            if user_id in self._data:
+                metrics.incr("conversation_cache.hits")
+                return True
+        return self._load(user_id)
+
+    def __setitem__(self, user_id: str, messages: list) -> None:
+        with self._lock:
+            self._data[user_id] = messages
+            self._evicted.discard(user_id)
+            self._misses.pop(user_id, None)
+            self._touch_locked(user_id)
+            over_limit = len(self._data) > self.max_users
+        if self._sweeper is None:
+            self.start_sweeper()
+        if over_limit:
+            # הפינוי (שכולל כתיבה לדיסק) רץ ב-thread המפנה, לא בתוך הנעילה של מי שהציב
+            self._sweep_now.set()
+
+    def __delitem__(self, user_id: str) -> None:
+        with self._lock:
+            self._evicted.discard(user_id)
+            self._misses.pop(user_id, None)
+            self._active_at.pop(user_id, None)
+            del self._data[user_id]
+
+    def __iter__(self) -> Iterator[str]:
+        # עותק - בטוח לאיטרציה בזמן ש-threads אחרים מוסיפים משתמשים
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def keys(self) -> List[str]:
+        """המשתמשים שבזיכרון כרגע (בלי טעינה של מפונים)"""
+        with self._lock:
+            return list(self._data.keys())
+
+    def items(self) -> List:
+        with self._lock:
+            return list(self._data.items())
+
+    def values(self) -> List[list]:
+        with self._lock:
+            return list(self._data.values())
+
+    def peek(self, user_id: str) -> Optional[list]:
+        """השיחה אם היא בזיכרון - בלי טעינה מחדש ובלי לספור פגיעה"""
+        return self._data.get(user_id)
+
+    # --- פעילות ופינוי ---
+
+    def touch(self, user_id: str) -> None:
+        """סמן פעילות (הוספת הודעה) - מזיז את המשתמש לסוף ה-LRU"""
+        with self._lock:
+            if user_id in self._data:
+                self._touch_locked(user_id)
+
+    def forget_miss(self, user_id: str) -> None:
+        """בטל פספוס שמור (read_through) - הגישה הבאה תטען מהמאגר גם לפני שעבר miss_ttl_sec"""
+        with self._lock:
+            self._misses.pop(user_id, None)
+
+    def add_evict_listener(self, fn: Callable[[str], None]) -> None:
+        """fn(user_id) נקרא אחרי פינוי - לניקוי מצב נלווה לכל משתמש"""
+        self._evict_listeners.append(fn)
+
+    def evict(self, user_id: str) -> bool:
+        """שמור ופנה משתמש מהזיכרון; יחזור בטעינה עצלה. לא לקרוא כשהנעילה של המטמון מוחזקת."""
+        try:
+            self.before_evict(user_id)
+        except Exception as e:
+            print(f"⚠️ שמירה לפני פינוי נכשלה עבור {user_id} - נשאר בזיכרון: {e}")
+            return False
+        with self._lock:
+            if time.time() - self._active_at.get(user_id, 0) < self.min_idle_sec:
+                # חזר להיות פעיל בזמן השמירה
+                return False
+            if self._data.pop(user_id, None) is None:
+                return False
+            self._active_at.pop(user_id, None)
+            self._evicted.add(user_id)
+        for listener in self._evict_listeners:
+            try:
+                listener(user_id)
+            except Exception as e:
+                print(f"⚠️ שגיאה בניקוי אחרי פינוי {user_id}: {e}")
+        metrics.incr("conversation_cache.evictions")
+        return True
+
+    def evict_over_budget(self) -> int:
+        """פנה משתמשים שבסרק יותר מ-idle_sec, ואז לפי LRU עד שחוזרים לתקרות"""
+        now = time.time()
+        with self._lock:
+            candidates = [u for u in self._data if now - self._active_at.get(u, 0) >= self.min_idle_sec]
+            resident = len(self._data)
+            total_bytes = (sum(estimate_bytes(m) for m in self._data.values())
+                           if self.max_bytes > 0 else 0)
+
+        evicted = 0
+        for user_id in candidates:
+            idle = now - self._active_at.get(user_id, 0) >= self.idle_sec
+            over_users = resident - evicted > self.max_users
+            over_bytes = self.max_bytes > 0 and total_bytes > self.max_bytes
+            if not (idle or over_users or over_bytes):
+                # הבאים בתור פעילים יותר - אין סיבה להמשיך
+                break
+            size = estimate_bytes(self._data.get(user_id) or []) if over_bytes else 0
+            if self.evict(user_id):
+                evicted += 1
+                total_bytes -= size
+        return evicted
+
+    # --- סטטיסטיקות ---
+
+    def hit_ratio(self) -> float:
+        hits = metrics.get("conversation_cache.hits")
+        reloads = metrics.get("conversation_cache.reloads")
+        return round(hits / (hits + reloads), 4) if hits + reloads else 1.0
+
+    def stats(self) -> Dict:
+        """סטטיסטיקות לניטור"""
+        with self._lock:
+            sizes = [estimate_bytes(m) for m in self._data.values()]
+        return {
+            "resident_users": len(sizes),
+            "evicted_users": len(self._evicted),
+            "approx_bytes": sum(sizes),
+            "approx_bytes_per_user": int(sum(sizes) / len(sizes)) if sizes else 0,
+            "max_users": self.max_users,
+            "max_bytes": self.max_bytes,
+            "idle_sec": self.idle_sec,
+            "hits": metrics.get("conversation_cache.hits"),
+            "reloads": metrics.get("conversation_cache.reloads"),
+            "hit_ratio": self.hit_ratio(),
+            "evictions": metrics.get("conversation_cache.evictions"),
+        }
+
+    def start_sweeper(self) -> None:
+        """thread שמפנה משתמשים בסרק מדי sweep_interval_sec"""
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            self._sweeper = threading.Thread(target=self._sweep_loop, name="conversation-cache-sweeper",
+                                             daemon=True)
+            self._sweeper.start()
+
+    # --- פנימי ---
+
+    def _touch_locked(self, user_id: str) -> None:
+        self._active_at[user_id] = time.time()
+        self._data.move_to_end(user_id)
+
+    def _should_load(self, user_id: str) -> bool:
+        """האם לנסות לטעון משתמש שלא בזיכרון (הנעילה מוחזקת)"""
+        if user_id in self._evicted:
+            return True
+        if not self.read_through:
+            return False
+        missed_at = self._misses.get(user_id)
+        return missed_at is None or time.time() - missed_at >= self.miss_ttl_sec
+
+    def _load(self, user_id: str) -> bool:
+        """
+        טעינה עצלה של משתמש שלא בזיכרון. ה-loader (קובץ או שאילתה ל-Mongo) רץ מחוץ לנעילה
+        הכללית, כך שפספוס של משתמש אחד לא עוצר את הגישה לכל השאר.
+        """
+        with self._lock:
+            if not self._should_load(user_id):
+                return False
+            entry = self._loading.get(user_id)
+            if entry is None:
+                entry = self._loading[user_id] = [threading.RLock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                with self._lock:
+                    if user_id in self._data:
+                        # thread אחר טען בזמן שחיכינו
+                        return True
+                    if not self._should_load(user_id):
+                        return False
+                return self._reload(user_id)
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    self._loading.pop(user_id, None)
+
+    def _reload(self, user_id: str) -> bool:
+        """טעינה (נעילת הטעינה של המשתמש מוחזקת, הכללית לא - ה-loader מציב דרך __setitem__)"""
+        with self._lock:
+            was_evicted = user_id in self._evicted
+        started = time.time()
+        try:
+            loaded = bool(self.loader(user_id)) and user_id in self._data
+        except Exception as e:
+            print(f"⚠️ טעינה מחדש של {user_id} נכשלה: {e}")
+            loaded = False
+        if not loaded:
+            # מפונה נשאר מסומן כדי לנסות שוב בגישה הבאה; משתמש לא מוכר נרשם כפספוס
+            if not was_evicted:
+                with self._lock:
+                    self._misses[user_id] = time.time()
+            return False
+        metrics.incr("conversation_cache.reloads")
+        metrics.observe("conversation_cache.reload_sec", time.time() - started)
+        return True
+
+    def _prune_misses(self) -> None:
+        now = time.time()
+        with self._lock:
+            expired = [u for u, at in self._misses.items() if now - at >= self.miss_ttl_sec]
+            for user_id in expired:
+                del self._misses[user_id]
+
+    def _sweep_loop(self) -> None:
+        while True:
+            self._sweep_now.wait(self.sweep_interval_sec)
+            self._sweep_now.clear()
+            try:
+                self._prune_misses()
+                evicted = self.evict_over_budget()
+                if evicted:
+                    print(f"🧹 מטמון שיחות: פונו {evicted} משתמשים ({len(self._data)} בזיכרון)")
+            except Exception as e:
+                print(f"❌ שגיאה בפינוי מטמון השיחות: {e}")
+                traceback.print_exc()
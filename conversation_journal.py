@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+יומן שיחות append-only: לכל משתמש קובץ JSONL ב-conversations/ שמקבל רשומה אחת לכל
+הודעה, סיכום או שינוי מונה שאלות - במקום לכתוב מחדש את כל השיחה בכל סבב.
+מדי פעם (לפי מספר הרשומות בזנב) היומן נדחס ל-snapshot, והטעינה = snapshot + זנב.
+קובץ ה-txt הקריא נוצר לפי דרישה:
+
+    python conversation_journal.py [user_id ...]     # בלי פרמטרים - לכל המשתמשים
+
+קבצים לכל משתמש:
+    <user>.journal.jsonl    רשומות לפי הסדר, לכל אחת מספר רץ (seq)
+    <user>.snapshot.json    מצב מלא עד seq מסוים; רשומות עם seq קטן או שווה מדולגות בטעינה
+    <user>.json             הפורמט הישן - נקרא רק אם אין עדיין יומן
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from metrics import metrics
+
+JOURNAL_FOLDER = "conversations"
+# אחרי כמה רשומות בזנב היומן נדחס ל-snapshot
+JOURNAL_COMPACT_EVERY = int(os.environ.get("CONVERSATION_JOURNAL_COMPACT_EVERY", "200"))
+
+
+class _Cursor:
+    """מה כבר נכתב ליומן עבור משתמש: עד איזו הודעה, באיזו רשימה, ועד איזה seq"""
+    __slots__ = ("source_id", "length", "last_message", "question_count", "seq", "tail_records")
+
+    def __init__(self):
+        self.source_id = None
+        self.length = 0
+        self.last_message = None
+        self.question_count = 0
+        self.seq = 0
+        self.tail_records = 0
+
+
+class ConversationJournal:
+    # קבצים מקומיים - לתהליך יחיד (מאגר משותף: conversation_store.py)
+    shared = False
+
+    def __init__(self, folder: str = JOURNAL_FOLDER, compact_every: int = JOURNAL_COMPACT_EVERY):
+        self.folder = folder
+        self.compact_every = max(1, int(compact_every))
+        self._lock = threading.Lock()
+        self._user_locks: Dict[str, threading.RLock] = {}
+        self._cursors: Dict[str, _Cursor] = {}
+
+    # --- נתיבים ---
+
+    def journal_path(self, user_id: str) -> str:
+        return os.path.join(self.folder, f"{user_id}.journal.jsonl")
+
+    def snapshot_path(self, user_id: str) -> str:
+        return os.path.join(self.folder, f"{user_id}.snapshot.json")
+
+    def legacy_path(self, user_id: str) -> str:
+        return os.path.join(self.folder, f"{user_id}.json")
+
+    def text_path(self, user_id: str) -> str:
+        return os.path.join(self.folder, f"{user_id}.txt")
+
+    # --- כתיבה ---
+
+    def sync(self, user_id: str, messages: List[Dict], question_count: int = 0) -> int:
+        """
+        כתוב ליומן רק את מה שהשתנה מאז הפעם הקודמת: הודעות שנוספו לסוף ושינוי במונה השאלות.
+        אם הרשימה הוחלפה, קוצרה או שונתה לא בסוף (למשל הוספת system בהתחלה או ביטול סבב) -
+        נכתב snapshot מלא במקום. מחזיר את מספר הרשומות שנכתבו.
+        """
+        with self._user_lock(user_id):
+            cursor = self._cursor(user_id)
+            if not self._is_append_of(cursor, messages):
+                metrics.incr("journal.rewrites")
+                self._write_snapshot(user_id, cursor, messages, question_count,
+                                     self._load_summaries(user_id))
+                return 0
+
+            # חיתוך אחד: הודעה שנוספת במקביל (מה-thread של השיחה) תיכתב בפעם הבאה
+            new_messages = messages[cursor.length:]
+            records = [{"t": "msg", "role": m.get("role"), "content": m.get("content"), "at": time.time()}
+                       for m in new_messages]
+            if question_count != cursor.question_count:
+                records.append({"t": "meta", "question_count": question_count})
+            if not records:
+                return 0
+
+            self._append(user_id, cursor, records)
+            cursor.source_id = id(messages)
+            cursor.length += len(new_messages)
+            if new_messages:
+                cursor.last_message = new_messages[-1]
+            cursor.question_count = question_count
+
+            if cursor.tail_records >= self.compact_every:
+                self.compact(user_id, messages, question_count)
+            return len(records)
+
+    def append_summary(self, user_id: str, summary: str, customer_name: str, customer_gender: str,
+                       message_count: int) -> None:
+        """רשומת סיכום (תוצג ב-txt אחרי ההודעה ה-message_count)"""
+        record = {
+            "t": "summary",
+            "summary": summary,
+            "customer_name": customer_name,
+            "customer_gender": customer_gender,
+            "date": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "after": message_count,
+        }
+        with self._user_lock(user_id):
+            self._append(user_id, self._cursor(user_id), [record])
+
+    def compact(self, user_id: str, messages: List[Dict], question_count: int) -> None:
+        """דחיסת היומן ל-snapshot (המצב בזיכרון הוא המקור) ואיפוס הזנב"""
+        with self._user_lock(user_id):
+            cursor = self._cursor(user_id)
+            self._write_snapshot(user_id, cursor, messages, question_count, self._load_summaries(user_id))
+            metrics.incr("journal.compactions")
+
+    def forget(self, user_id: str) -> None:
+        """שחרור מצב הכתיבה של משתמש שפונה מהזיכרון (ייבנה מחדש בטעינה הבאה)"""
+        with self._user_lock(user_id):
+            self._cursors.pop(user_id, None)
+
+    # --- קריאה ---
+
+    def load(self, user_id: str) -> Optional[Dict]:
+        """
+        שחזור שיחה: snapshot ואחריו הזנב. מחזיר {"messages", "question_count", "summaries"}
+        או None אם אין למשתמש שום קובץ. גם הפורמט הישן (<user>.json) נתמך.
+        """
+        with self._user_lock(user_id):
+            state = self._replay(user_id)
+            if state is None:
+                return None
+            messages = state["messages"]
+            cursor = self._cursors.setdefault(user_id, _Cursor())
+            cursor.source_id = id(messages)
+            cursor.length = len(messages)
+            cursor.last_message = messages[-1] if messages else None
+            cursor.question_count = state["question_count"]
+            cursor.seq = state["seq"]
+            cursor.tail_records = state["tail_records"]
+            if state.get("legacy"):
+                # מעבר חד-פעמי מהפורמט הישן: מכאן והלאה רק היומן
+                self._write_snapshot(user_id, cursor, messages, state["question_count"], state["summaries"])
+            return state
+
+    def last_updated(self, user_id: str) -> Optional[float]:
+        """זמן השינוי האחרון בקבצי המשתמש (או None)"""
+        times = [os.path.getmtime(p) for p in (self.journal_path(user_id), self.snapshot_path(user_id),
+                                                  self.legacy_path(user_id)) if os.path.exists(p)]
+        return max(times) if times else None
+
+    def render_text(self, user_id: str) -> Optional[str]:
+        """הטקסט הקריא של השיחה (הודעות וסיכומים לפי הסדר), בפורמט של קבצי ה-txt"""
+        state = self._replay(user_id)
+        if state is None:
+            return None
+        summaries_after: Dict[int, List[Dict]] = {}
+        for s in state["summaries"]:
+            summaries_after.setdefault(min(s.get("after", 0), len(state["messages"])), []).append(s)
+
+        parts = [_render_summary(user_id, s) for s in summaries_after.get(0, [])]
+        for i, msg in enumerate(state["messages"], start=1):
+            parts.append(f"{(msg.get('role') or '').upper()}: {msg.get('content')}\n\n")
+            parts.extend(_render_summary(user_id, s) for s in summaries_after.get(i, []))
+        return "".join(parts)
+
+    def write_text(self, user_id: str) -> Optional[str]:
+        """כתוב את ה-txt של המשתמש; מחזיר את הנתיב (או None אם אין שיחה)"""
+        text = self.render_text(user_id)
+        if text is None:
+            return None
+        path = self.text_path(user_id)
+        with open(path, "w", encoding="utf-8-sig") as f:
+            f.write(text)
+        return path
+
+    def user_ids(self) -> List[str]:
+        """כל המשתמשים שיש להם יומן, snapshot או קובץ JSON ישן"""
+        if not os.path.isdir(self.folder):
+            return []
+        users = set()
+        for name in os.listdir(self.folder):
+            for suffix in (".journal.jsonl", ".snapshot.json", ".json"):
+                if name.endswith(suffix):
+                    users.add(name[:-len(suffix)])
+                    break
+        return sorted(users)
+
+    # --- פנימי ---
+
+    def _user_lock(self, user_id: str) -> threading.RLock:
+        with self._lock:
+            lock = self._user_locks.get(user_id)
+            if lock is None:
+                lock = self._user_locks[user_id] = threading.RLock()
+            return lock
+
+    def _cursor(self, user_id: str) -> _Cursor:
+        cursor = self._cursors.get(user_id)
+        if cursor is None:
+            cursor = self._cursors[user_id] = _Cursor()
+            # תהליך שעלה מחדש: ממשיכים את ה-seq מהקבצים, אבל הרשימה בזיכרון עוד לא ידועה
+            state = self._replay(user_id)
+            if state is not None:
+                cursor.seq = state["seq"]
+                cursor.tail_records = state["tail_records"]
+        return cursor
+
+    @staticmethod
+    def _is_append_of(cursor: _Cursor, messages: List[Dict]) -> bool:
+        """האם הרשימה היא אותה רשימה שנכתבה, רק עם הודעות נוספות בסוף"""
+        if cursor.source_id != id(messages) or len(messages) < cursor.length:
+            return False
+        if cursor.length == 0:
+            return True
+        return messages[cursor.length - 1] is cursor.last_message
+
+    def _append(self, user_id: str, cursor: _Cursor, records: List[Dict]) -> None:
+        os.makedirs(self.folder, exist_ok=True)
+        lines = []
+        for record in records:
+            cursor.seq += 1
+            record["seq"] = cursor.seq
+            lines.append(json.dumps(record, ensure_ascii=False))
+        data = "\n".join(lines) + "\n"
+        with open(self.journal_path(user_id), "a", encoding="utf-8") as f:
+            f.write(data)
+        cursor.tail_records += len(records)
+        metrics.incr("journal.records", len(records))
+        metrics.incr("journal.bytes", len(data.encode("utf-8")))
+
+    def _write_snapshot(self, user_id: str, cursor: _Cursor, messages: List[Dict], question_count: int,
+                        summaries: List[Dict]) -> None:
+        """snapshot אטומי (קובץ זמני + החלפה) ואז ריקון היומן; seq של ה-snapshot מונע כפילות אם נפלנו באמצע"""
+        os.makedirs(self.folder, exist_ok=True)
+        source = messages
+        # עותק: הרשימה יכולה לגדול בזמן הכתיבה
+        messages = list(messages)
+        snapshot = {
+            "user_id": user_id,
+            "seq": cursor.seq,
+            "last_updated": datetime.now().isoformat(),
+            "messages": messages,
+            "question_count": question_count,
+            "summaries": summaries,
+        }
+        path = self.snapshot_path(user_id)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        open(self.journal_path(user_id), "w", encoding="utf-8").close()
+
+        cursor.source_id = id(source)
+        cursor.length = len(messages)
+        cursor.last_message = messages[-1] if messages else None
+        cursor.question_count = question_count
+        cursor.tail_records = 0
+        metrics.incr("journal.snapshots")
+
+    def _load_summaries(self, user_id: str) -> List[Dict]:
+        state = self._replay(user_id)
+        return state["summaries"] if state else []
+
+    def _replay(self, user_id: str) -> Optional[Dict]:
+        snapshot_path = self.snapshot_path(user_id)
+        journal_path = self.journal_path(user_id)
+        if not os.path.exists(snapshot_path) and not os.path.exists(journal_path):
+            return self._load_legacy(user_id)
+
+        state = {"messages": [], "question_count": 0, "summaries": [], "seq": 0, "tail_records": 0}
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            state["messages"] = snapshot.get("messages", [])
+            state["question_count"] = snapshot.get("question_count", 0)
+            state["summaries"] = snapshot.get("summaries", [])
+            state["seq"] = snapshot.get("seq", 0)
+
+        base_seq = state["seq"]
+        if os.path.exists(journal_path):
+            with open(journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # שורה אחרונה חלקית (נפילה באמצע כתיבה) - מדלגים
+                        metrics.incr("journal.corrupt_lines")
+                        continue
+                    seq = record.get("seq", 0)
+                    if seq <= base_seq:
+                        continue
+                    state["seq"] = max(state["seq"], seq)
+                    state["tail_records"] += 1
+                    kind = record.get("t")
+                    if kind == "msg":
+                        state["messages"].append({"role": record.get("role"), "content": record.get("content")})
+                    elif kind == "meta":
+                        state["question_count"] = record.get("question_count", state["question_count"])
+                    elif kind == "summary":
+                        state["summaries"].append({k: v for k, v in record.items() if k not in ("t", "seq")})
+        return state
+
+    def _load_legacy(self, user_id: str) -> Optional[Dict]:
+        path = self.legacy_path(user_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8-sig") as f:
+            data = json.load(f)
+        return {
+            "messages": data.get("messages", []),
+            "question_count": data.get("question_count", 0),
+            "summaries": [],
+            "seq": 0,
+            "tail_records": 0,
+            "legacy": True,
+        }
+
+
+def _render_summary(user_id: str, summary: Dict) -> str:
+    """קטע סיכום בפורמט שנכתב בעבר לסוף קובץ ה-txt"""
+    return f"""
+{'='*50}
+📋 סיכום שיחה
+{'='*50}
+📱 מספר טלפון: {user_id}
+👤 שם לקוח: {summary.get('customer_name', '')}
+👥 מין: {summary.get('customer_gender', '')}
+📅 תאריך: {summary.get('date', '')}
+{'='*50}
+
+{summary.get('summary', '')}
+
+{'='*50}
+"""
+
+
+# יצירת מופע גלובלי
+conversation_journal = ConversationJournal()
+
+
+if __name__ == "__main__":
+    targets = sys.argv[1:] or conversation_journal.user_ids()
+    for target in targets:
+        written = conversation_journal.write_text(target)
+        print(f"📝 {target}: {written}" if written else f"⚠️ {target}: אין שיחה")
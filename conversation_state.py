@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+מצב מצטבר לכל שיחה: מונים וזמנים שמתעדכנים בכל הוספת הודעה, במקום לסרוק את כל ההיסטוריה מחדש
+"""
+
+import time
+from typing import Dict, List, Optional, Set
+
+from business_info import TRACKED_KEYWORDS
+from prompt_registry import is_prompt_reference
+
+IMAGE_MARKER = "[תמונה]"
+IMAGE_URL_PREFIX = "🔗 קישור לתמונה:"
+
+
+def extract_image_url(content: str) -> Optional[str]:
+    """קישור התמונה מתוך הודעת תמונה שמורה (אם יש)"""
+    if IMAGE_URL_PREFIX not in content:
+        return None
+    for line in content.split("\n"):
+        if IMAGE_URL_PREFIX in line:
+            return line.replace(IMAGE_URL_PREFIX, "").strip() or None
+    return None
+
+
+class ConversationState:
+    __slots__ = (
+        "user_count", "assistant_count", "last_user_at", "last_assistant_at",
+        "question_total", "image_count", "image_urls", "keywords_seen", "_source_id", "_length",
+    )
+
+    def __init__(self):
+        self.user_count = 0
+        self.assistant_count = 0
+        self.last_user_at: Optional[float] = None
+        self.last_assistant_at: Optional[float] = None
+        self.question_total = 0
+        self.image_count = 0
+        self.image_urls: List[str] = []
+        # מילות המפתח העסקיות שהופיעו בשיחה (כולל טקסט פרומפט המערכת ותשובות הסוכן)
+        self.keywords_seen: Set[str] = set()
+        # לאיזו רשימת הודעות המצב מתאים ועד איזה אורך
+        self._source_id = None
+        self._length = 0
+
+    @classmethod
+    def from_messages(cls, messages: List[Dict], question_total: int = 0,
+                      prompt_text: Optional[str] = None) -> "ConversationState":
+        """
+        בניית מצב מהיסטוריה קיימת (טעינה מקובץ / אחרי שינוי שלא דרך הוספה). זמנים לא ידועים.
+        prompt_text - הטקסט שהפניה לפרומפט ("@prompt:<גרסה>") מייצגת, כדי שמילות המפתח שלו
+        ייספרו כמו כשהפרומפט המלא היה שמור בהיסטוריה.
+        """
+        state = cls()
+        for message in messages:
+            content = message.get("content") or ""
+            if prompt_text is not None and is_prompt_reference(message):
+                content = prompt_text
+            state._count(message.get("role"), content)
+        state.question_total = question_total
+        state._source_id = id(messages)
+        state._length = len(messages)
+        return state
+
+    @property
+    def total_messages(self) -> int:
+        """הודעות משתמש וסוכן (בלי system)"""
+        return self.user_count + self.assistant_count
+
+    def matches(self, messages: List[Dict]) -> bool:
+        """האם המצב עדיין משקף את הרשימה (לא הוחלפה, אופסה או נחתכה מאז)"""
+        return self._source_id == id(messages) and self._length == len(messages)
+
+    def record(self, role: str, content: str, at: Optional[float] = None) -> None:
+        """עדכון אחרי הוספת הודעה לסוף הרשימה"""
+        self._count(role, content or "")
+        now = at or time.time()
+        if role == "user":
+            self.last_user_at = now
+        elif role == "assistant":
+            self.last_assistant_at = now
+        self._length += 1
+
+    def as_dict(self) -> Dict:
+        return {
+            "user_count": self.user_count,
+            "assistant_count": self.assistant_count,
+            "total_messages": self.total_messages,
+            "last_user_at": self.last_user_at,
+            "last_assistant_at": self.last_assistant_at,
+            "question_total": self.question_total,
+            "image_count": self.image_count,
+            "keywords_seen": sorted(self.keywords_seen),
+        }
+
+    def _count(self, role: str, content: str) -> None:
+        if role == "user":
+            self.user_count += 1
+        elif role == "assistant":
+            self.assistant_count += 1
+        if len(self.keywords_seen) < len(TRACKED_KEYWORDS):
+            lowered = content.lower()
+            for keyword in TRACKED_KEYWORDS:
+                if keyword not in self.keywords_seen and keyword in lowered:
+                    self.keywords_seen.add(keyword)
+        if IMAGE_MARKER in content:
+            self.image_count += 1
+            url = extract_image_url(content)
+            if url:
+                self.image_urls.append(url)
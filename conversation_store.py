@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+מאגר שיחות משותף ב-Mongo (אוסף wa_conversations, ליד wa_sessions), כדי שכמה תהליכים
+(workers של gunicorn, כמה מופעים, ה-worker של הסקד'ולר) יוכלו לשרת כל משתמש.
+
+מסמך לכל משתמש: {user_id, messages, length, question_count, summaries, created_at, updated_at}.
+הודעות חדשות נוספות ב-$push והמונים ב-$inc - אף פעם לא נכתבת כל השיחה מחדש, חוץ
+ממקרים שבהם הרשימה הוחלפה (שיחה חדשה, ביטול סבב). הכתיבה מותנית ב-length שהתהליך
+מכיר; אם תהליך אחר הוסיף הודעות בינתיים, רק ההודעות של הסבב הזה נוספות בסוף (תחת תנאי
+length עדכני, בלי פרומפט מערכת כפול) והעותק המקומי נטען מחדש מהמסמך (needs_reload).
+
+הממשק זהה ל-ConversationJournal (sync / load / last_updated / append_summary / compact / forget),
+כך ש-chatbot.py בוחר ביניהם לפי CONVERSATION_STORE=file|mongo.
+"""
+
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
+
+from metrics import metrics
+
+CONVERSATIONS_COLLECTION = os.environ.get("MONGODB_CONVERSATIONS_COLLECTION", "wa_conversations")
+# כמה פעמים לנסות להוסיף את הסבב אחרי התנגשות לפני שמוסיפים בלי תנאי
+CONFLICT_RETRIES = 3
+
+
+class _Synced:
+    """
+    מה התהליך הזה כבר כתב למסמך: איזו רשימה, כמה הודעות, ומה ההודעה האחרונה.
+    stale - הרשימה המקומית כבר לא תואמת את המסמך (הסבב נוסף אחרי הודעות של תהליך אחר).
+    """
+    __slots__ = ("source_id", "length", "last_message", "question_count", "stale")
+
+    def __init__(self):
+        self.source_id = None
+        self.length = 0
+        self.last_message = None
+        self.question_count = 0
+        self.stale = False
+
+
+class MongoConversationStore:
+    # המאגר משותף לכמה תהליכים: שמירה מיידית ובדיקת עדכניות בתחילת סבב
+    shared = True
+
+    def __init__(self, collection, fallback=None):
+        """
+        collection - אוסף ה-Mongo של השיחות.
+        fallback - מאגר קודם (יומן הקבצים) שממנו מועתקת שיחה שעוד לא קיימת ב-Mongo.
+        """
+        self.collection = collection
+        self.fallback = fallback
+        self._lock = threading.Lock()
+        self._user_locks: Dict[str, threading.RLock] = {}
+        self._synced: Dict[str, _Synced] = {}
+        self.collection.create_index("user_id", unique=True)
+        self.collection.create_index("updated_at")
+
+    # --- כתיבה ---
+
+    def sync(self, user_id: str, messages: List[Dict], question_count: int = 0) -> int:
+        """
+        כתוב רק את מה שהשתנה: הודעות חדשות ב-$push, מונה ההודעות ב-$inc ומונה השאלות ב-$set.
+        רשימה שהוחלפה או שונתה לא בסוף נכתבת במלואה. מחזיר את מספר ההודעות שנכתבו.
+        """
+        with self._user_lock(user_id):
+            synced = self._synced.setdefault(user_id, _Synced())
+            if not self._is_append_of(synced, messages):
+                self._replace(user_id, synced, messages, question_count)
+                return 0
+
+            # חיתוך אחד: הודעה שנוספת במקביל תיכתב בפעם הבאה
+            new_messages = messages[synced.length:]
+            if not new_messages and question_count == synced.question_count:
+                return 0
+
+            now = time.time()
+            update = {"$set": {"question_count": question_count, "updated_at": now},
+                      "$setOnInsert": {"created_at": now, "summaries": []}}
+            if new_messages:
+                update["$push"] = {"messages": {"$each": [_record(m, now) for m in new_messages]}}
+                update["$inc"] = {"length": len(new_messages)}
+
+            try:
+                result = self.collection.update_one({"user_id": user_id, "length": synced.length}, update,
+                                                    upsert=synced.length == 0)
+                conflict = result.matched_count == 0 and result.upserted_id is None
+            except DuplicateKeyError:
+                conflict = True
+            if conflict:
+                # תהליך אחר הוסיף הודעות מאז שקראנו - רק ההודעות של הסבב הזה נוספות אחרי שלו
+                metrics.incr("conversation_store.conflicts")
+                pushed = self._append_after_conflict(user_id, synced, new_messages, question_count)
+                synced.stale = True
+            else:
+                pushed = len(new_messages)
+
+            synced.source_id = id(messages)
+            synced.length += len(new_messages)
+            if new_messages:
+                synced.last_message = new_messages[-1]
+            synced.question_count = question_count
+            metrics.incr("conversation_store.pushed_messages", pushed)
+            return pushed
+
+    def append_summary(self, user_id: str, summary: str, customer_name: str, customer_gender: str,
+                       message_count: int) -> None:
+        """סיכום נוסף למערך summaries של המסמך (אחרי ההודעה ה-message_count)"""
+        now = time.time()
+        record = {
+            "summary": summary,
+            "customer_name": customer_name,
+            "customer_gender": customer_gender,
+            "date": time.strftime('%Y-%m-%d %H:%M:%S'),
+            "after": message_count,
+        }
+        self.collection.update_one(
+            {"user_id": user_id},
+            {"$push": {"summaries": record}, "$set": {"updated_at": now},
+             "$setOnInsert": {"created_at": now, "messages": [], "length": 0, "question_count": 0}},
+            upsert=True,
+        )
+
+    def compact(self, user_id: str, messages: List[Dict], question_count: int) -> None:
+        """כתיבה מלאה של השיחה (ב-Mongo אין זנב לדחוס - משמש להחלפת הרשימה)"""
+        with self._user_lock(user_id):
+            self._replace(user_id, self._synced.setdefault(user_id, _Synced()), messages, question_count)
+
+    def forget(self, user_id: str) -> None:
+        """שחרור מצב הכתיבה של משתמש שפונה מהזיכרון"""
+        with self._user_lock(user_id):
+            self._synced.pop(user_id, None)
+
+    # --- קריאה ---
+
+    def load(self, user_id: str) -> Optional[Dict]:
+        """השיחה מהמסמך: {"messages", "question_count", "summaries"} או None אם אין"""
+        with self._user_lock(user_id):
+            metrics.incr("conversation_store.reads")
+            doc = self.collection.find_one(
+                {"user_id": user_id}, {"messages": 1, "question_count": 1, "summaries": 1, "_id": 0})
+            if doc is None:
+                return self._import_from_fallback(user_id)
+            messages = [{"role": m.get("role"), "content": m.get("content")} for m in doc.get("messages", [])]
+            synced = self._synced.setdefault(user_id, _Synced())
+            synced.source_id = id(messages)
+            synced.length = len(messages)
+            synced.last_message = messages[-1] if messages else None
+            synced.question_count = doc.get("question_count", 0)
+            synced.stale = False
+            return {"messages": messages, "question_count": synced.question_count,
+                    "summaries": doc.get("summaries", [])}
+
+    def stored_length(self, user_id: str) -> Optional[int]:
+        """כמה הודעות שמורות (קריאה מוקרנת וזולה - לבדיקה אם המטמון המקומי עדכני)"""
+        doc = self.collection.find_one({"user_id": user_id}, {"length": 1, "_id": 0})
+        return doc.get("length", 0) if doc else None
+
+    def needs_reload(self, user_id: str) -> bool:
+        """האם העותק המקומי של השיחה כבר לא תואם את המסמך (אחרי התנגשות) וצריך לטעון אותו מחדש"""
+        synced = self._synced.get(user_id)
+        return bool(synced and synced.stale)
+
+    def synced_length(self, user_id: str) -> Optional[int]:
+        """כמה הודעות התהליך הזה יודע שכתובות במסמך (None אם לא נטען/נכתב כאן)"""
+        synced = self._synced.get(user_id)
+        return synced.length if synced else None
+
+    def last_updated(self, user_id: str) -> Optional[float]:
+        doc = self.collection.find_one({"user_id": user_id}, {"updated_at": 1, "_id": 0})
+        return doc.get("updated_at") if doc else None
+
+    # --- פנימי ---
+
+    def _user_lock(self, user_id: str) -> threading.RLock:
+        with self._lock:
+            lock = self._user_locks.get(user_id)
+            if lock is None:
+                lock = self._user_locks[user_id] = threading.RLock()
+            return lock
+
+    @staticmethod
+    def _is_append_of(synced: _Synced, messages: List[Dict]) -> bool:
+        """האם הרשימה היא אותה רשימה שנכתבה, רק עם הודעות נוספות בסוף"""
+        if synced.source_id is None and synced.length == 0:
+            # רשימה שלא נטענה ולא נכתבה בתהליך הזה (שיחה חדשה) - נוספת בתנאי length 0, כך שאם
+            # תהליך אחר כבר יצר את המסמך היא לא דורסת אותו
+            return True
+        if synced.source_id != id(messages) or len(messages) < synced.length:
+            return False
+        if synced.length == 0:
+            return True
+        return messages[synced.length - 1] is synced.last_message
+
+    def _append_after_conflict(self, user_id: str, synced: _Synced, new_messages: List[Dict],
+                               question_count: int) -> int:
+        """
+        הוספת ההודעות של הסבב הזה אחרי מה שתהליך אחר כתב, תחת תנאי length שנקרא עכשיו.
+        רשימה שהתחילה כאן מאפס (המשתמש לא נמצא כשנבדק) לא מביאה איתה פרומפט מערכת שני;
+        מונה השאלות מתווסף כהפרש (לא דורס את של התהליך האחר). מחזיר כמה הודעות נוספו.
+        """
+        turn_messages = new_messages
+        if synced.length == 0:
+            turn_messages = [m for m in new_messages if m.get("role") != "system"]
+        now = time.time()
+        update = {"$set": {"updated_at": now}, "$setOnInsert": {"created_at": now, "summaries": []}}
+        inc = {}
+        if turn_messages:
+            update["$push"] = {"messages": {"$each": [_record(m, now) for m in turn_messages]}}
+            inc["length"] = len(turn_messages)
+        if question_count > synced.question_count:
+            inc["question_count"] = question_count - synced.question_count
+        if inc:
+            update["$inc"] = inc
+
+        written = False
+        for _ in range(CONFLICT_RETRIES):
+            doc = self.collection.find_one({"user_id": user_id}, {"length": 1, "_id": 0})
+            try:
+                result = self.collection.update_one(
+                    {"user_id": user_id, "length": doc.get("length", 0) if doc else 0}, update,
+                    upsert=doc is None)
+            except DuplicateKeyError:
+                continue
+            if result.matched_count or result.upserted_id is not None:
+                written = True
+                break
+        if not written:
+            # עומס כתיבה חריג על אותו משתמש - עדיף להוסיף בסוף מאשר לאבד את התשובה שכבר נשלחה
+            metrics.incr("conversation_store.conflict_retries_exhausted")
+            self.collection.update_one({"user_id": user_id}, update, upsert=True)
+        return len(turn_messages)
+
+    def _replace(self, user_id: str, synced: _Synced, messages: List[Dict], question_count: int) -> None:
+        source = messages
+        # עותק: הרשימה יכולה לגדול בזמן הכתיבה
+        messages = list(messages)
+        now = time.time()
+        self.collection.update_one(
+            {"user_id": user_id},
+            {"$set": {"messages": [_record(m, now) for m in messages], "length": len(messages),
+                      "question_count": question_count, "updated_at": now},
+             "$setOnInsert": {"created_at": now, "summaries": []}},
+            upsert=True,
+        )
+        synced.source_id = id(source)
+        synced.length = len(messages)
+        synced.last_message = messages[-1] if messages else None
+        synced.question_count = question_count
+        synced.stale = False
+        metrics.incr("conversation_store.rewrites")
+
+    def _import_from_fallback(self, user_id: str) -> Optional[Dict]:
+        """שיחה שקיימת רק במאגר הקודם מועתקת ל-Mongo בפעם הראשונה שניגשים אליה"""
+        if self.fallback is None:
+            return None
+        state = self.fallback.load(user_id)
+        if state is None:
+            return None
+        messages = state["messages"]
+        self._replace(user_id, self._synced.setdefault(user_id, _Synced()), messages, state["question_count"])
+        for s in state.get("summaries", []):
+            self.collection.update_one({"user_id": user_id}, {"$push": {"summaries": s}})
+        self.fallback.forget(user_id)
+        metrics.incr("conversation_store.imported")
+        print(f"📥 שיחה הועתקה מהיומן ל-Mongo: {user_id} ({len(messages)} הודעות)")
+        return {"messages": messages, "question_count": state["question_count"],
+                "summaries": state.get("summaries", [])}
+
+
+def _record(message: Dict, at: float) -> Dict:
+    return {"role": message.get("role"), "content": message.get("content"), "at": at}
+
+
+def create_mongo_conversation_store(fallback=None) -> MongoConversationStore:
+    """מאגר לפי MONGODB_URI / MONGODB_DATABASE (כמו wa_sessions ב-whatsapp_webhook.py)"""
+    client = MongoClient(os.environ["MONGODB_URI"], serverSelectionTimeoutMS=10000)
+    db = client[os.environ.get("MONGODB_DATABASE", "chatbot_db")]
+    print(f"🗄️ מאגר שיחות: Mongo ({CONVERSATIONS_COLLECTION})")
+    return MongoConversationStore(db[CONVERSATIONS_COLLECTION], fallback=fallback)
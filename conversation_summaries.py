@@ -7,8 +7,14 @@
 
 import os
 import json
+import threading
+import time
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
+
+from conversation_state import ConversationState
+from metrics import metrics
+from text_matching import detect_gender, extract_name
 
 # נסה לייבא את MongoDB Manager
 try:
@@ -18,6 +24,12 @@ except ImportError:
     MONGODB_AVAILABLE = False
     print("⚠️ MongoDB לא זמין, משתמש ב-JSON בלבד")
 
+# כמה זמן תשובה של "יש/אין סיכום" (ושדות הבקרה שלו) נשמרת בזיכרון. שמירה בתהליך הזה מבטלת
+# אותה מיד; סיכום שנשמר בתהליך אחר נראה כאן לכל היותר אחרי ה-TTL
+SUMMARY_STATUS_TTL_SEC = float(os.environ.get("SUMMARY_STATUS_TTL_SEC", "60"))
+# שדות הבקרה שנשמרים במטמון (בלי טקסט הסיכום)
+_META_FIELDS = ("_id", "summary_count", "notified", "user_message_count")
+
 # חילוץ שם הלקוח מהשיחה
 def extract_customer_name(user_id: str, conversations: dict, pushname: str = "") -> str:
     # ראשית נסה להשתמש בשם מ-UltraMsg
@@ -31,13 +43,10 @@ def extract_customer_name(user_id: str, conversations: dict, pushname: str = "")
     user_messages = [msg["content"] for msg in conversations[user_id] if msg["role"] == "user"]
     
     for message in user_messages:
-        # חפש תבניות נפוצות לשמות
-        if "קוראים לי" in message or "שמי" in message or "אני" in message:
-            # נסה לחלץ שם מההודעה
-            words = message.split()
-            for i, word in enumerate(words):
-                if word in ["קוראים", "שמי", "אני"] and i + 1 < len(words):
-                    return words[i + 1]
+        # המילה שאחרי "קוראים" / "שמי" / "אני"
+        name = extract_name(message)
+        if name:
+            return name
     
     return "לא ידוע"
 
@@ -50,12 +59,10 @@ def detect_customer_gender(user_id: str, conversations: dict) -> str:
     user_messages = [msg["content"] for msg in conversations[user_id] if msg["role"] == "user"]
     
     for message in user_messages:
-        message_lower = message.lower()
         # חפש מילים שמעידות על מין
-        if any(word in message_lower for word in ["אני גבר", "אני בן", "זכר", "גבר"]):
-            return "זכר"
-        elif any(word in message_lower for word in ["אני אישה", "אני בת", "נקבה", "אישה"]):
-            return "נקבה"
+        gender = detect_gender(message)
+        if gender:
+            return gender
     
     return "לא ידוע"
 
@@ -63,6 +70,10 @@ class ConversationSummaries:
     def __init__(self, summaries_file="conversation_summaries.json"):
         self.summaries_file = summaries_file
         self.summaries = self.load_summaries()
+        # מטמון מצב סיכום: משתמש -> (שדות הבקרה או None אם אין סיכום, מתי נקרא)
+        self._status_cache: Dict[str, Tuple[Optional[Dict], float]] = {}
+        self._status_lock = threading.Lock()
+        self._status_pruned_at = 0.0
         # אל תינעל על מצב החיבור בזמן האתחול בלבד; בדוק דינמית בכל פעולה
         self.mongodb_available = MONGODB_AVAILABLE and mongodb_manager.is_connected()
         
@@ -105,13 +116,17 @@ class ConversationSummaries:
         with open(self.summaries_file, "w", encoding="utf-8-sig") as f:
             json.dump(self.summaries, f, ensure_ascii=False, indent=2)
     
-    def add_summary(self, user_id: str, summary: str, conversations: dict, pushname: str = ""):
-        """הוסף סיכום חדש עם מידע על תמונות"""
+    def add_summary(self, user_id: str, summary: str, conversations: dict, pushname: str = "",
+                    state: Optional[ConversationState] = None):
+        """הוסף סיכום חדש עם מידע על תמונות (state - המצב המצטבר של השיחה, אם כבר קיים)"""
         customer_name = extract_customer_name(user_id, conversations, pushname)
         customer_gender = detect_customer_gender(user_id, conversations)
         
+        if state is None:
+            state = ConversationState.from_messages(conversations.get(user_id, []))
+        
         # ספר הודעות משתמש עד כה (לצורך בקרת המשכיות שיחה)
-        user_message_count = len([m for m in conversations.get(user_id, []) if m.get("role") == "user"])
+        user_message_count = state.user_count
 
         # חשב את מונה הסיכומים (summary_count):
         # אם יש מסמך קיים במונגו – קח ממנו, אחרת קח מה-JSON; אם אין – התחל מ-1
@@ -120,7 +135,7 @@ class ConversationSummaries:
             prev_count = 0
             if MONGODB_AVAILABLE and mongodb_manager.is_connected():
                 try:
-                    existing_doc = mongodb_manager.get_summary(user_id)
+                    existing_doc = mongodb_manager.get_summary_meta(user_id)
                 except Exception:
                     existing_doc = None
                 if existing_doc and isinstance(existing_doc, dict):
@@ -133,22 +148,9 @@ class ConversationSummaries:
         except Exception:
             summary_count = 1
 
-        # ספור תמונות בשיחה לפי תוכן ההודעות
-        image_count = 0
-        image_urls = []
-        for msg in conversations.get(user_id, []):
-            if "[תמונה]" in msg.get("content", ""):
-                image_count += 1
-                # חלץ קישור לתמונה מהתוכן
-                content = msg.get("content", "")
-                if "🔗 קישור לתמונה:" in content:
-                    lines = content.split('\n')
-                    for line in lines:
-                        if "🔗 קישור לתמונה:" in line:
-                            url = line.replace("🔗 קישור לתמונה:", "").strip()
-                            if url:
-                                image_urls.append(url)
-                            break
+        # תמונות בשיחה (נספרות במצב המצטבר לפי תוכן ההודעות)
+        image_count = state.image_count
+        image_urls = list(state.image_urls)
         
         summary_data = {
             "phone_number": user_id,
@@ -156,7 +158,7 @@ class ConversationSummaries:
             "gender": customer_gender,
             "summary": summary,
             "timestamp": datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.000Z'),
-            "total_messages": len([m for m in conversations.get(user_id, []) if m["role"] in ["user", "assistant"]]),
+            "total_messages": state.total_messages,
             "image_count": image_count,
             "image_urls": image_urls,
             # שדות בקרה נוספים
@@ -180,6 +182,7 @@ class ConversationSummaries:
                         mongodb_manager.save_summary(user_id, summary_data)
         except Exception as e:
             print(f"⚠️ שמירה ל-MongoDB נכשלה, נשמר רק ב-JSON. שגיאה: {e}")
+        self.invalidate_summary_status(user_id)
         
         print(f"✅ סיכום נשמר עבור {customer_name} ({user_id}) עם {image_count} תמונות")
     
@@ -193,6 +196,46 @@ class ConversationSummaries:
         
         # גיבוי ל-JSON
         return self.summaries.get(user_id)
+
+    def get_summary_meta(self, user_id: str) -> Optional[Dict]:
+        """
+        שדות הבקרה של הסיכום (summary_count, notified, user_message_count) או None אם אין סיכום -
+        למי שצריך לדעת אם יש סיכום ולא את הטקסט. גם "אין סיכום" נשמר במטמון, כך שהודעות
+        נכנסות לא שולחות שאילתה בכל פעם.
+        """
+        now = time.time()
+        with self._status_lock:
+            cached = self._status_cache.get(user_id)
+        if cached is not None and now - cached[1] < SUMMARY_STATUS_TTL_SEC:
+            metrics.incr("summary_status.hits")
+            return cached[0]
+        metrics.incr("summary_status.misses")
+
+        meta = None
+        if self.mongodb_available:
+            meta = mongodb_manager.get_summary_meta(user_id)
+        if not meta:
+            # גיבוי ל-JSON
+            local = self.summaries.get(user_id)
+            meta = {field: local[field] for field in _META_FIELDS if field in local} if local else None
+        with self._status_lock:
+            self._status_cache[user_id] = (meta, now)
+            if now - self._status_pruned_at >= SUMMARY_STATUS_TTL_SEC:
+                # רשומות שפג תוקפן ממילא נקראות מחדש - מסירים אותן כדי שהמטמון לא יגדל עם כל משתמש
+                self._status_pruned_at = now
+                expired = [u for u, (_, at) in self._status_cache.items() if now - at >= SUMMARY_STATUS_TTL_SEC]
+                for expired_user in expired:
+                    del self._status_cache[expired_user]
+        return meta
+
+    def has_summary(self, user_id: str) -> bool:
+        """האם כבר קיים סיכום למשתמש (דרך מטמון המצב)"""
+        return self.get_summary_meta(user_id) is not None
+
+    def invalidate_summary_status(self, user_id: str) -> None:
+        """ביטול מצב הסיכום השמור של משתמש - אחרי כל שמירה/מחיקה של סיכום"""
+        with self._status_lock:
+            self._status_cache.pop(user_id, None)
     
     def get_all_summaries(self):
         """קבל את כל הסיכומים"""
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+מדיניות צבירה אדפטיבית: חלון ההמתנה נלמד מקצב ההקלדה של כל שולח ונסגר מוקדם כשההודעה נראית גמורה
+"""
+
+import statistics
+import threading
+from collections import deque
+from typing import Deque, Dict
+
+# הודעות שמסתיימות כך נחשבות גמורות
+FINISHED_SUFFIXES = ("?", "؟")
+# הודעה ארוכה לפחות כך נחשבת משפט שלם
+LONG_MESSAGE_CHARS = 80
+# פער גדול מזה בין הודעות = שיחה נפרדת, לא נכנס ללימוד הקצב
+SESSION_GAP_SEC = 120.0
+# כמה זמני הודעה אחרונים נשמרים לכל שולח
+HISTORY_SIZE = 12
+
+
+def looks_finished(message: str) -> bool:
+    """האם ההודעה האחרונה נראית כמו שאלה/משפט שלם שאין טעם לחכות אחריו"""
+    text = (message or "").strip()
+    if not text or text.startswith("["):
+        # placeholder של מדיה (תמונה/קובץ) - בדרך כלל מגיע אחריו טקסט
+        return False
+    if text.endswith(FINISHED_SUFFIXES):
+        return True
+    return len(text) >= LONG_MESSAGE_CHARS
+
+
+def median_gap(stamps):
+    """חציון הפער בין הודעות רצופות (פערים של שיחה נפרדת לא נספרים), או None"""
+    gaps = [b - a for a, b in zip(stamps, stamps[1:]) if 0 <= b - a <= SESSION_GAP_SEC]
+    return statistics.median(gaps) if gaps else None
+
+
+class AdaptiveDebouncePolicy:
+    def __init__(self, min_wait: float, max_wait: float, default_wait: float,
+                 finished_wait: float, gap_multiplier: float):
+        """
+        min_wait/max_wait - גבולות חלון ההמתנה אחרי הודעה.
+        max_wait נמדד גם מההודעה הראשונה ברצף, כך שמשתמש פטפטן לא ידחה את התשובה לנצח.
+        """
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+        self.default_wait = default_wait
+        self.finished_wait = finished_wait
+        self.gap_multiplier = gap_multiplier
+        self._lock = threading.Lock()
+        self._history: Dict[str, Deque[float]] = {}
+        self._burst_started: Dict[str, float] = {}
+        self._pruned_at = 0.0
+
+    def typical_gap(self, sender: str):
+        """חציון הפער בין הודעות רצופות של השולח, או None אם אין מספיק נתונים"""
+        with self._lock:
+            stamps = list(self._history.get(sender, ()))
+        return median_gap(stamps)
+
+    def next_wait(self, sender: str, message: str, now: float) -> float:
+        """רשום הודעה חדשה והחזר כמה שניות לחכות מעכשיו לפני flush"""
+        with self._lock:
+            history = self._history.get(sender)
+            if history is None:
+                history = self._history[sender] = deque(maxlen=HISTORY_SIZE)
+            history.append(now)
+            burst_start = self._burst_started.setdefault(sender, now)
+            stamps = list(history)
+            if now - self._pruned_at >= SESSION_GAP_SEC:
+                self._prune_locked(now)
+        return self.wait_for(stamps, burst_start, message, now)
+
+    def wait_for(self, stamps, burst_start: float, message: str, now: float) -> float:
+        """
+        חלון ההמתנה לפי זמני ההודעות האחרונות (כולל הנוכחית) ותחילת הרצף - בלי מצב מקומי,
+        למאגר צבירה משותף שבו ההיסטוריה נשמרת במסד
+        """
+        gap = median_gap(stamps)
+        wait = self.default_wait if gap is None else gap * self.gap_multiplier
+        wait = min(max(wait, self.min_wait), self.max_wait)
+
+        if looks_finished(message):
+            wait = min(wait, self.finished_wait)
+
+        # תקרה מוחלטת מתחילת הרצף
+        return max(0.0, min(wait, burst_start + self.max_wait - now))
+
+    def last_message_at(self, sender: str):
+        """זמן ההודעה האחרונה שנרשמה לשולח, או None"""
+        with self._lock:
+            history = self._history.get(sender)
+            return history[-1] if history else None
+
+    def resume_burst(self, sender: str, started_at: float) -> None:
+        """החזר רצף שנסגר (תור שבוטל ואוחד לבא) - תחילת הרצף נשארת המוקדמת מביניהם"""
+        with self._lock:
+            current = self._burst_started.get(sender)
+            self._burst_started[sender] = started_at if current is None else min(current, started_at)
+
+    def end_burst(self, sender: str):
+        """סגור את הרצף הנוכחי (אחרי flush) והחזר את זמן תחילתו"""
+        with self._lock:
+            return self._burst_started.pop(sender, None)
+
+    def _prune_locked(self, now: float) -> None:
+        """
+        הסר היסטוריה של שולחים בסרק יותר מ-SESSION_GAP_SEC בלי רצף פתוח (הנעילה מוחזקת) -
+        ההודעה הבאה שלהם ממילא פותחת שיחה נפרדת, והמילון לא גדל עם כל שולח שאי פעם כתב
+        """
+        self._pruned_at = now
+        idle = [s for s, h in self._history.items()
+                if s not in self._burst_started and (not h or now - h[-1] > SESSION_GAP_SEC)]
+        for sender in idle:
+            del self._history[sender]
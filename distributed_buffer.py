@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+מאגר צבירה (debounce) משותף ב-Mongo: קטעי ההודעות של כל שולח ומועד ה-flush שלו (due_at,
+כמו ב-wa_sessions) נשמרים במסמך באוסף wa_buffers, כך שכל worker יכול לקבל הודעות מכל שולח.
+
+כל worker שהגיע מועד ה-flush אצלו מנסה "לתפוס" את המאגר ב-find_one_and_update אטומי:
+התפיסה מעבירה את ההודעות ל-inflight ונותנת חכירה (lease) עד lease_until - רק worker אחד
+מצליח, ולכן התשובה נשלחת פעם אחת. בסיום החכירה משתחררת; worker שנפל באמצע משאיר
+inflight עם חכירה שפגה, ו-worker אחר תופס אותו מחדש (כולל הודעות שהצטברו בינתיים).
+
+כל הזמנים בשניות (time.time()).
+"""
+
+import os
+import socket
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from pymongo import ReturnDocument
+
+from metrics import metrics
+
+BUFFERS_COLLECTION = os.environ.get("MONGODB_BUFFERS_COLLECTION", "wa_buffers")
+
+
+class MongoMessageBuffer:
+    def __init__(self, collection, lease_sec: float, history_size: int):
+        """
+        lease_sec - כמה זמן worker מחזיק מאגר שתפס (GPT + TTS + שליחה) לפני שאחר רשאי לתפוס מחדש.
+        history_size - כמה זמני הודעה אחרונים נשמרים לכל שולח (ללימוד הקצב האדפטיבי).
+        """
+        self.collection = collection
+        self.lease_sec = float(lease_sec)
+        self.history_size = int(history_size)
+        # מזהה ה-worker הזה (מופיע ב-lease_owner)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.collection.create_index("due_at")
+        self.collection.create_index("lease_until")
+
+    # --- הוספה ---
+
+    def append(self, sender: str, message: str, now: float, provisional_wait: float) -> Dict:
+        """
+        הוסף קטע למאגר של השולח. מועד ה-flush נקבע זמנית ל-provisional_wait (התקרה) עד
+        ש-set_due מעדכן אותו לפי המדיניות. מחזיר {"stamps", "burst_start", "version"}.
+        """
+        doc = self.collection.find_one_and_update(
+            {"_id": sender},
+            {
+                "$push": {"messages": message, "stamps": {"$each": [now], "$slice": -self.history_size}},
+                "$min": {"burst_start": now},
+                "$set": {"last_message_at": now, "due_at": now + provisional_wait},
+                "$inc": {"version": 1},
+            },
+            projection={"stamps": 1, "burst_start": 1, "version": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        metrics.incr("debounce.appended")
+        return doc
+
+    def set_due(self, sender: str, due_at: float, version: int) -> None:
+        """מועד ה-flush לפי המדיניות - רק אם לא נוספה מאז הודעה חדשה (שקובעת מועד משלה)"""
+        self.collection.update_one({"_id": sender, "version": version}, {"$set": {"due_at": due_at}})
+
+    def set_reply_mode(self, sender: str, mode: str) -> None:
+        """מצב התשובה (טקסט/אודיו) נשמר עם המאגר ונלקח איתו בתפיסה"""
+        self.collection.update_one({"_id": sender}, {"$set": {"reply_mode": mode}}, upsert=True)
+
+    def has_pending(self, sender: str) -> bool:
+        """האם יש קטעים שעוד לא נתפסו (הלקוח ממשיך להקליד)"""
+        return self.collection.find_one({"_id": sender, "messages.0": {"$exists": True}}, {"_id": 1}) is not None
+
+    def due_in(self, sender: str, now: float) -> Optional[float]:
+        """כמה שניות עד מועד ה-flush של השולח, או None אם אין מה לשלוח"""
+        doc = self.collection.find_one({"_id": sender, "messages.0": {"$exists": True}}, {"due_at": 1})
+        if not doc or doc.get("due_at") is None:
+            return None
+        return doc["due_at"] - now
+
+    # --- תפיסה וחכירה ---
+
+    def claim(self, sender: str, now: float) -> Optional[Dict]:
+        """תפוס את המאגר של שולח מסוים אם הגיע מועדו ואין עליו חכירה בתוקף"""
+        return self._claim({"_id": sender, **self._claimable(now)}, now)
+
+    def claim_next(self, now: float) -> Optional[Dict]:
+        """תפוס מאגר כלשהו שמועדו עבר (או שה-worker שלו נפל) - לסריקת הגיבוי"""
+        return self._claim(self._claimable(now), now)
+
+    def requeue(self, sender: str, messages: List[str], reply_mode: Optional[str],
+                burst_start: Optional[float], due_at: float) -> None:
+        """
+        תור שבוטל (הלקוח המשיך להקליד): ההודעות חוזרות לראש המאגר והחכירה משתחררת.
+        due_at - מועד flush גיבוי, רק אם ההודעה החדשה לא קבעה מועד משלה.
+        """
+        stage = {
+            "messages": {"$concatArrays": [{"$literal": list(messages)}, {"$ifNull": ["$messages", []]}]},
+            "reply_mode": {"$ifNull": ["$reply_mode", {"$literal": reply_mode}]},
+            "due_at": {"$ifNull": ["$due_at", due_at]},
+        }
+        if burst_start:
+            stage["burst_start"] = {"$min": [{"$ifNull": ["$burst_start", burst_start]}, burst_start]}
+        self.collection.update_one(
+            {"_id": sender, "lease_owner": self.owner},
+            [{"$set": stage}, {"$unset": _LEASE_FIELDS}],
+        )
+
+    def complete(self, sender: str, now: float) -> Optional[float]:
+        """
+        שחרר את החכירה בסיום ה-flush. מחזיר בעוד כמה שניות מועד ה-flush הבא אם בינתיים
+        הצטברו הודעות חדשות (שלא נתפסו כי המאגר היה חכור), אחרת None.
+        """
+        doc = self.collection.find_one_and_update(
+            {"_id": sender, "lease_owner": self.owner},
+            {"$unset": {field: "" for field in _LEASE_FIELDS}},
+            projection={"messages": {"$slice": 1}, "due_at": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc and doc.get("messages") and doc.get("due_at") is not None:
+            return doc["due_at"] - now
+        return None
+
+    def stats(self) -> Dict:
+        now = time.time()
+        return {
+            "owner": self.owner,
+            "lease_sec": self.lease_sec,
+            "pending": self.collection.count_documents({"messages.0": {"$exists": True}}),
+            "leased": self.collection.count_documents({"lease_until": {"$gt": now}}),
+            "claims": metrics.get("debounce.claims"),
+            "reclaimed": metrics.get("debounce.reclaimed"),
+        }
+
+    # --- פנימי ---
+
+    def _claimable(self, now: float) -> Dict:
+        # מועד עבר ויש הודעות, או inflight של worker שהחכירה שלו פגה; ובכל מקרה - אין חכירה בתוקף
+        return {
+            "$and": [
+                {"$or": [{"due_at": {"$lte": now}, "messages.0": {"$exists": True}},
+                         {"inflight.0": {"$exists": True}}]},
+                {"$or": [{"lease_until": {"$exists": False}}, {"lease_until": {"$lte": now}}]},
+            ]
+        }
+
+    def _claim(self, query: Dict, now: float) -> Optional[Dict]:
+        # עדכון pipeline: כל הביטויים בשלב הראשון רואים את המסמך לפני השינוי
+        doc = self.collection.find_one_and_update(
+            query,
+            [
+                {"$set": {
+                    "reclaimed": {"$gt": [{"$size": {"$ifNull": ["$inflight", []]}}, 0]},
+                    "inflight": {"$concatArrays": [{"$ifNull": ["$inflight", []]}, {"$ifNull": ["$messages", []]}]},
+                    "inflight_mode": {"$ifNull": ["$inflight_mode", "$reply_mode"]},
+                    "inflight_burst_start": {"$ifNull": ["$inflight_burst_start", "$burst_start"]},
+                    "messages": {"$literal": []},
+                    "lease_owner": self.owner,
+                    "lease_until": now + self.lease_sec,
+                }},
+                {"$unset": ["reply_mode", "burst_start", "due_at"]},
+            ],
+            sort=[("due_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc is None:
+            return None
+        metrics.incr("debounce.claims")
+        if doc.get("reclaimed"):
+            metrics.incr("debounce.reclaimed")
+            print(f"♻️ מאגר של {doc['_id']} נתפס מחדש אחרי שחכירה פגה")
+        return {
+            "sender": doc["_id"],
+            "messages": doc.get("inflight", []),
+            "reply_mode": doc.get("inflight_mode"),
+            "burst_start": doc.get("inflight_burst_start"),
+            "last_message_at": doc.get("last_message_at"),
+        }
+
+
+_LEASE_FIELDS = ["inflight", "inflight_mode", "inflight_burst_start", "reclaimed", "lease_owner", "lease_until"]
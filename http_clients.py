@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+מאגר לקוחות HTTP משותף: session אחד עם keep-alive ומאגר חיבורים לכל שירות חיצוני,
+וזמני timeout מפורשים (התחברות/קריאה) כך ששירות איטי לא תוקע worker לנצח.
+
+הגדרה לכל שירות דרך משתני סביבה, למשל:
+    HTTP_ULTRAMSG_POOL_SIZE=20
+    HTTP_ULTRAMSG_CONNECT_TIMEOUT=5
+    HTTP_ULTRAMSG_READ_TIMEOUT=30
+"""
+
+import os
+import threading
+import time
+from typing import Dict, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import metrics
+
+# ברירות מחדל לכל שירות: (גודל מאגר, timeout התחברות, timeout קריאה)
+UPSTREAM_DEFAULTS = {
+    "openai": (20, 5.0, 60.0),
+    "ultramsg": (20, 5.0, 30.0),
+    "elevenlabs": (10, 5.0, 60.0),
+    "cloudinary": (10, 5.0, 60.0),
+    "media": (10, 5.0, 60.0),
+}
+
+
+class UpstreamConfig:
+    __slots__ = ("name", "pool_size", "connect_timeout", "read_timeout")
+
+    def __init__(self, name: str):
+        """קריאת הגדרות שירות ממשתני הסביבה (עם ברירות המחדל למעלה)"""
+        pool_size, connect_timeout, read_timeout = UPSTREAM_DEFAULTS.get(name, (10, 5.0, 30.0))
+        prefix = f"HTTP_{name.upper()}_"
+        self.name = name
+        self.pool_size = int(os.environ.get(prefix + "POOL_SIZE", pool_size))
+        self.connect_timeout = float(os.environ.get(prefix + "CONNECT_TIMEOUT", connect_timeout))
+        self.read_timeout = float(os.environ.get(prefix + "READ_TIMEOUT", read_timeout))
+
+    @property
+    def timeout(self) -> Tuple[float, float]:
+        return (self.connect_timeout, self.read_timeout)
+
+    def as_dict(self) -> Dict:
+        return {
+            "pool_size": self.pool_size,
+            "connect_timeout": self.connect_timeout,
+            "read_timeout": self.read_timeout,
+        }
+
+
+class HttpClientRegistry:
+    def __init__(self):
+        """sessions נוצרים בעצלות, פעם אחת לכל שירות"""
+        self._lock = threading.Lock()
+        self._configs: Dict[str, UpstreamConfig] = {}
+        self._sessions: Dict[str, requests.Session] = {}
+        self._openai_clients: Dict[str, object] = {}
+
+    def config(self, upstream: str) -> UpstreamConfig:
+        """הגדרות השירות (pool ו-timeouts)"""
+        with self._lock:
+            cfg = self._configs.get(upstream)
+            if cfg is None:
+                cfg = self._configs[upstream] = UpstreamConfig(upstream)
+            return cfg
+
+    def session(self, upstream: str) -> requests.Session:
+        """session משותף עם keep-alive עבור השירות"""
+        with self._lock:
+            session = self._sessions.get(upstream)
+            if session is not None:
+                return session
+        cfg = self.config(upstream)
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=cfg.pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        with self._lock:
+            # ייתכן ש-thread אחר הקדים אותנו
+            return self._sessions.setdefault(upstream, session)
+
+    def request(self, upstream: str, method: str, url: str, **kwargs) -> requests.Response:
+        """בקשה דרך ה-session של השירות; timeout ברירת מחדל מההגדרות אם לא הועבר"""
+        kwargs.setdefault("timeout", self.config(upstream).timeout)
+        started = time.time()
+        try:
+            response = self.session(upstream).request(method, url, **kwargs)
+        except requests.Timeout:
+            metrics.incr(f"http.{upstream}.timeouts")
+            raise
+        except requests.RequestException:
+            metrics.incr(f"http.{upstream}.errors")
+            raise
+        metrics.observe(f"http.{upstream}.latency_sec", time.time() - started)
+        return response
+
+    def get(self, upstream: str, url: str, **kwargs) -> requests.Response:
+        return self.request(upstream, "GET", url, **kwargs)
+
+    def post(self, upstream: str, url: str, **kwargs) -> requests.Response:
+        return self.request(upstream, "POST", url, **kwargs)
+
+    def openai_client(self, api_key: str):
+        """לקוח OpenAI משותף (לכל מפתח) עם מאגר חיבורי httpx ו-timeouts מההגדרות"""
+        with self._lock:
+            existing = self._openai_clients.get(api_key)
+            if existing is not None:
+                return existing
+
+        import httpx
+        from openai import OpenAI
+
+        cfg = self.config("openai")
+        http_client = httpx.Client(
+            limits=httpx.Limits(max_connections=cfg.pool_size, max_keepalive_connections=cfg.pool_size),
+            timeout=httpx.Timeout(cfg.read_timeout, connect=cfg.connect_timeout),
+        )
+        client = OpenAI(api_key=api_key, http_client=http_client)
+        with self._lock:
+            return self._openai_clients.setdefault(api_key, client)
+
+    def cloudinary_options(self) -> Dict:
+        """
+        אפשרויות timeout להעלאה ל-Cloudinary. ה-SDK מחזיק מאגר urllib3 משלו,
+        כך שכאן מוגדר רק ה-timeout (ערך אחד לכל הבקשה).
+        """
+        cfg = self.config("cloudinary")
+        return {"timeout": cfg.connect_timeout + cfg.read_timeout}
+
+    def stats(self) -> Dict:
+        """הגדרות השירותים שכבר בשימוש"""
+        with self._lock:
+            configs = dict(self._configs)
+            active = set(self._sessions) | ({"openai"} if self._openai_clients else set())
+        return {name: dict(cfg.as_dict(), active=name in active) for name, cfg in configs.items()}
+
+
+# יצירת מופע גלובלי
+http_clients = HttpClientRegistry()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+בחירת מוביל (leader) בחכירה ב-Mongo, כדי שמשימות הסקד'ולר ירוצו בתהליך אחד בלבד גם כשהוא
+מופעל בכמה מקומות (ENABLE_SCHEDULER בשירות ה-Web, start_auto_summary_thread, worker_min.py,
+כמה מופעים של כל אחד).
+
+מסמך אחד לכל תפקיד באוסף wa_leader: {_id: "<תפקיד>", owner, lease_until, acquired_at, heartbeat_at}.
+המוביל מחדש את החכירה כל lease_sec/3 מ-thread נפרד (start), כך שמשימה ארוכה בסקד'ולר לא
+מפילה את החכירה; כל השאר מנסים לתפוס אותה באותו קצב, ומצליחים רק כשהיא פגה - כך שמוביל
+שנפל מוחלף תוך lease_sec (+ מחזור חידוש אחד). משימה ארוכה בודקת is_leader() בין צעדים.
+
+כל הזמנים בשניות (time.time()).
+"""
+
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Dict, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from metrics import metrics
+
+LEADER_COLLECTION = os.environ.get("MONGODB_LEADER_COLLECTION", "wa_leader")
+LEADER_LEASE_SEC = float(os.environ.get("LEADER_LEASE_SEC", "30"))
+
+
+class LeaderLease:
+    def __init__(self, collection, role: str, lease_sec: float = LEADER_LEASE_SEC):
+        """
+        role - שם התפקיד (מסמך החכירה), למשל "scheduler".
+        lease_sec - זמן ה-failover: אחרי כמה שניות בלי חידוש מוביל אחר רשאי לתפוס.
+        """
+        self.collection = collection
+        self.role = role
+        self.lease_sec = float(lease_sec)
+        self.renew_every = self.lease_sec / 3
+        # מזהה התהליך הזה (מופיע ב-owner)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        # עד מתי החכירה שלנו בתוקף לפי מה שכתבנו (0 = לא מובילים)
+        self._held_until = 0.0
+        self._next_attempt = 0.0
+        self.leader_since: Optional[float] = None
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """הפעל את thread החידוש (פעם אחת בלבד) - רץ ללא תלות במשימות של הסקד'ולר"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._keepalive, name=f"leader-{self.role}", daemon=True)
+            self._thread.start()
+
+    def is_leader(self, now: Optional[float] = None) -> bool:
+        """האם התהליך הזה המוביל כרגע (לפי החכירה האחרונה שחודשה בהצלחה)"""
+        return (now or time.time()) < self._held_until
+
+    def heartbeat(self, now: Optional[float] = None) -> bool:
+        """
+        חידוש/תפיסת החכירה אם הגיע הזמן (לכל היותר פעם ב-renew_every); מחזיר האם אנחנו המוביל.
+        שגיאת Mongo לא מפילה את הסקד'ולר - פשוט לא מובילים עד הניסיון הבא.
+        """
+        now = now or time.time()
+        if now < self._next_attempt:
+            return self.is_leader(now)
+        self._next_attempt = now + self.renew_every
+        was_leader = self.is_leader(now)
+        try:
+            acquired = self._try_acquire(now)
+        except Exception as e:
+            print(f"⚠️ חידוש חכירת המוביל ({self.role}) נכשל: {e}", flush=True)
+            acquired = False
+        if acquired:
+            self._held_until = now + self.lease_sec
+            if not was_leader:
+                self.leader_since = now
+                metrics.incr("leader.elected")
+                print(f"👑 {self.owner} הוא המוביל של {self.role}", flush=True)
+        else:
+            self._held_until = 0.0
+            self.leader_since = None
+            if was_leader:
+                metrics.incr("leader.lost")
+                print(f"⚠️ {self.owner} איבד את ההובלה של {self.role}", flush=True)
+        return acquired
+
+    def seconds_to_next_heartbeat(self, now: Optional[float] = None) -> float:
+        """כמה זמן עד החידוש (או ניסיון התפיסה) הבא"""
+        return max(0.0, self._next_attempt - (now or time.time()))
+
+    def resign(self) -> None:
+        """ויתור על ההובלה (כיבוי מסודר) - מוביל אחר יתפוס בלי לחכות שהחכירה תפוג"""
+        self.collection.delete_one({"_id": self.role, "owner": self.owner})
+        self._held_until = 0.0
+        self.leader_since = None
+
+    def current(self) -> Dict:
+        """מי המוביל לפי Mongo - ל-/health"""
+        doc = self.collection.find_one({"_id": self.role}) or {}
+        now = time.time()
+        lease_until = doc.get("lease_until")
+        return {
+            "role": self.role,
+            "leader": doc.get("owner") if lease_until and lease_until > now else None,
+            "lease_expires_in": round(lease_until - now, 1) if lease_until else None,
+            "self": self.owner,
+            "is_self": self.is_leader(now),
+            "lease_sec": self.lease_sec,
+        }
+
+    # --- פנימי ---
+
+    def _keepalive(self) -> None:
+        while True:
+            self.heartbeat()
+            time.sleep(self.seconds_to_next_heartbeat() or self.renew_every)
+
+    def _try_acquire(self, now: float) -> bool:
+        # תופסים אם אנחנו כבר הבעלים או שהחכירה פגה; אחרת ה-upsert נכשל על _id קיים
+        try:
+            doc = self.collection.find_one_and_update(
+                {"_id": self.role, "$or": [{"owner": self.owner}, {"lease_until": {"$lte": now}}]},
+                {"$set": {"owner": self.owner, "lease_until": now + self.lease_sec, "heartbeat_at": now},
+                 "$setOnInsert": {"acquired_at": now}},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE,
+            )
+        except DuplicateKeyError:
+            return False
+        if doc is not None and doc.get("owner") != self.owner:
+            # החכירה של מוביל קודם פגה - מתעדים את מועד ההחלפה
+            self.collection.update_one({"_id": self.role, "owner": self.owner}, {"$set": {"acquired_at": now}})
+            if doc.get("owner"):
+                metrics.incr("leader.failovers")
+        return True
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+מדדי ביצועים פנימיים (מונים, מדדים רגעיים והתפלגויות זמנים) - נחשפים דרך /metrics
+"""
+
+import threading
+from collections import deque
+from typing import Callable, Dict, Iterable
+
+# כמה דגימות אחרונות נשמרות לכל התפלגות (חלון נע)
+SAMPLE_WINDOW = 2000
+
+
+def percentile(values: Iterable[float], pct: float) -> float:
+    """אחוזון (nearest-rank) של רשימת ערכים"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    idx = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        """אתחול מאגר מדדים משותף לכל התהליך"""
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {}
+        self._gauges: Dict[str, Callable[[], object]] = {}
+        self._samples: Dict[str, deque] = {}
+        self._sample_counts: Dict[str, int] = {}
+
+    def incr(self, name: str, amount: int = 1) -> None:
+        """הגדל מונה בשם נתון"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def get(self, name: str) -> int:
+        """קבל ערך מונה נוכחי"""
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def observe(self, name: str, value: float) -> None:
+        """רשום דגימה להתפלגות (למשל זמן עד תשובה ראשונה בשניות)"""
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=SAMPLE_WINDOW)
+            samples.append(value)
+            self._sample_counts[name] = self._sample_counts.get(name, 0) + 1
+
+    def distribution(self, name: str) -> Dict:
+        """סיכום התפלגות: מספר דגימות, p50, p95 ומקסימום (על החלון הנע)"""
+        with self._lock:
+            values = list(self._samples.get(name, ()))
+            count = self._sample_counts.get(name, 0)
+        return {
+            "count": count,
+            "p50": round(percentile(values, 50), 3),
+            "p95": round(percentile(values, 95), 3),
+            "max": round(max(values), 3) if values else 0.0,
+        }
+
+    def register_gauge(self, name: str, fn: Callable[[], object]) -> None:
+        """רשום מדד רגעי שמחושב בזמן הקריאה (למשל עומק תור)"""
+        with self._lock:
+            self._gauges[name] = fn
+
+    def snapshot(self) -> Dict:
+        """צילום מצב של כל המדדים"""
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            sample_names = list(self._samples)
+
+        values = {}
+        for name, fn in gauges.items():
+            try:
+                values[name] = fn()
+            except Exception as e:
+                values[name] = f"error: {e}"
+
+        distributions = {name: self.distribution(name) for name in sample_names}
+        return {"counters": counters, "gauges": values, "distributions": distributions}
+
+
+# יצירת מופע גלובלי
+metrics = MetricsRegistry()
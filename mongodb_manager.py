@@ -16,6 +16,9 @@ from dotenv import load_dotenv
 # טען משתני סביבה
 load_dotenv()
 
+# שדות הבקרה של מסמך סיכום - למי שצריך לדעת אם יש סיכום ומה מצבו, בלי הטקסט עצמו
+SUMMARY_META_PROJECTION = {"_id": 1, "summary_count": 1, "notified": 1, "user_message_count": 1}
+
 class MongoDBManager:
     def __init__(self):
         """אתחול חיבור ל-MongoDB"""
@@ -309,7 +312,34 @@ class MongoDBManager:
         except Exception as e:
             print(f"❌ שגיאה בקבלת סיכום מ-MongoDB: {e}")
             return None
-    
+
+    def get_summary_meta(self, user_id: str) -> Optional[Dict]:
+        """קבל רק את שדות הבקרה של הסיכום (summary_count, notified, user_message_count) בלי טקסט הסיכום"""
+        if not self.is_connected():
+            return None
+
+        try:
+            return self.collection.find_one({"phone_number": user_id}, SUMMARY_META_PROJECTION)
+        except Exception as e:
+            print(f"❌ שגיאה בקבלת פרטי סיכום מ-MongoDB: {e}")
+            return None
+
+    def get_summaries_by_phone(self, user_ids: List[str], fields: Optional[List[str]] = None) -> Dict[str, Dict]:
+        """קבל סיכומים של כמה משתמשים בשאילתת $in אחת (מפתח: מספר טלפון); fields מגביל את השדות"""
+        if not user_ids or not self.is_connected():
+            return {}
+
+        try:
+            projection = None
+            if fields:
+                projection = {field: 1 for field in fields}
+                projection["phone_number"] = 1
+            docs = self.collection.find({"phone_number": {"$in": list(user_ids)}}, projection)
+            return {doc["phone_number"]: doc for doc in docs}
+        except Exception as e:
+            print(f"❌ שגיאה בקבלת סיכומים מ-MongoDB: {e}")
+            return {}
+
     def get_all_summaries(self) -> List[Dict]:
         """קבל את כל סיכומי השיחה"""
         if not self.is_connected():
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+שולח הודעות יוצאות: תור FIFO לכל נמען (הודעות לאותו משתמש יוצאות לפי הסדר),
+קצב גלובלי לפי token bucket שמותאם ל-instance של UltraMsg, ניסיונות חוזרים עם
+השהיה אקספוננציאלית אקראית, ורישום הודעות שנכשלו סופית ל-dead letter.
+"""
+
+import json
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Callable, Deque, Dict, Optional
+
+from metrics import metrics
+from timer_wheel import DeadlineScheduler
+from work_queue import BoundedWorkQueue
+
+# אורך מקסימלי של פרמטר שנשמר ב-dead letter
+DEAD_LETTER_ARG_CHARS = 2000
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        """rate - אסימונים לשנייה, capacity - גודל פרץ מקסימלי"""
+        self.rate = max(0.001, float(rate))
+        self.capacity = max(1.0, float(capacity))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> float:
+        """קח אסימון; מחזיר 0 אם הצליח, אחרת כמה שניות לחכות לאסימון הבא"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return 0.0
+            return (1.0 - self._tokens) / self.rate
+
+
+class OutboundJob:
+    __slots__ = ("recipient", "kind", "send_fn", "args", "fallback", "on_sent", "attempts", "enqueued_at", "last_error")
+
+    def __init__(self, recipient: str, kind: str, send_fn: Callable, args: tuple,
+                 fallback: Optional["OutboundJob"] = None, on_sent: Optional[Callable] = None):
+        self.recipient = recipient
+        self.kind = kind
+        self.send_fn = send_fn
+        self.args = args
+        self.fallback = fallback
+        self.on_sent = on_sent
+        self.attempts = 0
+        self.enqueued_at = time.time()
+        self.last_error = None
+
+
+class OutboundDispatcher:
+    def __init__(self, name: str, rate_per_sec: float, burst: int, max_attempts: int,
+                 backoff_base: float, backoff_max: float, dead_letter_path: str,
+                 workers: int, queue_size: int = 1000):
+        """
+        send_fn של כל הודעה מחזיר True בהצלחה; False או חריגה נחשבים כישלון ומנוסים שוב.
+        בזמן המתנה לניסיון חוזר התור של הנמען עצור, כדי שהסדר יישמר.
+        """
+        self.name = name
+        self.bucket = TokenBucket(rate_per_sec, burst)
+        self.max_attempts = max(1, int(max_attempts))
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.dead_letter_path = dead_letter_path
+        self._executor = BoundedWorkQueue(name, queue_size, workers)
+        self._scheduler = DeadlineScheduler(f"{name}_pacer", self._executor)
+        self._lock = threading.Lock()
+        self._dead_letter_lock = threading.Lock()
+        self._lanes: Dict[str, Deque[OutboundJob]] = {}
+
+        metrics.register_gauge(f"{name}.pending", self.pending)
+        metrics.register_gauge(f"{name}.recipients", lambda: len(self._lanes))
+
+    def enqueue(self, recipient: str, kind: str, send_fn: Callable, *args,
+                fallback: Optional[OutboundJob] = None, on_sent: Optional[Callable] = None) -> None:
+        """הוסף הודעה לתור של הנמען"""
+        job = OutboundJob(recipient, kind, send_fn, args, fallback, on_sent)
+        with self._lock:
+            lane = self._lanes.get(recipient)
+            start = lane is None
+            if start:
+                lane = self._lanes[recipient] = deque()
+            lane.append(job)
+        metrics.incr(f"{self.name}.enqueued")
+        if start:
+            # הנמען לא היה פעיל - אין ריצה מתוזמנת עבורו, מתחילים עכשיו
+            self._scheduler.schedule(recipient, 0, self._run_head, recipient)
+
+    def pending(self) -> int:
+        """מספר ההודעות שממתינות לשליחה בכל התורים"""
+        with self._lock:
+            return sum(len(lane) for lane in self._lanes.values())
+
+    def stats(self) -> Dict:
+        """סטטיסטיקות לניטור"""
+        return {
+            "pending": self.pending(),
+            "recipients": len(self._lanes),
+            "rate_per_sec": self.bucket.rate,
+            "burst": self.bucket.capacity,
+            "sent": metrics.get(f"{self.name}.sent"),
+            "retries": metrics.get(f"{self.name}.retries"),
+            "dead_letters": metrics.get(f"{self.name}.dead_letters"),
+            "executor": self._executor.stats(),
+        }
+
+    def _run_head(self, recipient: str) -> None:
+        with self._lock:
+            lane = self._lanes.get(recipient)
+            if not lane:
+                self._lanes.pop(recipient, None)
+                return
+            job = lane[0]
+
+        wait = self.bucket.try_acquire()
+        if wait > 0:
+            metrics.incr(f"{self.name}.paced")
+            self._scheduler.schedule(recipient, wait, self._run_head, recipient)
+            return
+
+        ok = False
+        try:
+            ok = bool(job.send_fn(*job.args))
+            if not ok:
+                job.last_error = "send returned failure"
+        except Exception as e:
+            job.last_error = str(e)
+        job.attempts += 1
+
+        if ok:
+            metrics.incr(f"{self.name}.sent")
+            metrics.observe(f"{self.name}.delivery_sec", time.time() - job.enqueued_at)
+            self._finish_head(recipient)
+            if job.on_sent:
+                try:
+                    job.on_sent()
+                except Exception as e:
+                    print(f"⚠️ שגיאה ב-callback אחרי שליחה ל-{recipient}: {e}")
+            return
+
+        if job.attempts < self.max_attempts:
+            delay = self._backoff(job.attempts)
+            metrics.incr(f"{self.name}.retries")
+            print(f"🔁 שליחת {job.kind} ל-{recipient} נכשלה ({job.last_error}), ניסיון {job.attempts + 1} בעוד {delay:.1f}s")
+            self._scheduler.schedule(recipient, delay, self._run_head, recipient)
+            return
+
+        self._dead_letter(job)
+        self._finish_head(recipient, replacement=job.fallback)
+
+    def _finish_head(self, recipient: str, replacement: Optional[OutboundJob] = None) -> None:
+        """הוצא את ההודעה שבראש התור (או החלף אותה בחלופה) והמשך לבאה"""
+        with self._lock:
+            lane = self._lanes.get(recipient)
+            if lane:
+                lane.popleft()
+                if replacement is not None:
+                    lane.appendleft(replacement)
+            if not lane:
+                self._lanes.pop(recipient, None)
+                return
+        self._scheduler.schedule(recipient, 0, self._run_head, recipient)
+
+    def _backoff(self, attempts: int) -> float:
+        """השהיה אקראית בין חצי התקרה לתקרה; התקרה מוכפלת בכל ניסיון עד backoff_max"""
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** (attempts - 1)))
+        return random.uniform(ceiling / 2, ceiling)
+
+    def _dead_letter(self, job: OutboundJob) -> None:
+        metrics.incr(f"{self.name}.dead_letters")
+        print(f"☠️ הודעת {job.kind} ל-{job.recipient} נכשלה סופית אחרי {job.attempts} ניסיונות: {job.last_error}")
+        record = {
+            "timestamp": datetime.now().isoformat(),
+            "recipient": job.recipient,
+            "kind": job.kind,
+            "attempts": job.attempts,
+            "error": job.last_error,
+            "args": [str(a)[:DEAD_LETTER_ARG_CHARS] for a in job.args],
+            "has_fallback": job.fallback is not None,
+        }
+        try:
+            with self._dead_letter_lock:
+                with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except Exception as e:
+            print(f"❌ שגיאה בכתיבת dead letter: {e}")
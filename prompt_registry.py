@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+פרומפט המערכת לפי הפניה: במקום להעתיק את כל agent_prompt.txt (כמה KB) כהודעה הראשונה
+בהיסטוריה של כל משתמש, ההיסטוריה מחזיקה הודעת system קצרה עם מזהה גרסה
+("@prompt:<גרסה>"), והטקסט עצמו מוצב רק בבניית הבקשה ל-GPT.
+
+ההפניה נפתרת תמיד לגרסה הנוכחית - כך ש-reload משפיע מיד גם על שיחות קיימות, בלי
+לכתוב מחדש היסטוריה. המזהה שנשמר מתעד עם איזו גרסה השיחה התחילה.
+"""
+
+import hashlib
+import threading
+from typing import Callable, Dict, List, Optional
+
+from metrics import metrics
+
+PROMPT_REF_PREFIX = "@prompt:"
+
+
+def prompt_version(text: str) -> str:
+    """מזהה גרסה קצר ויציב לטקסט הפרומפט"""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:12]
+
+
+def is_prompt_reference(message: Dict) -> bool:
+    """האם ההודעה היא הפניה לפרומפט המערכת (ולא הטקסט עצמו)"""
+    return message.get("role") == "system" and (message.get("content") or "").startswith(PROMPT_REF_PREFIX)
+
+
+class PromptRegistry:
+    def __init__(self, loader: Callable[[], str]):
+        """loader() מחזיר את טקסט הפרומפט העדכני (למשל מ-agent_prompt.txt)"""
+        self.loader = loader
+        self._lock = threading.Lock()
+        # גרסה -> טקסט; נשמרות כל הגרסאות שנטענו בתהליך הזה
+        self._versions: Dict[str, str] = {}
+        self.current_version: Optional[str] = None
+        self.reload()
+
+    @property
+    def text(self) -> str:
+        """טקסט הפרומפט בגרסה הנוכחית"""
+        return self._versions[self.current_version]
+
+    def reload(self) -> str:
+        """טען מחדש את הפרומפט; מחזיר את מזהה הגרסה הנוכחית"""
+        text = self.loader()
+        version = prompt_version(text)
+        with self._lock:
+            self._versions[version] = text
+            changed = version != self.current_version
+            self.current_version = version
+        if changed:
+            metrics.incr("prompt.reloads")
+        return version
+
+    def text_for(self, version: str) -> Optional[str]:
+        """הטקסט של גרסה מסוימת (אם נטענה בתהליך הזה)"""
+        return self._versions.get(version)
+
+    def reference(self) -> Dict:
+        """הודעת system שמפנה לגרסה הנוכחית - זה מה שנשמר בהיסטוריה"""
+        return {"role": "system", "content": PROMPT_REF_PREFIX + self.current_version}
+
+    def resolve(self, messages: List[Dict]) -> List[Dict]:
+        """ההודעות לבקשה: הפניה בראש ההיסטוריה מוחלפת בטקסט הנוכחי (ההיסטוריה עצמה לא משתנה)"""
+        if messages and is_prompt_reference(messages[0]):
+            return [{"role": "system", "content": self.text}] + messages[1:]
+        return messages
+
+    def normalize(self, messages: List[Dict]) -> bool:
+        """
+        הסבה של שיחה ישנה (עם הטקסט המלא בראשה) להפניה, במקום. מחזיר True אם משהו השתנה.
+        הודעת system ראשונה שאינה הפניה היא תמיד הפרומפט - אין system אחר בתחילת ההיסטוריה.
+        """
+        if not messages or messages[0].get("role") != "system" or is_prompt_reference(messages[0]):
+            return False
+        version = prompt_version(messages[0].get("content") or "")
+        with self._lock:
+            self._versions.setdefault(version, messages[0].get("content") or "")
+        messages[0] = {"role": "system", "content": PROMPT_REF_PREFIX + version}
+        metrics.incr("prompt.normalized_histories")
+        return True
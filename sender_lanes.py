@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+נתיב ביצוע לכל שולח (mailbox): עבודות של אותו משתמש רצות אחת-אחת לפי הסדר,
+ומשתמשים שונים רצים במקביל על מאגר workers משותף עם תקרת מקביליות גלובלית.
+סך העבודות שממתינות בכל הנתיבים חסום (max_backlog), כדי שקליטה מהירה לא תצבור עבודה בלי גבול
+כשהעיבוד (GPT) איטי - submit מחזיר False וה-webhook משיל.
+"""
+
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Callable, Deque, Dict, List, Set
+
+from metrics import metrics
+
+
+class SenderLanes:
+    def __init__(self, name: str, workers: int, max_backlog: int = 0):
+        """
+        workers - תקרת המקביליות הגלובלית (כמה שולחים מעובדים בו זמנית).
+        max_backlog - כמה עבודות לכל היותר ממתינות בכל הנתיבים יחד (0 = ללא הגבלה).
+        """
+        self.name = name
+        self.workers = max(1, int(workers))
+        self.max_backlog = max(0, int(max_backlog))
+        self._cond = threading.Condition()
+        self._mailboxes: Dict[str, Deque] = {}
+        # שולחים שיש להם עבודה ואינם רצים כרגע, לפי סדר הגעה (round robin)
+        self._ready: Deque[str] = deque()
+        # שולחים שנמצאים ב-_ready או רצים כרגע
+        self._scheduled: Set[str] = set()
+        self._threads: List[threading.Thread] = []
+        self._running = 0
+        self._backlog = 0
+
+        metrics.register_gauge(f"{name}.lanes", lambda: len(self._mailboxes))
+        metrics.register_gauge(f"{name}.backlog", self.backlog)
+        metrics.register_gauge(f"{name}.max_lane_backlog", self.max_lane_backlog)
+        metrics.register_gauge(f"{name}.ready", lambda: len(self._ready))
+        metrics.register_gauge(f"{name}.running", lambda: self._running)
+
+    def start(self) -> None:
+        """הפעל את ה-workers (פעם אחת בלבד)"""
+        with self._cond:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker_loop, name=f"{self.name}-lane-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+        print(f"🧵 נתיבי {self.name}: הופעלו {self.workers} workers")
+
+    def submit(self, sender: str, fn: Callable, *args) -> bool:
+        """
+        הוסף עבודה לנתיב של השולח; תרוץ אחרי כל העבודות הקודמות שלו.
+        מחזיר False (והעבודה נזרקת) אם סך העבודות הממתינות הגיע ל-max_backlog.
+        """
+        if not self._enqueue(sender, fn, args, capped=True):
+            metrics.incr(f"{self.name}.rejected")
+            return False
+        return True
+
+    def submit_followup(self, sender: str, fn: Callable, *args) -> None:
+        """
+        עבודת המשך של עבודה שכבר התקבלה (למשל flush של הודעות שכבר במאגר) - לא נדחית
+        גם מעל התקרה, אחרת ההודעות שכבר אושרו היו נתקעות
+        """
+        self._enqueue(sender, fn, args, capped=False)
+
+    def full(self) -> bool:
+        """האם התקרה של העבודות הממתינות הושגה (עבודה חדשה תידחה)"""
+        return 0 < self.max_backlog <= self._backlog
+
+    def backlog(self) -> int:
+        """סך העבודות שממתינות בכל הנתיבים"""
+        return self._backlog
+
+    def max_lane_backlog(self) -> int:
+        """העומק של הנתיב הארוך ביותר"""
+        with self._cond:
+            return max((len(m) for m in self._mailboxes.values()), default=0)
+
+    def lane_depth(self, sender: str) -> int:
+        """כמה עבודות ממתינות לשולח"""
+        with self._cond:
+            mailbox = self._mailboxes.get(sender)
+            return len(mailbox) if mailbox else 0
+
+    def queued(self, sender: str, *fns: Callable) -> int:
+        """כמה עבודות מסוג מסוים (לפי הפונקציה) ממתינות בנתיב של השולח ועוד לא התחילו"""
+        with self._cond:
+            mailbox = self._mailboxes.get(sender)
+            return sum(1 for fn, _args, _at in mailbox if fn in fns) if mailbox else 0
+
+    def stats(self) -> Dict:
+        """סטטיסטיקות לניטור"""
+        return {
+            "workers": self.workers,
+            "running": self._running,
+            "lanes": len(self._mailboxes),
+            "ready": len(self._ready),
+            "backlog": self.backlog(),
+            "max_backlog": self.max_backlog,
+            "max_lane_backlog": self.max_lane_backlog(),
+            "processed": metrics.get(f"{self.name}.processed"),
+            "failed": metrics.get(f"{self.name}.failed"),
+            "rejected": metrics.get(f"{self.name}.rejected"),
+        }
+
+    def _enqueue(self, sender: str, fn: Callable, args, capped: bool) -> bool:
+        if not self._threads:
+            self.start()
+        with self._cond:
+            if capped and self.full():
+                return False
+            mailbox = self._mailboxes.get(sender)
+            if mailbox is None:
+                mailbox = self._mailboxes[sender] = deque()
+            mailbox.append((fn, args, time.time()))
+            self._backlog += 1
+            if sender not in self._scheduled:
+                self._scheduled.add(sender)
+                self._ready.append(sender)
+                self._cond.notify()
+        metrics.incr(f"{self.name}.submitted")
+        return True
+
+    def _worker_loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._ready:
+                    self._cond.wait()
+                sender = self._ready.popleft()
+                fn, args, submitted_at = self._mailboxes[sender].popleft()
+                self._backlog -= 1
+                self._running += 1
+
+            metrics.observe(f"{self.name}.wait_sec", time.time() - submitted_at)
+            try:
+                fn(*args)
+                metrics.incr(f"{self.name}.processed")
+            except Exception as e:
+                metrics.incr(f"{self.name}.failed")
+                print(f"❌ שגיאה בעבודה בנתיב {sender} ({self.name}): {e}")
+                traceback.print_exc()
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    if self._mailboxes[sender]:
+                        # עוד עבודה לשולח - חוזר לסוף התור כדי לא להרעיב אחרים
+                        self._ready.append(sender)
+                        self._cond.notify()
+                    else:
+                        del self._mailboxes[sender]
+                        self._scheduled.discard(sender)
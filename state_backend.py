@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+מאגר מצב לדגלים לכל משתמש (בוט פעיל/עצור, הועבר ליועץ, הגיע למגבלה, קיבל התראה,
+בקרת סיכומים, שם מ-UltraMsg, מצב תשובה): כל דגל הוא "מרחב" שמתנהג כמו dict (או set),
+כך שהקוד הקיים לא משתנה - רק מאיפה המרחב מגיע.
+
+    STATE_BACKEND=memory   מילונים בזיכרון (תהליך יחיד, ברירת מחדל)
+    STATE_BACKEND=mongo    אוסף wa_user_state משותף לכל ה-workers/מופעים, עם מטמון מקומי
+                           קצר (STATE_CACHE_TTL_SEC) לקריאות חמות כמו is_bot_active
+
+כתיבה מתהליך מסוים נראית בו מיד; בתהליכים אחרים - לכל היותר אחרי ה-TTL.
+"""
+
+import os
+import threading
+import time
+from collections.abc import MutableMapping, MutableSet
+from typing import Any, Dict, Iterator, Tuple
+
+from dotenv import load_dotenv
+
+from metrics import metrics
+
+# נטען לפני chatbot.py - המופע הגלובלי נוצר בייבוא
+load_dotenv()
+
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "memory")
+STATE_CACHE_TTL_SEC = float(os.environ.get("STATE_CACHE_TTL_SEC", "2"))
+STATE_COLLECTION = os.environ.get("MONGODB_STATE_COLLECTION", "wa_user_state")
+
+_MISSING = object()
+
+
+# --- בזיכרון ---
+
+class MemoryStateMap(dict):
+    """מרחב בזיכרון - dict רגיל; forget מוחק (אין עותק אחר)"""
+
+    def forget(self, key: str) -> None:
+        self.pop(key, None)
+
+
+class MemoryStateSet(set):
+    def forget(self, key: str) -> None:
+        self.discard(key)
+
+
+class MemoryStateBackend:
+    shared = False
+
+    def map(self, namespace: str) -> MemoryStateMap:
+        return MemoryStateMap()
+
+    def set(self, namespace: str) -> MemoryStateSet:
+        return MemoryStateSet()
+
+    def stats(self) -> Dict:
+        return {"backend": "memory"}
+
+
+# --- Mongo ---
+
+class MongoStateMap(MutableMapping):
+    """מרחב במסמכים {_id: "<מרחב>:<מפתח>", ns, key, value}; קריאות עוברות דרך מטמון TTL מקומי"""
+
+    def __init__(self, collection, namespace: str, ttl_sec: float):
+        self.collection = collection
+        self.namespace = namespace
+        self.ttl_sec = ttl_sec
+        self._lock = threading.Lock()
+        # מפתח -> (ערך או _MISSING, מתי נקרא)
+        self._cache: Dict[str, Tuple[Any, float]] = {}
+        self._pruned_at = 0.0
+
+    def _id(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def _lookup(self, key: str) -> Any:
+        now = time.time()
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached is not None and now - cached[1] < self.ttl_sec:
+            metrics.incr("state.cache_hits")
+            return cached[0]
+        metrics.incr("state.reads")
+        doc = self.collection.find_one({"_id": self._id(key)}, {"value": 1})
+        value = doc.get("value") if doc else _MISSING
+        self._remember(key, value)
+        return value
+
+    def _remember(self, key: str, value: Any) -> None:
+        now = time.time()
+        with self._lock:
+            self._cache[key] = (value, now)
+            if now - self._pruned_at >= self.ttl_sec:
+                # עותקים שפג תוקפם ממילא לא משמשים - מסירים אותם כדי שהמטמון לא יגדל עם כל מפתח שנקרא
+                self._pruned_at = now
+                expired = [k for k, (_, at) in self._cache.items() if now - at >= self.ttl_sec]
+                for expired_key in expired:
+                    del self._cache[expired_key]
+
+    def __getitem__(self, key: str) -> Any:
+        value = self._lookup(key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key) -> bool:
+        return self._lookup(key) is not _MISSING
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        metrics.incr("state.writes")
+        self.collection.update_one(
+            {"_id": self._id(key)},
+            {"$set": {"ns": self.namespace, "key": key, "value": value, "updated_at": time.time()}},
+            upsert=True,
+        )
+        self._remember(key, value)
+
+    def __delitem__(self, key: str) -> None:
+        if self.pop(key, _MISSING) is _MISSING:
+            raise KeyError(key)
+
+    def pop(self, key: str, default: Any = _MISSING) -> Any:
+        """מחיקה וקריאה בפעולה אטומית אחת (find_one_and_delete)"""
+        metrics.incr("state.writes")
+        doc = self.collection.find_one_and_delete({"_id": self._id(key)})
+        self._remember(key, _MISSING)
+        if doc is not None:
+            return doc.get("value")
+        if default is _MISSING:
+            raise KeyError(key)
+        return default
+
+    def __iter__(self) -> Iterator[str]:
+        # סריקה של כל המרחב - לסטטיסטיקות בלבד, לא בנתיב חם
+        return iter([d["key"] for d in self.collection.find({"ns": self.namespace}, {"key": 1})])
+
+    def __len__(self) -> int:
+        return self.collection.count_documents({"ns": self.namespace})
+
+    def items(self):
+        return [(d["key"], d.get("value")) for d in self.collection.find({"ns": self.namespace},
+                                                                         {"key": 1, "value": 1})]
+
+    def forget(self, key: str) -> None:
+        """שחרור העותק המקומי בלבד (המצב המשותף נשאר)"""
+        with self._lock:
+            self._cache.pop(key, None)
+
+
+class MongoStateSet(MutableSet):
+    """קבוצת מפתחות (למשל מי כבר קיבל התראה) מעל MongoStateMap"""
+
+    def __init__(self, collection, namespace: str, ttl_sec: float):
+        self._map = MongoStateMap(collection, namespace, ttl_sec)
+
+    def __contains__(self, key) -> bool:
+        return key in self._map
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._map)
+
+    def __len__(self) -> int:
+        return len(self._map)
+
+    def add(self, key: str) -> None:
+        self._map[key] = True
+
+    def discard(self, key: str) -> None:
+        self._map.pop(key, None)
+
+    def forget(self, key: str) -> None:
+        self._map.forget(key)
+
+
+class MongoStateBackend:
+    shared = True
+
+    def __init__(self, collection, ttl_sec: float = STATE_CACHE_TTL_SEC):
+        self.collection = collection
+        self.ttl_sec = ttl_sec
+        self.collection.create_index("ns")
+
+    def map(self, namespace: str) -> MongoStateMap:
+        return MongoStateMap(self.collection, namespace, self.ttl_sec)
+
+    def set(self, namespace: str) -> MongoStateSet:
+        return MongoStateSet(self.collection, namespace, self.ttl_sec)
+
+    def stats(self) -> Dict:
+        return {
+            "backend": "mongo",
+            "cache_ttl_sec": self.ttl_sec,
+            "reads": metrics.get("state.reads"),
+            "cache_hits": metrics.get("state.cache_hits"),
+            "writes": metrics.get("state.writes"),
+        }
+
+
+def create_state_backend():
+    """לפי STATE_BACKEND; ב-mongo - אותו MONGODB_URI / MONGODB_DATABASE כמו wa_sessions"""
+    if STATE_BACKEND != "mongo":
+        return MemoryStateBackend()
+    from pymongo import MongoClient
+    client = MongoClient(os.environ["MONGODB_URI"], serverSelectionTimeoutMS=10000)
+    db = client[os.environ.get("MONGODB_DATABASE", "chatbot_db")]
+    print(f"🗄️ מאגר מצב משתמשים: Mongo ({STATE_COLLECTION}, מטמון {STATE_CACHE_TTL_SEC:g}s)")
+    return MongoStateBackend(db[STATE_COLLECTION])
+
+
+# יצירת מופע גלובלי
+state_backend = create_state_backend()
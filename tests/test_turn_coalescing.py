@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+"""
+הודעת טקסט שמגיעה בזמן שתשובה עוד בסטרימינג מבטלת אותה, ושתי ההודעות נענות יחד בתור אחד.
+דורש את סביבת ההרצה המלאה (flask, pymongo, openai) - ה-API החיצוניים מוחלפים כאן.
+"""
+
+import os
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("pymongo")
+pytest.importorskip("openai")
+
+for _name, _value in {"MONGODB_URI": "mongodb://localhost:27017", "OPENAI_API_KEY": "test",
+                      "ULTRA_INSTANCE_ID": "test", "ULTRA_TOKEN": "test", "ELEVEN_API_KEY": "test"}.items():
+    os.environ.setdefault(_name, _value)
+
+import whatsapp_webhook as wh  # noqa: E402
+
+SENDER = "972500000001"
+
+
+def test_text_during_streaming_reply_cancels_and_merges(monkeypatch):
+    assert wh.distributed_buffer is None
+
+    calls = []
+    sent = []
+    streaming = threading.Event()
+    delivered = threading.Event()
+
+    def fake_chat_with_gpt(text, user_id="default", on_early_chunk=None, should_abort=None):
+        calls.append(text)
+        if len(calls) == 1:
+            # תשובה ארוכה בסטרימינג: בודקת should_abort בכל chunk, כמו complete_reply
+            streaming.set()
+            deadline = time.time() + 5
+            while time.time() < deadline:
+                if should_abort():
+                    raise wh.TurnSuperseded()
+                time.sleep(0.01)
+            return "first reply"
+        return "merged reply"
+
+    def fake_send(sender, text):
+        sent.append(text)
+        delivered.set()
+
+    monkeypatch.setattr(wh, "chat_with_gpt", fake_chat_with_gpt)
+    monkeypatch.setattr(wh, "send_whatsapp_message", fake_send)
+    monkeypatch.setattr(wh, "send_after_humanized_delay", lambda _r, _l, _t, send_fn, *args: send_fn(*args))
+    monkeypatch.setattr(wh, "handle_admin_commands", lambda message, sender: None)
+    monkeypatch.setattr(wh, "is_bot_active", lambda sender: True)
+    monkeypatch.setattr(wh, "DEBOUNCE_ADAPTIVE", False)
+    monkeypatch.setattr(wh, "BUFFER_WINDOW_SEC", 0.05)
+
+    wh.turn_lanes.submit(SENDER, wh.process_text_turn, SENDER, "שלום", time.time())
+    assert streaming.wait(5)
+
+    # ההודעה השנייה ממתינה בנתיב של השולח מאחורי התור שרץ - עוד לא הגיעה למאגר
+    wh.turn_lanes.submit(SENDER, wh.process_text_turn, SENDER, "יש לי שאלה", time.time())
+    assert delivered.wait(5)
+
+    assert calls == ["שלום", "שלום\nיש לי שאלה"]
+    assert sent == ["merged reply"]
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+התאמת טקסט משותפת לכל ההיוריסטיקות בעברית: רשימות הביטויים מוגדרות ומקומפלות פעם אחת
+(בטעינת המודול) במקום רשימות ולולאות מקוננות בתוך כל פונקציה, ובדיקות ברמת מילה (מילות
+שאלה, שם אחרי "קוראים"/"שמי"/"אני") הן ביטוי רגולרי אחד שעובר על ההודעה פעם אחת.
+
+לכל היוריסטיקה התאמה משלה (ולא אוטומט אחד לכולן): התאמה בביטוי משולב "צורכת" את
+הטקסט, ו"אני בן" למשל הוא גם ביטוי מין וגם פתיח לשם - איחוד היה משנה תוצאות.
+benchmark_text_matching.py מוודא שהתוצאות זהות למימושים הקודמים.
+"""
+
+import random
+import re
+from typing import Iterable, Optional
+
+
+# מתחת לזה חיפוש "in" של פייתון (ב-C) מהיר מביטוי משולב על הודעות באורך של וואטסאפ
+REGEX_MIN_PHRASES = 8
+
+
+class PhraseMatcher:
+    def __init__(self, phrases: Iterable[str]):
+        """רשימת ביטויים קבועים (לא regex); הארוכים קודמים כדי שההתאמה תהיה המלאה ביותר"""
+        self.phrases = tuple(dict.fromkeys(phrases))
+        alternation = "|".join(re.escape(p) for p in sorted(self.phrases, key=len, reverse=True))
+        self.pattern = re.compile(f"(?:{alternation})")
+        self._use_regex = len(self.phrases) >= REGEX_MIN_PHRASES
+
+    def contains(self, text: str) -> bool:
+        """האם אחד הביטויים מופיע בטקסט"""
+        if self._use_regex:
+            return self.pattern.search(text) is not None
+        for phrase in self.phrases:
+            if phrase in text:
+                return True
+        return False
+
+    def starts(self, text: str) -> bool:
+        """האם הטקסט מתחיל באחד הביטויים"""
+        return text.startswith(self.phrases)
+
+
+# --- שאלות בתשובת הבוט ---
+QUESTION_WORDS = ('איך', 'מה', 'איפה', 'מתי', 'למה', 'מי', 'כמה', 'איזה', 'האם')
+# מילה (רצף ללא רווחים) שמכילה מילת שאלה כלשהי; מעוגנת לתחילת המילה כדי לספור כל מילה פעם אחת
+_QUESTION_WORD_TOKEN = re.compile(
+    r"(?<!\S)\S*?(?:" + "|".join(re.escape(w) for w in QUESTION_WORDS) + r")\S*"
+)
+
+
+def count_questions(reply: str) -> int:
+    """המקסימום בין סימני שאלה למספר המילים שמכילות מילת שאלה"""
+    question_word_count = sum(1 for _ in _QUESTION_WORD_TOKEN.finditer(reply))
+    return max(reply.count('?'), question_word_count)
+
+
+# --- ברכת פתיחה ---
+GREETINGS = PhraseMatcher(['היי', 'הי', 'שלום לך', 'שלום לכם', 'שלום עליכם', 'מה נשמע', 'מה קורה'])
+
+
+def is_greeting(message: str) -> bool:
+    """האם ההודעה מתחילה בברכה"""
+    return GREETINGS.starts(message.lower().strip())
+
+
+# --- סיום שיחה ---
+# מילות סיום מפורשות - רק ביטויים ברורים מאוד
+ENDING_PHRASES = PhraseMatcher([" ביי"])
+SHORT_RESPONSES = frozenset(["כן", "לא", "אוקיי", "בסדר", "בטח"])
+
+
+# --- מין ושם הלקוח ---
+MALE_PHRASES = PhraseMatcher(["אני גבר", "אני בן", "זכר", "גבר"])
+FEMALE_PHRASES = PhraseMatcher(["אני אישה", "אני בת", "נקבה", "אישה"])
+# הודעה נבדקת לשם רק אם יש בה אחד הרמזים האלה
+NAME_HINTS = PhraseMatcher(["קוראים לי", "שמי", "אני"])
+# מילת פתיחה (מילה שלמה) ואחריה המילה הבאה - השם
+_NAME_AFTER_TRIGGER = re.compile(r"(?<!\S)(?:קוראים|שמי|אני)(?!\S)\s+(\S+)")
+
+
+def detect_gender(message: str) -> Optional[str]:
+    """"זכר" / "נקבה" לפי ההודעה, או None אם אין בה סימן; ביטוי זכר קודם"""
+    message_lower = message.lower()
+    if MALE_PHRASES.contains(message_lower):
+        return "זכר"
+    if FEMALE_PHRASES.contains(message_lower):
+        return "נקבה"
+    return None
+
+
+def extract_name(message: str) -> Optional[str]:
+    """המילה שאחרי "קוראים" / "שמי" / "אני" הראשון בהודעה"""
+    if not NAME_HINTS.contains(message):
+        return None
+    match = _NAME_AFTER_TRIGGER.search(message)
+    return match.group(1) if match else None
+
+
+# --- שיפור טקסט לקול ---
+VOICE_EMOJIS = PhraseMatcher(["😊", "😄", "🙂", "😁"])
+# מילות מעבר שמחות; ההחלפות מוחלות לפי הסדר (אחת יכולה ליצור התאמה לבאה)
+HAPPY_TRANSITIONS = (
+    ("אז", "אז בטח"),
+    ("כן", "כן בהחלט!"),
+    ("לא", "לא, אבל"),
+    ("אבל", "אבל יש לי רעיון טוב!"),
+    ("אוקיי", "אוקיי מעולה!"),
+    ("בסדר", "בסדר גמור!"),
+    ("נכון", "נכון לגמרי!"),
+)
+# בדיקה מקדימה במעבר אחד: האם יש בכלל מילת מעבר כמילה שלמה (באמצע או בתחילת הטקסט)
+_ANY_TRANSITION = re.compile(
+    r"(?:^|(?<= ))(?:" + "|".join(re.escape(old) for old, _ in HAPPY_TRANSITIONS) + r") "
+)
+VOICE_INTEREST = PhraseMatcher(["מצחיק", "הומור", "בדיחה", "צחוק", "מעניין"])
+VOICE_POSITIVE = PhraseMatcher(["מעולה", "נהדר", "פנטסטי", "אחלה"])
+VOICE_HESITATION = PhraseMatcher(["בוא נראה", "אולי", "יכול להיות"])
+VOICE_SUPPORT = PhraseMatcher(["תעזור", "עזרה", "בעיה", "קושי"])
+VOICE_THANKS = PhraseMatcher(["תודה", "מעולה", "נהדר"])
+HUMAN_FILLERS = (
+    (". ", ". אממ... "),
+    (", ", ", נו... "),
+    (" אבל ", " אבל רגע... "),
+    (" גם ", " גם כן... "),
+    (" או ", " או שמא... "),
+)
+
+
+def enhance_for_voice(text: str) -> str:
+    """הוספת רגש, מילות מעבר וביטויי מילוי לטקסט שיוקרא בקול (הטקסט כבר לא ריק)"""
+    enhanced_text = text
+
+    # הוסף רגש חיובי לתחילת או סוף המשפט
+    if not VOICE_EMOJIS.contains(text):
+        if len(text) > 50:
+            enhanced_text = enhanced_text + " 😊"
+        else:
+            enhanced_text = "😊 " + enhanced_text
+
+    # מילות מעבר שמחות - רק אם יש בכלל אחת כזו
+    if _ANY_TRANSITION.search(enhanced_text):
+        for old, new in HAPPY_TRANSITIONS:
+            if f" {old} " in enhanced_text:
+                enhanced_text = enhanced_text.replace(f" {old} ", f" {new} ")
+            elif enhanced_text.startswith(f"{old} "):
+                enhanced_text = enhanced_text.replace(f"{old} ", f"{new} ", 1)
+
+    # ביטויים אנושיים ושקולים בהתאם למשפט
+    lowered = enhanced_text.lower()
+    if VOICE_INTEREST.contains(lowered):
+        enhanced_text = enhanced_text + " זה באמת מעניין."
+    elif VOICE_POSITIVE.contains(lowered):
+        enhanced_text = enhanced_text + " זה נשמע טוב."
+    elif VOICE_HESITATION.contains(lowered):
+        enhanced_text = enhanced_text.replace("בוא נראה", "בוא נראה...")
+        enhanced_text = enhanced_text.replace("אולי", "אולי...")
+        enhanced_text = enhanced_text.replace("יכול להיות", "יכול להיות...")
+
+    # קריאות הופכות לנקודות לטון שקול, ואחרי כל נקודה רווח קטן לנשימה
+    enhanced_text = enhanced_text.replace("!", ".").replace(".", ". ")
+
+    # ביטוי מילוי אחד בטקסט ארוך, ב-30% מהמקרים, כדי לא להפריז
+    if len(enhanced_text) > 100:
+        if random.random() < 0.3:
+            filler = random.choice(HUMAN_FILLERS)
+            if filler[0] in enhanced_text:
+                enhanced_text = enhanced_text.replace(filler[0], filler[1], 1)
+
+    # ביטויים תומכים לפי הקשר
+    lowered = enhanced_text.lower()
+    if VOICE_SUPPORT.contains(lowered):
+        enhanced_text = enhanced_text + " אני כאן לעזור לך."
+    elif VOICE_THANKS.contains(lowered):
+        enhanced_text = enhanced_text + " אני שמחה לעזור."
+
+    # וודא שהטקסט נגמר בצורה טבעית ושקולה (שאלה בסוף נשארת כמו שהיא)
+    if not enhanced_text.endswith((".", "?", "...")):
+        if "?" not in enhanced_text[-10:]:
+            enhanced_text = enhanced_text + "."
+
+    return enhanced_text
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+מתזמן מועדים יחיד: thread אחד מבוסס ערימה במקום threading.Timer (thread חדש) לכל הודעה
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+from metrics import metrics
+
+# אם ה-executor מלא, נסה שוב לשגר את המשימה אחרי השהיה קצרה במקום לאבד אותה
+DISPATCH_RETRY_SEC = 0.5
+
+
+class DeadlineHeap:
+    """ערימת מועדים לפי מפתח: לכל מפתח מועד אחד בתוקף, רשומות ישנות נזרקות בעצלות"""
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._deadlines: Dict[Hashable, Tuple[float, int]] = {}
+        self._seq = itertools.count()
+
+    def set(self, key: Hashable, deadline: float) -> None:
+        """קבע (או החלף) את המועד של מפתח"""
+        seq = next(self._seq)
+        self._deadlines[key] = (deadline, seq)
+        heapq.heappush(self._heap, (deadline, seq, key))
+        # דחיסה כשיש יותר מדי רשומות מתות (משתמש פטפטן מזיז את המועד שוב ושוב)
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._heap = [(d, s, k) for k, (d, s) in self._deadlines.items()]
+            heapq.heapify(self._heap)
+
+    def discard(self, key: Hashable) -> None:
+        """הסר מפתח (אם קיים)"""
+        self._deadlines.pop(key, None)
+
+    def get(self, key: Hashable) -> Optional[float]:
+        """המועד הנוכחי של מפתח, או None"""
+        entry = self._deadlines.get(key)
+        return entry[0] if entry else None
+
+    def _purge_top(self) -> None:
+        while self._heap:
+            deadline, seq, key = self._heap[0]
+            if self._deadlines.get(key) == (deadline, seq):
+                return
+            heapq.heappop(self._heap)
+
+    def peek_deadline(self) -> Optional[float]:
+        """המועד המוקדם ביותר שבתוקף, או None אם הערימה ריקה"""
+        self._purge_top()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float) -> List[Tuple[Hashable, float]]:
+        """שלוף את כל המפתחות שהמועד שלהם עבר, לפי סדר המועדים"""
+        due = []
+        while True:
+            self._purge_top()
+            if not self._heap or self._heap[0][0] > now:
+                return due
+            deadline, _seq, key = heapq.heappop(self._heap)
+            del self._deadlines[key]
+            due.append((key, deadline))
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._deadlines
+
+
+class DeadlineScheduler:
+    def __init__(self, name: str, executor=None):
+        """
+        מתזמן עם thread יחיד. executor (למשל BoundedWorkQueue) מריץ את הקריאות שהגיע זמנן;
+        בלי executor הקריאה רצה על thread המתזמן עצמו ולכן חייבת להיות קצרה.
+        """
+        self.name = name
+        self.executor = executor
+        self._heap = DeadlineHeap()
+        self._callbacks: Dict[Hashable, Tuple[Callable, tuple]] = {}
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._oneshot_ids = itertools.count()
+
+        metrics.register_gauge(f"{name}.pending", lambda: len(self._heap))
+
+    def start(self) -> None:
+        """הפעל את thread המתזמן (פעם אחת בלבד)"""
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name=f"{self.name}-scheduler", daemon=True)
+            self._thread.start()
+
+    def schedule(self, key: Hashable, delay: float, fn: Callable, *args) -> None:
+        """קבע קריאה למפתח בעוד delay שניות; קריאה קודמת לאותו מפתח מוחלפת"""
+        if self._thread is None:
+            self.start()
+        deadline = time.monotonic() + max(0.0, delay)
+        with self._cond:
+            self._callbacks[key] = (fn, args)
+            self._heap.set(key, deadline)
+            self._cond.notify()
+
+    def call_later(self, delay: float, fn: Callable, *args) -> None:
+        """קריאה חד-פעמית בעוד delay שניות (ללא מפתח)"""
+        self.schedule(("call_later", next(self._oneshot_ids)), delay, fn, *args)
+
+    def cancel(self, key: Hashable) -> None:
+        """בטל קריאה מתוזמנת למפתח"""
+        with self._cond:
+            self._heap.discard(key)
+            self._callbacks.pop(key, None)
+
+    def remaining(self, key: Hashable) -> Optional[float]:
+        """כמה שניות נותרו עד הקריאה של מפתח, או None אם אין"""
+        with self._cond:
+            deadline = self._heap.get(key)
+        return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    next_deadline = self._heap.peek_deadline()
+                    now = time.monotonic()
+                    if next_deadline is not None and next_deadline <= now:
+                        break
+                    self._cond.wait(None if next_deadline is None else next_deadline - now)
+                due = self._heap.pop_due(now)
+                fired = [(key, deadline, self._callbacks.pop(key, None)) for key, deadline in due]
+
+            for key, deadline, callback in fired:
+                if callback is None:
+                    continue
+                fn, args = callback
+                metrics.incr(f"{self.name}.fired")
+                if self.executor is None:
+                    self._invoke(fn, args)
+                elif not self.executor.submit(fn, *args):
+                    # ה-executor מלא - דחה מעט ונסה שוב, אלא אם כבר נקבע מועד חדש למפתח
+                    metrics.incr(f"{self.name}.deferred")
+                    with self._cond:
+                        if key not in self._heap:
+                            self._callbacks[key] = callback
+                            self._heap.set(key, time.monotonic() + DISPATCH_RETRY_SEC)
+
+    def _invoke(self, fn: Callable, args: tuple) -> None:
+        try:
+            fn(*args)
+        except Exception as e:
+            print(f"❌ שגיאה בקריאה מתוזמנת ({self.name}): {e}")
@@ -1,5 +1,5 @@
 from flask import Flask, request, jsonify
-from chatbot import chat_with_gpt
+from chatbot import chat_with_gpt, TurnSuperseded, conversation_persistence, PERSIST_WRITE_BEHIND, conversations, prompt_registry
 import requests
 import os
 import json
@@ -7,7 +7,6 @@ import base64
 # לא צריכים tempfile יותר - משתמשים ב-BytesIO
 from io import BytesIO
 from dotenv import load_dotenv
-from openai import OpenAI
 from datetime import datetime
 import time
 import random
@@ -19,6 +18,19 @@ import cloudinary.api
 import threading
 import schedule
 import hashlib
+import socket
+from collections import deque
+
+from metrics import metrics
+from work_queue import BoundedWorkQueue
+from timer_wheel import DeadlineScheduler
+from debounce_policy import AdaptiveDebouncePolicy, HISTORY_SIZE
+from http_clients import http_clients
+from outbound_dispatcher import OutboundDispatcher, OutboundJob
+from sender_lanes import SenderLanes
+from text_matching import enhance_for_voice
+from state_backend import state_backend
+from leader_election import LeaderLease, LEADER_COLLECTION
 
 # OpenAI TTS מודל מתקדם
 # tts-1-hd הוא המודל החדש ביותר להמרת טקסט לדיבור עם איכות גבוהה
@@ -30,27 +42,62 @@ import hashlib
 load_dotenv()
 
 # --- session tracking in Mongo ---
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument
 
 _mclient = MongoClient(os.environ["MONGODB_URI"], serverSelectionTimeoutMS=10000)
 _mdb = _mclient[os.environ.get("MONGODB_DATABASE", "chatbot_db")]
 _sessions = _mdb["wa_sessions"]
+# הסקד'ולר יכול לעלות בכמה תהליכים (Web + worker_min, כמה מופעים) - המשימות המחזוריות רצות רק אצל המוביל
+scheduler_leader = LeaderLease(_mdb[LEADER_COLLECTION], "scheduler")
 
 # 20 דקות (ניתן לשינוי דרך ENV)
 INACT_SEC = int(os.environ.get("INACTIVITY_SECONDS", "1200"))
+# סשן מסוכם רק אם היו בו לפחות כך הודעות לקוח
+SUMMARY_MIN_USER_MSGS = 3
+# הסקד'ולר ישן עד ה-due_at הקרוב, אבל לא יותר מזה (סשנים שנוצרו בתהליך אחר לא מעירים אותו)
+SUMMARY_SCHEDULER_MAX_SLEEP_SEC = float(os.environ.get("SUMMARY_SCHEDULER_MAX_SLEEP_SEC", "30"))
+# סיכום שנכשל מנוסה שוב אחרי
+SUMMARY_RETRY_SEC = 60
+# סיכום במקביל: כל worker/מופע תופס סשנים בחכירה (open → summarizing) ומסכם עד SUMMARY_WORKERS בו-זמנית;
+# חכירה שפגה (ה-worker נפל) נתפסת מחדש
+SUMMARY_WORKERS = int(os.environ.get("SUMMARY_WORKERS", "4"))
+SUMMARY_LEASE_SEC = int(os.environ.get("SUMMARY_LEASE_SEC", "300"))
+SUMMARY_WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+summary_pool = BoundedWorkQueue("summaries", SUMMARY_WORKERS, SUMMARY_WORKERS)
+
+# מתי הסקד'ולר מתכנן להתעורר (ms); touch עם due_at מוקדם יותר מעיר אותו
+session_due_wakeup = threading.Event()
+_summary_wake_at_ms = {"value": None}
+
+def ensure_session_indexes():
+    """אינדקסים לשאילתות הסקד'ולר (status+due_at) ולעדכון לפי session_id - נוצרים בעלייה"""
+    try:
+        _sessions.create_index([("status", 1), ("due_at", 1)], name="status_due_at")
+        _sessions.create_index([("status", 1), ("lease_until", 1)], name="status_lease_until")
+        _sessions.create_index("session_id", name="session_id")
+        _sessions.create_index("inactivity_due_at", name="inactivity_due_at", sparse=True)
+    except Exception as e:
+        print(f"⚠️ יצירת אינדקסים ל-wa_sessions נכשלה: {e}")
+
+ensure_session_indexes()
 
 def touch_session_for_user(user_id: str):
-    """עדכון 'הודעת לקוח אחרונה' + מונה הודעות לקוח + יעד due_at"""
+    """עדכון 'הודעת לקוח אחרונה' + מונה הודעות לקוח + יעד due_at ומועד בדיקת חוסר הפעילות"""
     now_ms = int(time.time() * 1000)
+    due_at = now_ms + INACT_SEC * 1000
     _sessions.update_one(
         {"session_id": user_id},
         {
             "$setOnInsert": {"status": "open"},
-            "$set": {"last_user_ts": now_ms, "due_at": now_ms + INACT_SEC * 1000},
+            "$set": {"last_user_ts": now_ms, "due_at": due_at,
+                     "inactivity_due_at": now_ms + INACTIVITY_NOTIFY_SEC * 1000},
             "$inc": {"user_msg_count": 1}
         },
         upsert=True
     )
+    wake_at = _summary_wake_at_ms["value"]
+    if wake_at is None or due_at < wake_at:
+        session_due_wakeup.set()
 
 # הגדר את Cloudinary
 try:
@@ -76,23 +123,98 @@ except KeyError as e:
 else:
     CLOUDINARY_AVAILABLE = True
 
-# מילון לשמירת מצב הבוט לכל משתמש
-bot_active_status = {}
+# מצב הבוט לכל משתמש - במאגר המצב, כך ש"עצור בוט" חל על כל ה-workers
+bot_active_status = state_backend.map("bot_active_status")
 
 # מילון לשמירת זמני הודעות אחרונות לכל משתמש
 last_message_times = {}
 
+# התראת חוסר פעילות אחרי שעה; המועד נשמר בסשן ב-wa_sessions (inactivity_due_at, ms), כך שהמוביל
+# רואה גם משתמשים שההודעות שלהם הגיעו לתהליך אחר, ונוגע רק במי שמועדו עבר
+INACTIVITY_NOTIFY_SEC = 3600
+# משתמש שנתפס לבדיקה ולא סומן כגמור (נכשל או שהתהליך נפל) נבדק שוב אחרי
+INACTIVITY_RETRY_SEC = 300
+# כמה משתמשים לכל היותר נתפסים בכל סבב
+INACTIVITY_BATCH = 100
+
+def _forget_inactivity(user_id):
+    # מועד הבדיקה נמצא ב-Mongo - זמן ההודעה המקומי לא נדרש אחרי פינוי
+    last_message_times.pop(user_id, None)
+
+conversations.add_evict_listener(_forget_inactivity)
+
 # סט לזיהוי משתמשים שקיבלו הודעת התראה כאשר MongoDB לא זמין (מניעת כפילויות)
-notified_users = set()
+notified_users = state_backend.set("notified_users")
 
 # מנגנון צבירת הודעות טקסט לפי משתמש (debounce)
 message_buffer = {}
-buffer_timers = {}
 buffer_lock = threading.Lock()
-BUFFER_WINDOW_SEC = 15  # חלון צבירה בשניות
+BUFFER_WINDOW_SEC = float(os.environ.get("BUFFER_WINDOW_SEC", "15"))  # חלון צבירה קבוע בשניות
+
+# חלון צבירה אדפטיבי: נלמד מקצב ההודעות של השולח ונסגר מוקדם כשההודעה נראית גמורה
+DEBOUNCE_ADAPTIVE = os.environ.get("DEBOUNCE_ADAPTIVE", "1") == "1"
+debounce_policy = AdaptiveDebouncePolicy(
+    min_wait=float(os.environ.get("DEBOUNCE_MIN_WAIT_SEC", "1.5")),
+    max_wait=float(os.environ.get("DEBOUNCE_MAX_WAIT_SEC", str(BUFFER_WINDOW_SEC))),
+    default_wait=float(os.environ.get("DEBOUNCE_DEFAULT_WAIT_SEC", "6")),
+    finished_wait=float(os.environ.get("DEBOUNCE_FINISHED_WAIT_SEC", "2")),
+    gap_multiplier=float(os.environ.get("DEBOUNCE_GAP_MULTIPLIER", "1.5")),
+)
+
+# מתזמן יחיד למועדי הצבירה + מאגר workers חסום שמריץ את ה-flush (GPT/TTS/שליחה)
+# נתיב ביצוע לכל שולח: תורות של אותו משתמש (flush, תמלול, סיכום, פקודות) רצים לפי הסדר,
+# משתמשים שונים במקביל עד TURN_WORKERS (FLUSH_WORKERS נשמר כשם ישן)
+TURN_WORKERS = int(os.environ.get("TURN_WORKERS", os.environ.get("FLUSH_WORKERS", "16")))
+# תקרת העבודות הממתינות בכל הנתיבים: מעליה הודעה חדשה מושלת (flush של הודעות שכבר נקלטו לא)
+TURN_QUEUE_SIZE = int(os.environ.get("TURN_QUEUE_SIZE", os.environ.get("FLUSH_QUEUE_SIZE", "1000")))
+turn_lanes = SenderLanes("turns", TURN_WORKERS, TURN_QUEUE_SIZE)
+# המתזמן רק מכניס את ה-flush לנתיב של השולח (פעולה קצרה), לכן רץ בלי executor
+buffer_scheduler = DeadlineScheduler("debounce")
+
+# מאגר צבירה: local = בזיכרון (כל ההודעות של שולח חייבות להגיע לאותו תהליך),
+# mongo = wa_buffers משותף; ה-flush נתפס בחכירה אטומית ורץ פעם אחת בכל ה-workers
+DEBOUNCE_BACKEND = os.environ.get("DEBOUNCE_BACKEND", "local")
+DEBOUNCE_LEASE_SEC = float(os.environ.get("DEBOUNCE_LEASE_SEC", "120"))
+# סריקת גיבוי: מאגרים שה-worker שקבע אותם נפל או שהחכירה עליהם פגה
+DEBOUNCE_SWEEP_SEC = float(os.environ.get("DEBOUNCE_SWEEP_SEC", "5"))
+distributed_buffer = None
+if DEBOUNCE_BACKEND == "mongo":
+    from distributed_buffer import MongoMessageBuffer, BUFFERS_COLLECTION
+    distributed_buffer = MongoMessageBuffer(_mdb[BUFFERS_COLLECTION], DEBOUNCE_LEASE_SEC, HISTORY_SIZE)
+    print(f"🗄️ מאגר צבירה משותף: Mongo ({BUFFERS_COLLECTION}), worker {distributed_buffer.owner}")
+
+# שליחות שממתינות לעיכוב האנושי: מתוזמנות ומבוצעות במאגר קטן נפרד, בלי time.sleep
+SEND_WORKERS = int(os.environ.get("SEND_WORKERS", "8"))
+SEND_QUEUE_SIZE = int(os.environ.get("SEND_QUEUE_SIZE", "1000"))
+send_executor = BoundedWorkQueue("send", SEND_QUEUE_SIZE, SEND_WORKERS)
+reply_scheduler = DeadlineScheduler("humanize", send_executor)
+# שליחות לפי נמען (לפי הסדר שבו נקבעו): שליחה עם עיכוב קצר לא עוקפת שליחה קודמת עם עיכוב ארוך
+_ordered_sends = {}
+_ordered_sends_lock = threading.Lock()
+
+# תור שליחה יוצא: FIFO לכל נמען, קצב גלובלי ל-instance של UltraMsg, ניסיונות חוזרים ו-dead letter
+OUTBOUND_DISPATCHER = os.environ.get("OUTBOUND_DISPATCHER", "1") == "1"
+outbound = OutboundDispatcher(
+    "outbound",
+    rate_per_sec=float(os.environ.get("ULTRAMSG_SEND_RATE", "5")),
+    burst=int(os.environ.get("ULTRAMSG_SEND_BURST", "10")),
+    max_attempts=int(os.environ.get("OUTBOUND_MAX_ATTEMPTS", "4")),
+    backoff_base=float(os.environ.get("OUTBOUND_BACKOFF_BASE_SEC", "1")),
+    backoff_max=float(os.environ.get("OUTBOUND_BACKOFF_MAX_SEC", "30")),
+    dead_letter_path=os.environ.get("OUTBOUND_DEAD_LETTER_PATH", "dead_letters.jsonl"),
+    workers=int(os.environ.get("OUTBOUND_WORKERS", "8")),
+)
 
 # מצב מועדף לתשובה עבור מאגר ההודעות (טקסט/אודיו) לכל משתמש
-buffer_reply_mode = {}
+buffer_reply_mode = state_backend.map("buffer_reply_mode")
+
+# קליטת webhook במצב ack-first: ה-route רק מאמת ומכניס לתור חסום, workers מעבדים ברקע
+WEBHOOK_ACK_FIRST = os.environ.get("WEBHOOK_ACK_FIRST", "0") == "1"
+INGEST_QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", "1000"))
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", "8"))
+# קוד תגובה כשהתור מלא: 503 גורם ל-UltraMsg לנסות שוב מאוחר יותר, 200 זורק את ההודעה
+INGEST_SHED_STATUS = int(os.environ.get("INGEST_SHED_STATUS", "503"))
+ingest_queue = BoundedWorkQueue("ingest", INGEST_QUEUE_SIZE, INGEST_WORKERS)
 
 # דיהופליקציה גלובלית וחזקה לאירועי קול
 VOICE_DEDUP_CACHE = {}
@@ -148,17 +270,70 @@ def process_voice_message_async(payload, sender):
 
 def flush_buffer(sender):
     """שליחת הודעה מרוכזת עבור משתמש לאחר חלון צבירה"""
+    if distributed_buffer is not None:
+        flush_claimed(sender, None)
+        return
     try:
         with buffer_lock:
             messages = message_buffer.get(sender, [])
-            # נקה את הטיימר והמאגרים עבור השולח
-            timer = buffer_timers.pop(sender, None)
+            # נקה את המאגרים עבור השולח
             message_buffer[sender] = []
             reply_mode = buffer_reply_mode.pop(sender, None)
+            burst_start = debounce_policy.end_burst(sender)
+            # העיכוב האנושי נמדד מקבלת ההודעה האחרונה, לא מרגע שהתשובה מוכנה
+            received_at = debounce_policy.last_message_at(sender) or time.time()
+        reply_to_buffered(sender, messages, reply_mode, burst_start, received_at)
+    except Exception as e:
+        print(f"❌ שגיאה בשליחת תשובה מרוכזת: {e}")
+
+def flush_claimed(sender, claimed):
+    """
+    מאגר משותף: תפוס את המאגר של השולח (או השתמש במה שסריקת הגיבוי כבר תפסה), ענה ושחרר.
+    אם התפיסה נכשלה כי המועד זז (הודעה חדשה ב-worker אחר) - מתזמנים מחדש למועד החדש.
+    """
+    try:
+        if claimed is None:
+            claimed = distributed_buffer.claim(sender, time.time())
+        if claimed is None:
+            metrics.incr("debounce.claim_missed")
+            due_in = distributed_buffer.due_in(sender, time.time())
+            if due_in is not None and due_in > 0:
+                buffer_scheduler.schedule(sender, due_in, turn_lanes.submit_followup, sender, flush_buffer, sender)
+            return
+        try:
+            reply_to_buffered(sender, claimed["messages"], claimed["reply_mode"], claimed["burst_start"],
+                              claimed["last_message_at"] or time.time())
+        finally:
+            due_in = distributed_buffer.complete(sender, time.time())
+            if due_in is not None:
+                # הודעות שהגיעו בזמן שהמאגר היה חכור
+                buffer_scheduler.schedule(sender, max(0.0, due_in), turn_lanes.submit_followup, sender, flush_buffer, sender)
+    except Exception as e:
+        print(f"❌ שגיאה בשליחת תשובה מרוכזת (מאגר משותף): {e}")
+
+def sweep_distributed_buffers():
+    """סריקת גיבוי: תופס מאגרים שמועדם עבר ואף worker לא טיפל בהם (למשל כי נפל)"""
+    while True:
+        time.sleep(DEBOUNCE_SWEEP_SEC)
+        try:
+            while True:
+                claimed = distributed_buffer.claim_next(time.time())
+                if claimed is None:
+                    break
+                metrics.incr("debounce.swept")
+                turn_lanes.submit_followup(claimed["sender"], flush_claimed, claimed["sender"], claimed)
+        except Exception as e:
+            print(f"⚠️ שגיאה בסריקת מאגרי הצבירה: {e}")
 
+def reply_to_buffered(sender, messages, reply_mode, burst_start, received_at):
+    """תשובה אחת לכל ההודעות שנצברו בחלון (מהמאגר המקומי או מהמשותף)"""
+    try:
         if not messages:
             return
 
+        if burst_start:
+            metrics.observe("debounce.wait_sec", time.time() - burst_start)
+
         combined_text = "\n".join(messages).strip()
         if not combined_text:
             return
@@ -180,16 +355,27 @@ def flush_buffer(sender):
 
         combined_text = "\n".join(processed_lines).strip()
 
-        # עיבוד GPT על בסיס כל ההודעות יחד
+        # קבע מצב תשובה: אודיו אם התקבלה הודעת קול בחלון הצבירה
+        reply_type = "audio" if (reply_mode == "audio") else "text"
+
+        # עיבוד GPT על בסיס כל ההודעות יחד; בתשובת טקסט ארוכה המשפט הראשון יוצא כבר בזמן הסטרימינג
         print(f"🤖 מעבד הודעה מרוכזת עם GPT עבור {sender}...")
-        reply = chat_with_gpt(combined_text, user_id=sender)
+        early = EarlyReplySender(sender, burst_start) if reply_type == "text" else None
+        try:
+            reply = chat_with_gpt(combined_text, user_id=sender, on_early_chunk=early,
+                                  should_abort=lambda: has_buffered_messages(sender))
+        except TurnSuperseded:
+            # המשתמש המשיך להקליד - ההודעות חוזרות למאגר ויענו יחד עם החדשות ב-flush הבא
+            requeue_superseded_turn(sender, messages, reply_mode, burst_start)
+            return
         print(f"💬 תשובת GPT (מרוכזת): {reply}")
 
-        # קבע מצב תשובה: אודיו אם התקבלה הודעת קול בחלון הצבירה
-        reply_type = "audio" if (reply_mode == "audio") else "text"
-        delay = calculate_smart_delay(len(combined_text), reply_type)
-        print(f"⏱️ ממתין {delay:.2f} שניות לפני שליחת תשובה מרוכזת ({reply_type})...")
-        time.sleep(delay)
+        if early and early.sent:
+            # החלק הראשון כבר אצל הלקוח - היתרה נשלחת מיד אחריו, בלי עיכוב אנושי נוסף
+            remainder = early.remainder(reply)
+            if remainder:
+                send_in_order(sender, time.time(), send_whatsapp_message, sender, remainder)
+            return
 
         if reply_type == "audio":
             # נסה ליצור אודיו ולשלוח; במקרה של כישלון חזור לטקסט
@@ -198,40 +384,190 @@ def flush_buffer(sender):
                 if CLOUDINARY_AVAILABLE:
                     cloud_url = upload_audio_to_cloudinary(tts_audio, "reply.mp3")
                     if cloud_url:
-                        sent = send_audio_via_ultramsg_url(sender, cloud_url, caption="")
-                        if sent:
-                            print("✅ תשובת אודיו מרוכזת נשלחה בהצלחה")
-                            return
-                        else:
-                            print("⚠️ שליחת האודיו נכשלה, חוזר לטקסט")
+                        send_after_humanized_delay(
+                            received_at, len(combined_text), reply_type,
+                            deliver_audio_reply, sender, cloud_url, reply, burst_start
+                        )
+                        return
                 else:
                     print("⚠️ Cloudinary לא זמין, חוזר לטקסט")
             else:
                 print("⚠️ יצירת אודיו נכשלה או קובץ קטן מדי, חוזר לטקסט")
 
         # ברירת מחדל או נפילה חזרה: שלח טקסט
-        send_whatsapp_message(sender, reply)
+        send_after_humanized_delay(
+            received_at, len(combined_text), reply_type,
+            deliver_text_reply, sender, reply, burst_start
+        )
     except Exception as e:
         print(f"❌ שגיאה בשליחת תשובה מרוכזת: {e}")
 
+def has_buffered_messages(sender):
+    """
+    האם הגיעו הודעות חדשות מהשולח מאז ה-flush האחרון. טקסט וקול עוברים בנתיב של השולח
+    (אחרי התור שרץ עכשיו) לפני שהם מגיעים למאגר - לכן נבדקות גם העבודות שממתינות בנתיב.
+    """
+    if turn_lanes.queued(sender, process_text_turn, process_voice_message_async):
+        return True
+    if distributed_buffer is not None:
+        return distributed_buffer.has_pending(sender)
+    with buffer_lock:
+        return bool(message_buffer.get(sender))
+
+def requeue_superseded_turn(sender, messages, reply_mode, burst_start):
+    """
+    החזר הודעות של תור שבוטל לראש המאגר; ההודעה החדשה קובעת את מועד ה-flush שיאחד אותן.
+    אם היא לא תגיע למאגר (פקודת מנהל, בוט עצור) - flush גיבוי אחרי BUFFER_WINDOW_SEC.
+    """
+    if distributed_buffer is not None:
+        distributed_buffer.requeue(sender, messages, reply_mode, burst_start,
+                                   due_at=time.time() + BUFFER_WINDOW_SEC)
+        if buffer_scheduler.remaining(sender) is None:
+            buffer_scheduler.schedule(sender, BUFFER_WINDOW_SEC, turn_lanes.submit_followup, sender, flush_buffer, sender)
+        metrics.incr("turns.coalesced")
+        print(f"🔀 תור של {sender} אוחד עם {len(messages)} הודעות קודמות")
+        return
+    with buffer_lock:
+        message_buffer[sender] = list(messages) + message_buffer.get(sender, [])
+        if reply_mode and sender not in buffer_reply_mode:
+            buffer_reply_mode[sender] = reply_mode
+    if burst_start:
+        debounce_policy.resume_burst(sender, burst_start)
+    if buffer_scheduler.remaining(sender) is None:
+        buffer_scheduler.schedule(sender, BUFFER_WINDOW_SEC, turn_lanes.submit_followup, sender, flush_buffer, sender)
+    metrics.incr("turns.coalesced")
+    print(f"🔀 תור של {sender} אוחד עם {len(messages)} הודעות קודמות")
+
+if distributed_buffer is not None:
+    threading.Thread(target=sweep_distributed_buffers, name="debounce-sweeper", daemon=True).start()
+
+class EarlyReplySender:
+    """
+    callback לשליחה מוקדמת של המשפט/הפסקה הראשונים בזמן סטרימינג מ-GPT.
+    נשלח מיד (אחרי שליחות קודמות לאותו נמען שעוד ממתינות), והיתרה נכנסת אחריו באותו סדר.
+    """
+
+    def __init__(self, sender, burst_start=None):
+        self.sender = sender
+        self.burst_start = burst_start
+        self.sent = ""
+
+    def __call__(self, chunk):
+        print(f"📤 שליחה מוקדמת ל-{self.sender}: {chunk}")
+        send_in_order(self.sender, time.time(), send_whatsapp_message, self.sender, chunk)
+        self.sent = chunk
+        record_time_to_first_reply(self.burst_start)
+
+    def remainder(self, reply):
+        """החלק של התשובה המלאה שעוד לא נשלח"""
+        if not reply or not reply.startswith(self.sent):
+            return reply
+        return reply[len(self.sent):].strip()
+
+def deliver_text_reply(sender, reply, burst_start=None):
+    """שליחת תשובת טקסט מרוכזת (רצה אחרי העיכוב האנושי)"""
+    send_whatsapp_message(sender, reply)
+    record_time_to_first_reply(burst_start)
+
+def deliver_audio_reply(sender, cloud_url, reply, burst_start=None):
+    """שליחת תשובת אודיו מרוכזת; אם השליחה נכשלת - חוזר לטקסט"""
+    if OUTBOUND_DISPATCHER:
+        # ניסיונות חוזרים באחריות התור; אם האודיו נכשל סופית, הטקסט נשלח במקומו באותו מקום בתור
+        fallback = OutboundJob(sender, "text", post_whatsapp_text, (sender, reply),
+                               on_sent=lambda: record_time_to_first_reply(burst_start))
+        outbound.enqueue(sender, "audio", send_audio_via_ultramsg_url, sender, cloud_url, "",
+                         fallback=fallback, on_sent=lambda: record_time_to_first_reply(burst_start))
+        return
+
+    sent = send_audio_via_ultramsg_url(sender, cloud_url, caption="")
+    if sent:
+        print("✅ תשובת אודיו מרוכזת נשלחה בהצלחה")
+    else:
+        print("⚠️ שליחת האודיו נכשלה, חוזר לטקסט")
+        send_whatsapp_message(sender, reply)
+    record_time_to_first_reply(burst_start)
+
+def send_after_humanized_delay(received_at, message_length, message_type, send_fn, *args):
+    """
+    שלח אחרי עיכוב אנושי שנמדד מזמן קבלת ההודעה: זמן שכבר הלך על GPT/TTS/העלאה מקוזז,
+    והיתרה מתוזמנת במתזמן במקום time.sleep שמחזיק thread. הנמען הוא הפרמטר הראשון של send_fn.
+    """
+    delay = calculate_smart_delay(message_length, message_type)
+    remaining = delay - (time.time() - received_at)
+    if remaining <= 0:
+        metrics.incr("humanize.immediate")
+    else:
+        metrics.observe("humanize.remaining_sec", remaining)
+        print(f"⏱️ שליחה מתוזמנת בעוד {remaining:.2f} שניות (עיכוב {delay:.2f}, כבר עברו {delay - remaining:.2f})")
+    send_in_order(args[0], time.time() + max(0.0, remaining), send_fn, *args)
+
+def send_in_order(recipient, due_at, send_fn, *args):
+    """
+    שליחה לנמען לא לפני due_at ולא לפני שליחות קודמות שלו שעוד ממתינות (למשל תשובת מנהל
+    עם עיכוב ארוך ותשובה מרוכזת עם עיכוב קצר) - ההודעות יוצאות לפי הסדר שבו נקבעו.
+    """
+    with _ordered_sends_lock:
+        lane = _ordered_sends.get(recipient)
+        # אין שליחה ממתינה לנמען ואין צורך לחכות - שולחים מיד באותו thread
+        immediate = lane is None and due_at <= time.time()
+        start = lane is None and not immediate
+        if start:
+            lane = _ordered_sends[recipient] = deque()
+        if not immediate:
+            lane.append((due_at, send_fn, args))
+    if immediate:
+        send_fn(*args)
+    elif start:
+        reply_scheduler.schedule(("ordered", recipient), max(0.0, due_at - time.time()),
+                                 _run_ordered_sends, recipient)
+
+def _run_ordered_sends(recipient):
+    """מריץ את השליחות של נמען לפי הסדר; ממתין במתזמן לשליחה שמועדה עוד לא הגיע"""
+    while True:
+        with _ordered_sends_lock:
+            lane = _ordered_sends.get(recipient)
+            if not lane:
+                _ordered_sends.pop(recipient, None)
+                return
+            due_at, send_fn, args = lane[0]
+            wait = due_at - time.time()
+            if wait > 0:
+                reply_scheduler.schedule(("ordered", recipient), wait, _run_ordered_sends, recipient)
+                return
+            lane.popleft()
+        try:
+            send_fn(*args)
+        except Exception as e:
+            print(f"❌ שגיאה בשליחה מתוזמנת ל-{recipient}: {e}")
+
+def record_time_to_first_reply(burst_start):
+    """מדוד זמן מההודעה הראשונה ברצף ועד שליחת התשובה"""
+    if burst_start:
+        metrics.observe("reply.time_to_first_reply_sec", time.time() - burst_start)
+
 def buffer_text_message(sender, message):
     """הוסף הודעת טקסט למאגר עבור המשתמש והפעל/אתחל טיימר צבירה"""
+    if distributed_buffer is not None:
+        now = time.time()
+        doc = distributed_buffer.append(sender, message, now, max(debounce_policy.max_wait, BUFFER_WINDOW_SEC))
+        wait = BUFFER_WINDOW_SEC
+        if DEBOUNCE_ADAPTIVE:
+            # הקצב נלמד מזמני ההודעות שבמסמך - כולל הודעות שהגיעו ל-workers אחרים
+            wait = debounce_policy.wait_for(doc.get("stamps", [now]), doc.get("burst_start", now), message, now)
+        distributed_buffer.set_due(sender, now + wait, doc["version"])
+        buffer_scheduler.schedule(sender, wait, turn_lanes.submit_followup, sender, flush_buffer, sender)
+        return
     with buffer_lock:
         if sender not in message_buffer:
             message_buffer[sender] = []
         message_buffer[sender].append(message)
+        wait = debounce_policy.next_wait(sender, message, time.time())
 
-        # בטל טיימר קיים אם יש והפעל חדש
-        existing = buffer_timers.get(sender)
-        if existing is not None:
-            try:
-                existing.cancel()
-            except Exception:
-                pass
-        t = threading.Timer(BUFFER_WINDOW_SEC, flush_buffer, args=(sender,))
-        buffer_timers[sender] = t
-        t.daemon = True
-        t.start()
+    if not DEBOUNCE_ADAPTIVE:
+        wait = BUFFER_WINDOW_SEC
+
+    # הזז את מועד ה-flush של השולח (מחליף מועד קודם, בלי thread חדש)
+    buffer_scheduler.schedule(sender, wait, turn_lanes.submit_followup, sender, flush_buffer, sender)
 
 def is_bot_active(user_id):
     """בדוק אם הבוט פעיל למשתמש מסוים"""
@@ -246,7 +582,7 @@ def update_last_message_time(user_id):
     """עדכן זמן הודעה אחרונה למשתמש"""
     last_message_times[user_id] = datetime.now()
     print(f"⏰ זמן הודעה אחרונה עודכן עבור: {user_id}")
-    # עדכון סשן במונגו לצורך סיכומי שיחה אוטומטיים
+    # עדכון סשן במונגו לצורך סיכומי שיחה אוטומטיים ובדיקת חוסר הפעילות
     try:
         touch_session_for_user(user_id)
     except Exception as _e:
@@ -256,20 +592,20 @@ def update_last_message_time(user_id):
 def check_for_auto_summary_by_message_count(user_id):
     """בדוק אם צריך לבצע סיכום אוטומטי לפי מספר הודעות"""
     try:
-        from chatbot import conversations, summarize_conversation, save_conversation_summary, save_conversation_to_file
+        from chatbot import conversations, get_conversation_state, summarize_conversation, save_conversation_summary, save_conversation_to_file
         from conversation_summaries import summaries_manager
         
         if user_id not in conversations:
             return
         
-        # ספור הודעות משתמש
-        user_messages = [m for m in conversations[user_id] if m["role"] == "user"]
+        # ספור הודעות משתמש (מהמצב המצטבר, בלי לסרוק את ההיסטוריה)
+        user_message_count = get_conversation_state(user_id).user_count
         
         # בדוק אם יש 8 הודעות או יותר ואין עדיין סיכום
-        if len(user_messages) >= 8:
-            existing_summary = summaries_manager.get_summary(user_id)
-            if not existing_summary:
-                print(f"🔄 מבצע סיכום אוטומטי לפי מספר הודעות ({len(user_messages)}): {user_id}")
+        if user_message_count >= 8:
+            # בדיקת קיום בלבד - דרך מטמון המצב ושאילתה מוקרנת, לא המסמך המלא בכל הודעה
+            if not summaries_manager.has_summary(user_id):
+                print(f"🔄 מבצע סיכום אוטומטי לפי מספר הודעות ({user_message_count}): {user_id}")
                 summary = summarize_conversation(user_id)
                 save_conversation_summary(user_id, summary)
                 save_conversation_to_file(user_id)
@@ -278,131 +614,290 @@ def check_for_auto_summary_by_message_count(user_id):
         print(f"⚠️ שגיאה בבדיקת סיכום לפי מספר הודעות עבור {user_id}: {e}")
 
 def check_and_summarize_old_conversations():
-    """מסכם שיחות עם ≥3 הודעות לקוח ושקט ≥ INACT_SEC (ברירת מחדל 20 דק')."""
-    print("🔄 בודק שיחות ישנות (Mongo sessions)...", flush=True)
+    """
+    מסכם שיחות עם ≥3 הודעות לקוח ושקט ≥ INACT_SEC (ברירת מחדל 20 דק'), לפי due_at.
+    כל סשן נתפס אטומית (open → summarizing עם חכירה) ומסוכם במאגר workers, כך שכמה
+    מופעים של worker_min יכולים לרוקן backlog במקביל בלי לסכם פעמיים. מחזיר כמה נתפסו.
+    """
     now_ms = int(time.time() * 1000)
 
-    # מועמדים: סטטוס open, לפחות 3 הודעות לקוח, עברו ≥ INACT_SEC מהודעת לקוח אחרונה
-    cursor = _sessions.find(
-        {
-            "status": "open",
-            "user_msg_count": {"$gte": 3},
-            "last_user_ts": {"$lte": now_ms - INACT_SEC * 1000}
-        },
-        {"session_id": 1},
-        limit=100
+    # סשנים קצרים שהגיע מועדם יוצאים מהטווח (due_at נמחק) עד ההודעה הבאה, כדי לא להיסרק שוב ושוב
+    _sessions.update_many(
+        {"status": "open", "due_at": {"$lte": now_ms}, "user_msg_count": {"$lt": SUMMARY_MIN_USER_MSGS}},
+        {"$unset": {"due_at": ""}}
+    )
+
+    claimed = 0
+    # תופסים רק כמה שיש workers פנויים - סשן שממתין בתור עם חכירה רק מעכב מופע אחר
+    while summary_pool.free_slots() > 0:
+        session = claim_due_session(int(time.time() * 1000))
+        if session is None:
+            break
+        if not summary_pool.submit(summarize_claimed_session, session):
+            release_session_claim(session, retry=False)
+            break
+        claimed += 1
+
+    if claimed:
+        print(f"🔄 נתפסו {claimed} סשנים לסיכום (worker {SUMMARY_WORKER_ID})", flush=True)
+    return claimed
+
+def claim_due_session(now_ms):
+    """
+    תפיסה אטומית של הסשן הבא לסיכום: open שה-due_at שלו עבר, או summarizing שהחכירה שלו פגה
+    (ה-worker שתפס אותו נפל). מחזיר את המסמך כפי שהיה לפני התפיסה, או None.
+    """
+    session = _sessions.find_one_and_update(
+        {"$or": [
+            {"status": "open", "due_at": {"$lte": now_ms}, "user_msg_count": {"$gte": SUMMARY_MIN_USER_MSGS}},
+            {"status": "summarizing", "lease_until": {"$lte": now_ms}},
+        ]},
+        {"$set": {"status": "summarizing", "lease_owner": SUMMARY_WORKER_ID,
+                  "lease_until": now_ms + SUMMARY_LEASE_SEC * 1000}},
+        projection={"session_id": 1, "due_at": 1, "status": 1, "lease_owner": 1},
+        sort=[("due_at", 1)],
+        return_document=ReturnDocument.BEFORE,
+    )
+    if session is None:
+        return None
+    metrics.incr("summary.claims")
+    if session.get("status") == "summarizing":
+        metrics.incr("summary.reclaimed")
+        print(f"♻️ סשן {session['session_id']} נתפס מחדש (החכירה של {session.get('lease_owner')} פגה)", flush=True)
+    return session
+
+def release_session_claim(session, retry=True):
+    """החזרת סשן שנתפס ל-open (סיכום נכשל או שלא היה מקום בתור); retry דוחה את הניסיון הבא"""
+    update = {"$set": {"status": "open"}, "$unset": {"lease_owner": "", "lease_until": ""}}
+    if retry:
+        update["$set"]["due_at"] = int(time.time() * 1000) + SUMMARY_RETRY_SEC * 1000
+    _sessions.update_one(
+        {"session_id": session["session_id"], "status": "summarizing", "lease_owner": SUMMARY_WORKER_ID},
+        update
     )
 
+def summarize_claimed_session(session):
+    """סיכום סשן שנתפס (רץ במאגר ה-workers) וסגירתו - רק אם החכירה עדיין שלנו"""
     # ייבוא מאוחר כדי להימנע מתלות מעגלית
     from chatbot import summarize_conversation, save_conversation_summary, save_conversation_to_file
 
-    summarized = 0
-    for s in cursor:
-        sid = s["session_id"]
-        try:
-            summary = summarize_conversation(sid)
-            save_conversation_summary(sid, summary)  # שומר גם למונגו דרך המנגנון שלך
-            save_conversation_to_file(sid)            # אם קיים אצלך
-
-            # סגור סשן שלא נסכם שוב
-            _sessions.update_one(
-                {"session_id": sid, "status": "open"},
-                {"$set": {"status": "closed", "closed_at": now_ms}}
-            )
-            summarized += 1
-            print(f"✅ סוכמה שיחה אוטומטית: {sid}", flush=True)
-        except Exception as e:
-            print(f"⚠️ כשל בסיכום {sid}: {e}", flush=True)
+    sid = session["session_id"]
+    try:
+        summary = summarize_conversation(sid)
+        save_conversation_summary(sid, summary)  # שומר גם למונגו דרך המנגנון שלך
+        save_conversation_to_file(sid)            # אם קיים אצלך
+
+        # סגור סשן שלא נסכם שוב
+        closed = _sessions.update_one(
+            {"session_id": sid, "status": "summarizing", "lease_owner": SUMMARY_WORKER_ID},
+            {"$set": {"status": "closed", "closed_at": int(time.time() * 1000)},
+             "$unset": {"lease_owner": "", "lease_until": ""}}
+        )
+        if closed.modified_count == 0:
+            # החכירה פגה באמצע ו-worker אחר תפס את הסשן
+            metrics.incr("summary.lease_lost")
+            print(f"⚠️ החכירה על {sid} פגה לפני סיום הסיכום", flush=True)
+        if session.get("due_at"):
+            # כמה זמן אחרי המועד הסיכום נוצר בפועל
+            metrics.observe("summary.lag_sec", max(0.0, time.time() - session["due_at"] / 1000))
+        print(f"✅ סוכמה שיחה אוטומטית: {sid}", flush=True)
+    except Exception as e:
+        metrics.incr("summary.failed")
+        print(f"⚠️ כשל בסיכום {sid}: {e}", flush=True)
+        # דחה את הניסיון הבא כדי שהסקד'ולר לא יחזור עליו בלולאה צפופה
+        release_session_claim(session)
+    finally:
+        # מקום התפנה במאגר - אם יש עוד סשנים שמועדם עבר, הסקד'ולר יתפוס אותם מיד
+        session_due_wakeup.set()
+
+def next_session_due_ms():
+    """המועד הקרוב ביותר (ms): due_at של סשן פתוח או חכירה של סשן בסיכום שתפוג, או None"""
+    due = _sessions.find_one(
+        {"status": "open", "due_at": {"$exists": True}},
+        {"due_at": 1},
+        sort=[("due_at", 1)]
+    )
+    lease = _sessions.find_one(
+        {"status": "summarizing"},
+        {"lease_until": 1},
+        sort=[("lease_until", 1)]
+    )
+    candidates = [d for d in (due and due.get("due_at"), lease and lease.get("lease_until")) if d is not None]
+    return min(candidates) if candidates else None
 
-    if summarized == 0:
-        print("ℹ️ אין שיחות בשלות לסיכום", flush=True)
+def claim_inactive_users(now_ms, limit=INACTIVITY_BATCH):
+    """
+    תפיסה אטומית של משתמשים שמועד חוסר הפעילות שלהם עבר: המועד נדחה ב-INACTIVITY_RETRY_SEC
+    (חכירה), כך שתפיסה כפולה לא אפשרית ומשתמש שהטיפול בו לא הושלם נבדק שוב.
+    מחזיר [(user_id, המועד שנקבע בתפיסה)].
+    """
+    claimed = []
+    lease_until = now_ms + INACTIVITY_RETRY_SEC * 1000
+    while len(claimed) < limit:
+        session = _sessions.find_one_and_update(
+            {"inactivity_due_at": {"$lte": now_ms}},
+            {"$set": {"inactivity_due_at": lease_until}},
+            projection={"session_id": 1},
+            sort=[("inactivity_due_at", 1)],
+        )
+        if session is None:
+            break
+        claimed.append((session["session_id"], lease_until))
+    return claimed
+
+def complete_inactivity_check(user_id, claimed_due_ms):
+    """הבדיקה הושלמה - מסירים את המועד, אלא אם בינתיים הגיעה הודעה שקבעה מועד חדש"""
+    _sessions.update_one(
+        {"session_id": user_id, "inactivity_due_at": claimed_due_ms},
+        {"$unset": {"inactivity_due_at": ""}}
+    )
+
+def release_inactivity_claim(user_id, claimed_due_ms):
+    """החזרת משתמש שנתפס ולא טופל (ההובלה אבדה) לבדיקה בסבב הבא"""
+    _sessions.update_one(
+        {"session_id": user_id, "inactivity_due_at": claimed_due_ms},
+        {"$set": {"inactivity_due_at": int(time.time() * 1000)}}
+    )
 
 def check_and_notify_inactive_conversations():
-    """בדוק חוסר פעילות של שעה: בצע סיכום (בנוסף למנגנון הקיים) ושלח הודעת התראה"""
+    """
+    בדוק חוסר פעילות של שעה: בצע סיכום (בנוסף למנגנון הקיים) ושלח הודעת התראה.
+    עובר רק על משתמשים שמועד הבדיקה שלהם ב-wa_sessions עבר (מכל התהליכים), כל אחד נתפס אטומית,
+    ודגלי הסיכום/התראה שלהם נקראים בשאילתה אחת. משתמש שהבדיקה שלו נכשלה נבדק שוב אחרי
+    INACTIVITY_RETRY_SEC.
+    """
     try:
-        from chatbot import conversations, summarize_conversation, save_conversation_summary, save_conversation_to_file
-        from conversation_summaries import summaries_manager
-        try:
-            from mongodb_manager import mongodb_manager
-        except Exception:
-            mongodb_manager = None
-
-        current_time = datetime.now()
         notified_text = "העברתי את הפרטים שלך למאפיין אתרים מטעמינו, הוא יחזור אלייך בשעות הקרובות לתחילת עבודה!"
 
-        if not conversations:
-            return
+        # סבבים של INACTIVITY_BATCH עד שאין יותר משתמשים שמועדם עבר
+        while True:
+            claimed = claim_inactive_users(int(time.time() * 1000))
+            if not claimed:
+                return
+            if not _notify_inactive_batch(claimed, notified_text) or len(claimed) < INACTIVITY_BATCH:
+                return
+    except Exception as e:
+        print(f"❌ שגיאה בפונקציית חוסר פעילות: {e}")
+        import traceback
+        traceback.print_exc()
 
-        for user_id, conversation in conversations.items():
-            try:
-                # חובה שיהיה לנו זמן הודעה אחרונה כדי למדוד חוסר פעילות
-                if user_id not in last_message_times:
-                    continue
-
-                time_diff = current_time - last_message_times[user_id]
-                if time_diff.total_seconds() < 3600:  # פחות משעה
-                    continue
-
-                # ודא שיש לפחות הודעת משתמש אחת
-                user_messages = [m for m in conversation if m.get("role") == "user"]
-                if len(user_messages) == 0:
-                    continue
-
-                # סכם שיחה אם עדיין אין סיכום
-                existing_summary = summaries_manager.get_summary(user_id)
-                if not existing_summary:
-                    print(f"🔄 מבצע סיכום חוסר פעילות (60דק): {user_id}")
-                    summary = summarize_conversation(user_id)
-                    save_conversation_summary(user_id, summary)
-                    save_conversation_to_file(user_id)
-
-                # שליחת הודעת התראה פעם אחת בלבד
-                already_notified = False
-                if mongodb_manager and mongodb_manager.is_connected():
-                    try:
-                        doc = mongodb_manager.get_summary(user_id)
-                        if doc and doc.get("notified") is True:
-                            already_notified = True
-                        if not already_notified:
-                            send_whatsapp_message(user_id, notified_text)
-                            # סמן כ-notified במסד
-                            if doc and doc.get("_id"):
-                                mongodb_manager.mark_lead_notified(doc["_id"])
-                    except Exception as e:
-                        print(f"⚠️ שגיאה בסימון notified במונגו עבור {user_id}: {e}")
-                else:
-                    if user_id in notified_users:
+def _notify_inactive_batch(claimed, notified_text):
+    """סיכום והתראה למשתמשים שנתפסו; מחזיר False אם ההובלה אבדה באמצע"""
+    from chatbot import get_conversation_state, summarize_conversation, save_conversation_summary, save_conversation_to_file
+    from conversation_summaries import summaries_manager
+    try:
+        from mongodb_manager import mongodb_manager
+    except Exception:
+        mongodb_manager = None
+
+    due_users = [user_id for user_id, _due in claimed]
+    metrics.incr("inactivity.checked", len(due_users))
+
+    mongo_connected = bool(mongodb_manager and mongodb_manager.is_connected())
+    # מסמך הסיכום (אם יש) של כל המשתמשים שמועדם עבר - $in אחד במקום שתי קריאות לכל משתמש
+    summary_docs = {}
+    if mongo_connected:
+        summary_docs = mongodb_manager.get_summaries_by_phone(due_users, ["_id", "notified"])
+
+    for index, (user_id, claimed_due_ms) in enumerate(claimed):
+        # כל משתמש עולה סיכום LLM - אם החכירה אבדה באמצע (Mongo לא זמין), המוביל החדש
+        # עלול להריץ את אותה משימה; עוצרים, והשאר חוזרים לבדיקה בסבב הבא (אצל מי שיוביל)
+        if not scheduler_leader.is_leader():
+            metrics.incr("leader.job_aborted")
+            print(f"⚠️ ההובלה אבדה באמצע בדיקת חוסר הפעילות - {len(claimed) - index} משתמשים נדחו", flush=True)
+            for pending_user, pending_due_ms in claimed[index:]:
+                try:
+                    release_inactivity_claim(pending_user, pending_due_ms)
+                except Exception as e:
+                    print(f"⚠️ החזרת {pending_user} לבדיקה נכשלה (ייבדק אחרי {INACTIVITY_RETRY_SEC}s): {e}")
+            break
+        try:
+            # ודא שיש לפחות הודעת משתמש אחת
+            if get_conversation_state(user_id).user_count == 0:
+                complete_inactivity_check(user_id, claimed_due_ms)
+                continue
+
+            # סכם שיחה אם עדיין אין סיכום (ב-Mongo או בגיבוי ה-JSON)
+            doc = summary_docs.get(user_id)
+            if not doc and not summaries_manager.summaries.get(user_id):
+                print(f"🔄 מבצע סיכום חוסר פעילות (60דק): {user_id}")
+                summary = summarize_conversation(user_id)
+                save_conversation_summary(user_id, summary)
+                save_conversation_to_file(user_id)
+                # המסמך נוצר עכשיו - נדרש ה-_id שלו לסימון notified
+                if mongo_connected:
+                    doc = mongodb_manager.get_summary_meta(user_id)
+
+            # שליחת הודעת התראה פעם אחת בלבד
+            already_notified = False
+            if mongo_connected:
+                try:
+                    if doc and doc.get("notified") is True:
                         already_notified = True
                     if not already_notified:
                         send_whatsapp_message(user_id, notified_text)
-                        notified_users.add(user_id)
+                        # סמן כ-notified במסד
+                        if doc and doc.get("_id"):
+                            mongodb_manager.mark_lead_notified(doc["_id"])
+                except Exception as e:
+                    print(f"⚠️ שגיאה בסימון notified במונגו עבור {user_id}: {e}")
+            else:
+                if user_id in notified_users:
+                    already_notified = True
+                if not already_notified:
+                    send_whatsapp_message(user_id, notified_text)
+                    notified_users.add(user_id)
 
-            except Exception as e:
-                print(f"⚠️ שגיאה בבדיקת חוסר פעילות עבור {user_id}: {e}")
-                continue
-    except Exception as e:
-        print(f"❌ שגיאה בפונקציית חוסר פעילות: {e}")
-        import traceback
-        traceback.print_exc()
+            complete_inactivity_check(user_id, claimed_due_ms)
+
+        except Exception as e:
+            # המועד שנקבע בתפיסה נשאר - ייבדק שוב אחרי INACTIVITY_RETRY_SEC, אלא אם בינתיים
+            # הגיעה הודעה חדשה שקבעה מועד משלה
+            print(f"⚠️ שגיאה בבדיקת חוסר פעילות עבור {user_id}: {e}")
+            continue
+    return True
 
 def run_auto_summary_scheduler():
     print("⏰ run_auto_summary_scheduler: starting…", flush=True)
 
-    # תדירות גבוהה לזיהוי מהיר (אפשר 1 דקה אם רוצים)
-    schedule.every(2).minutes.do(check_and_summarize_old_conversations)
-
     # שמור גם על בדיקת חוסר פעילות אם קיימת במערכת שלך
     try:
         schedule.every(5).minutes.do(check_and_notify_inactive_conversations)
     except Exception:
         pass
 
-    # אם יש אצלך גם every(10).minutes / every(30).minutes – אפשר להשאיר
-
+    # סיכום סשנים לפי due_at: ישן עד המועד הקרוב (או עד ש-touch מעיר אותו) ומסכם מיד כשפג.
+    # הסיכום עצמו בטוח בכל תהליך (כל סשן נתפס בחכירה); משימות schedule רצות רק אצל המוביל.
+    # החכירה מתחדשת ב-thread משלה, כך שמשימה ארוכה (סיכומי LLM) לא גורמת לה לפוג באמצע
+    scheduler_leader.start()
+    last_heartbeat = 0.0
     while True:
-        schedule.run_pending()
-        print("❤️ scheduler heartbeat", flush=True)
-        time.sleep(60)
+        session_due_wakeup.clear()
+        is_leader = scheduler_leader.is_leader()
+        try:
+            due_ms = next_session_due_ms()
+            if due_ms is not None and due_ms <= time.time() * 1000:
+                check_and_summarize_old_conversations()
+                due_ms = next_session_due_ms()
+        except Exception as e:
+            print(f"⚠️ שגיאה בסיכום סשנים לפי due_at: {e}", flush=True)
+            due_ms = None
+
+        if is_leader:
+            schedule.run_pending()
+        if time.time() - last_heartbeat >= 60:
+            print(f"❤️ scheduler heartbeat ({'leader' if is_leader else 'standby'})", flush=True)
+            last_heartbeat = time.time()
+
+        sleep_sec = SUMMARY_SCHEDULER_MAX_SLEEP_SEC
+        # כשכל ה-workers עסוקים אין מה לתפוס - סיום סיכום מעיר את הלולאה
+        if due_ms is not None and summary_pool.free_slots() > 0:
+            sleep_sec = min(sleep_sec, max(0.1, due_ms / 1000 - time.time()))
+        idle = schedule.idle_seconds() if is_leader else None
+        if idle is not None:
+            sleep_sec = min(sleep_sec, max(0.0, idle))
+        _summary_wake_at_ms["value"] = int((time.time() + sleep_sec) * 1000)
+        session_due_wakeup.wait(sleep_sec)
 
 def start_auto_summary_thread():
     """הפעל את מערכת הסיכום האוטומטי בthread נפרד"""
@@ -687,8 +1182,8 @@ except KeyError as e:
 ELEVEN_VOICE_ID = "cgSgspJ2msm6clMCkdW9"  # Jessica
 ELEVEN_MODEL_ID = "eleven_v3"
 
-# התחברות ל־OpenAI עבור תמלול ו-TTS
-client = OpenAI(api_key=OPENAI_API_KEY)
+# התחברות ל־OpenAI עבור תמלול ו-TTS (לקוח משותף עם chatbot.py)
+client = http_clients.openai_client(OPENAI_API_KEY)
 
 app = Flask(__name__)
 
@@ -729,7 +1224,8 @@ def upload_audio_to_cloudinary(audio_bytes, filename="audio.mp3"):
         # העלה ל-Cloudinary
         result = cloudinary.uploader.upload(
             audio_file,
-            **upload_options
+            **upload_options,
+            **http_clients.cloudinary_options()
         )
         
         audio_url = result.get("secure_url")
@@ -773,8 +1269,8 @@ def download_file(file_url):
             'Connection': 'keep-alive'
         }
         
-        print(f"📥 שולח בקשת GET עם timeout של 60 שניות...")
-        response = requests.get(file_url, headers=headers, timeout=60, stream=True)
+        print(f"📥 שולח בקשת GET (timeout התחברות/קריאה: {http_clients.config('media').timeout})...")
+        response = http_clients.get("media", file_url, headers=headers, stream=True)
         
         # בדוק את קוד התגובה
         print(f"📊 קוד תגובה: {response.status_code}")
@@ -916,7 +1412,7 @@ def text_to_speech(text, language="he"):
             },
         }
 
-        resp = requests.post(url, headers=headers, data=json.dumps(body))
+        resp = http_clients.post("elevenlabs", url, headers=headers, data=json.dumps(body))
         if resp.status_code != 200:
             print(f"❌ שגיאה מ-ElevenLabs TTS: {resp.status_code} {resp.text}")
             return None
@@ -1053,98 +1549,8 @@ def enhance_text_for_voice(text):
         if not text or not text.strip():
             return "מצטערת, לא קיבלתי את מה שרצית לומר. תוכל לנסות שוב?"
         
-        # הוסף רגשות ותוספות לטקסט כדי להפוך אותו לשמח יותר
-        enhanced_text = text
-        
-        # הוסף הדגשות וביטויים שמחים
-        if not any(emoji in text for emoji in ["😊", "😄", "🙂", "😁"]):
-            # הוסף רגש חיובי לתחילת או סוף המשפט
-            if len(text) > 50:
-                enhanced_text = enhanced_text + " 😊"
-            else:
-                enhanced_text = "😊 " + enhanced_text
-        
-        # הוסף מילות מעבר שמחות
-        happy_transitions = [
-            ("אז", "אז בטח"),
-            ("כן", "כן בהחלט!"),
-            ("לא", "לא, אבל"),
-            ("אבל", "אבל יש לי רעיון טוב!"),
-            ("אוקיי", "אוקיי מעולה!"),
-            ("בסדר", "בסדר גמור!"),
-            ("נכון", "נכון לגמרי!"),
-        ]
-        
-        for old, new in happy_transitions:
-            if f" {old} " in enhanced_text:
-                enhanced_text = enhanced_text.replace(f" {old} ", f" {new} ")
-            elif enhanced_text.startswith(f"{old} "):
-                enhanced_text = enhanced_text.replace(f"{old} ", f"{new} ", 1)
-        
-        # הוסף ביטויים אנושיים ושקולים בהתאם למשפט
-        if any(word in enhanced_text.lower() for word in ["מצחיק", "הומור", "בדיחה", "צחוק", "מעניין"]):
-            enhanced_text = enhanced_text + " זה באמת מעניין."
-        elif any(word in enhanced_text.lower() for word in ["מעולה", "נהדר", "פנטסטי", "אחלה"]):
-            enhanced_text = enhanced_text + " זה נשמע טוב."
-        elif any(word in enhanced_text.lower() for word in ["בוא נראה", "אולי", "יכול להיות"]):
-            enhanced_text = enhanced_text.replace("בוא נראה", "בוא נראה...")
-            enhanced_text = enhanced_text.replace("אולי", "אולי...")
-            enhanced_text = enhanced_text.replace("יכול להיות", "יכול להיות...")
-            
-        # הוסף הדגשות קוליות למבטא ישראלי אנושי ושקול
-        voice_enhancements = [
-            ("!", "."),  # החלף קריאות בנקודות לטון שקול יותר
-            ("?", "?"),  # שמור שאלות
-            (".", ". "),  # הוסף רווח קטן לנשימה
-            ("כמובן", "כמובן"),  # שמור טבעי
-            ("בהחלט", "בהחלט"),  # שמור טבעי
-            ("מעולה", "מעולה"),  # שמור טבעי
-            ("נהדר", "נהדר"),  # שמור טבעי
-            ("וואו", "וואו"),  # שמור טבעי
-            ("אמת", "אמת"),  # שמור טבעי
-            ("בטח", "בטח"),  # שמור טבעי
-            ("ברור", "ברור"),  # שמור טבעי
-            ("מאוד", "מאוד"),  # שמור טבעי
-            ("ממש", "ממש"),  # שמור טבעי
-            ("טוב", "טוב"),  # שמור טבעי
-            ("יפה", "יפה"),  # שמור טבעי
-            ("נחמד", "נחמד"),  # שמור טבעי
-            ("מגניב", "מגניב"),  # שמור טבעי
-        ]
-        
-        for old, new in voice_enhancements:
-            enhanced_text = enhanced_text.replace(old, new)
-        
-        # הוסף ביטויי מילוי אנושיים לטקסט ארוך
-        if len(enhanced_text) > 100:
-            # הוסף ביטויים אנושיים באמצע הטקסט
-            human_fillers = [
-                (". ", ". אממ... "),
-                (", ", ", נו... "),
-                (" אבל ", " אבל רגע... "),
-                (" גם ", " גם כן... "),
-                (" או ", " או שמא... "),
-            ]
-            
-            # הוסף רק ביטוי אחד כדי לא להפריז
-            import random
-            if random.random() < 0.3:  # 30% סיכוי להוסיף ביטוי
-                filler = random.choice(human_fillers)
-                if filler[0] in enhanced_text:
-                    enhanced_text = enhanced_text.replace(filler[0], filler[1], 1)
-        
-        # הוסף ביטויים תומכים לפי הקשר
-        if any(word in enhanced_text.lower() for word in ["תעזור", "עזרה", "בעיה", "קושי"]):
-            enhanced_text = enhanced_text + " אני כאן לעזור לך."
-        elif any(word in enhanced_text.lower() for word in ["תודה", "מעולה", "נהדר"]):
-            enhanced_text = enhanced_text + " אני שמחה לעזור."
-        
-        # וודא שהטקסט נגמר בצורה טבעית ושקולה
-        if not enhanced_text.endswith((".", "?", "...")):
-            if "?" in enhanced_text[-10:]:
-                pass  # זו שאלה, תשאר ככה
-            else:
-                enhanced_text = enhanced_text + "."
+        # כל רשימות הביטויים מקומפלות מראש ב-text_matching.py
+        enhanced_text = enhance_for_voice(text)
         
         print(f"✨ טקסט משופר לקול אנושי ושקול: {enhanced_text[:100]}...")
         return enhanced_text
@@ -1269,7 +1675,7 @@ def send_audio_via_ultramsg(to, audio_bytes, caption=""):
         print(f"🎵 גודל אודיו: {len(audio_bytes)} bytes")
         
         # נסה לשלוח עם multipart/form-data
-        response = requests.post(url, files=files, data=data, params=params)
+        response = http_clients.post("ultramsg", url, files=files, data=data, params=params)
         print(f"🎵 תגובת UltraMsg API: {response.status_code}")
         print(f"🎵 תוכן תגובה: {response.text}")
         
@@ -1324,7 +1730,7 @@ def send_audio_via_ultramsg_alternative(to, audio_bytes, caption=""):
             'caption': caption
         }
         
-        response = requests.post(url, files=files, data=data, params=params)
+        response = http_clients.post("ultramsg", url, files=files, data=data, params=params)
         print(f"🎵 תגובת UltraMsg API (פורמט חלופי): {response.status_code}")
         print(f"🎵 תוכן תגובה: {response.text}")
         
@@ -1387,7 +1793,7 @@ def send_audio_via_ultramsg_fixed(to, audio_bytes, caption=""):
         }
         
         # שלח את הבקשה
-        response = requests.post(url, files=files, data=data, params=params, headers=headers)
+        response = http_clients.post("ultramsg", url, files=files, data=data, params=params, headers=headers)
         print(f"🎵 תגובת UltraMsg API: {response.status_code}")
         print(f"🎵 תוכן תגובה: {response.text}")
         
@@ -1448,7 +1854,7 @@ def send_audio_via_ultramsg_simple(to, audio_bytes, caption=""):
         print(f"🎵 גודל אודיו: {len(audio_bytes)} bytes")
         
         # שלח את הבקשה
-        response = requests.post(url, files=files, data=data, params=params)
+        response = http_clients.post("ultramsg", url, files=files, data=data, params=params)
         print(f"🎵 תגובת UltraMsg API: {response.status_code}")
         print(f"🎵 תוכן תגובה: {response.text}")
         
@@ -1511,7 +1917,7 @@ def send_audio_via_ultramsg_documentation(to, audio_bytes, caption=""):
         print(f"🎵 Token: {TOKEN[:5]}*****")
         
         # שלח את הבקשה
-        response = requests.post(url, files=files, data=data, params=params)
+        response = http_clients.post("ultramsg", url, files=files, data=data, params=params)
         print(f"🎵 תגובת UltraMsg API: {response.status_code}")
         print(f"🎵 תוכן תגובה: {response.text}")
         
@@ -1572,7 +1978,7 @@ def send_audio_via_ultramsg_recorald(to, audio_bytes, caption=""):
         print(f"🎵 גודל אודיו: {len(audio_bytes)} bytes")
         
         # שלח את הבקשה
-        response = requests.post(url, files=files, data=data, params=params)
+        response = http_clients.post("ultramsg", url, files=files, data=data, params=params)
         print(f"🎵 תגובת UltraMsg API: {response.status_code}")
         print(f"🎵 תוכן תגובה: {response.text}")
         
@@ -1642,7 +2048,7 @@ def send_audio_via_ultramsg_form_data(to, audio_bytes, caption=""):
         }
         
         # שלח את הבקשה
-        response = requests.post(url, files=files, data=data, params=params, headers=headers)
+        response = http_clients.post("ultramsg", url, files=files, data=data, params=params, headers=headers)
         print(f"🎵 תגובת UltraMsg API: {response.status_code}")
         print(f"🎵 תוכן תגובה: {response.text}")
         
@@ -1713,7 +2119,7 @@ def send_audio_via_ultramsg_json(to, audio_bytes, caption=""):
         }
         
         # שלח את הבקשה
-        response = requests.post(url, files=files, data=data, params=params, headers=headers)
+        response = http_clients.post("ultramsg", url, files=files, data=data, params=params, headers=headers)
         print(f"🎵 תגובת UltraMsg API: {response.status_code}")
         print(f"🎵 תוכן תגובה: {response.text}")
         
@@ -1783,7 +2189,7 @@ def send_audio_via_ultramsg_final(to, audio_bytes, caption=""):
         }
         
         # שלח את הבקשה
-        response = requests.post(url, files=files, data=data, params=params, headers=headers)
+        response = http_clients.post("ultramsg", url, files=files, data=data, params=params, headers=headers)
         print(f"🎵 תגובת UltraMsg API: {response.status_code}")
         print(f"🎵 תוכן תגובה: {response.text}")
         
@@ -1849,7 +2255,31 @@ def healthcheck():
 
 @app.route('/webhook', methods=['POST'])
 def whatsapp_webhook():
-    data = request.get_json()
+    if not WEBHOOK_ACK_FIRST:
+        return process_webhook_payload(request.get_json())
+
+    # מצב ack-first: רק פענוח ואימות בסיסי, העיבוד עצמו מתבצע ב-workers
+    data = request.get_json(silent=True)
+    payload = data.get("data") if isinstance(data, dict) else None
+    if not isinstance(payload, dict) or not payload.get("from"):
+        metrics.incr("ingest.invalid")
+        return "Invalid", 400
+
+    if turn_lanes.full():
+        # ה-workers של הקליטה מעבירים מיד לנתיבי השולחים - משילים כאן כל עוד אפשר להחזיר שגיאה
+        metrics.incr("ingest.shed")
+        print(f"⚠️ נתיבי השולחים מלאים ({turn_lanes.backlog()}) – משיל הודעה מ-{payload.get('from')}")
+        return "Busy", INGEST_SHED_STATUS
+
+    if not ingest_queue.submit(process_webhook_payload, data, time.time()):
+        print(f"⚠️ תור הקליטה מלא ({ingest_queue.depth()}) – משיל הודעה מ-{payload.get('from')}")
+        return "Busy", INGEST_SHED_STATUS
+
+    return "OK", 200
+
+def process_webhook_payload(data, received_at=None):
+    """עיבוד מלא של אירוע webhook: סיווג, עדכוני מצב וצבירה/מענה"""
+    received_at = received_at or time.time()
     print("🔍 JSON מלא שהתקבל:")
     print(data)
 
@@ -1860,10 +2290,7 @@ def whatsapp_webhook():
         
         if not sender:
             print("⚠️ שולח חסר.")
-            # חישוב עיכוב חכם לפני שליחת הודעת שגיאה
-            delay = calculate_smart_delay(30, "text")  # הודעת שגיאה קצרה
-            print(f"⏱️ ממתין {delay:.2f} שניות לפני שליחת הודעת שגיאה...")
-            time.sleep(delay)
+            # אין למי לשלוח הודעת שגיאה - אין טעם לעכב את התשובה ל-UltraMsg
             return "Invalid", 400
             
         if sender_name:
@@ -1957,7 +2384,7 @@ def whatsapp_webhook():
             caption = payload.get("caption", "")
             # עדכן זמן הודעה אחרונה וסיכומים
             update_last_message_time(sender)
-            check_for_auto_summary_by_message_count(sender)
+            turn_lanes.submit(sender, check_for_auto_summary_by_message_count, sender)
             # ודא שהבוט פעיל
             if not is_bot_active(sender):
                 print(f"🤖 בוט לא פעיל עבור {sender}, דולג על צבירה")
@@ -1992,7 +2419,7 @@ def whatsapp_webhook():
             print("🎥 הודעת וידאו – נכנסת ל-buffer")
             caption = payload.get("caption", "")
             update_last_message_time(sender)
-            check_for_auto_summary_by_message_count(sender)
+            turn_lanes.submit(sender, check_for_auto_summary_by_message_count, sender)
             if not is_bot_active(sender):
                 print(f"🤖 בוט לא פעיל עבור {sender}, דולג על צבירה")
                 return "OK", 200
@@ -2039,7 +2466,7 @@ def whatsapp_webhook():
             print("🎤 זוהתה הודעה קולית – מפעיל תמלול ברקע ושומר מצב תשובה אודיו")
             # עדכן זמן הודעה אחרונה וסיכום אוטומטי
             update_last_message_time(sender)
-            check_for_auto_summary_by_message_count(sender)
+            turn_lanes.submit(sender, check_for_auto_summary_by_message_count, sender)
 
             # דיהופליקציה חזקה על סמך מפתח יציב
             audio_url = payload.get("media", "") or payload.get("body", "") or payload.get("url", "")
@@ -2049,11 +2476,16 @@ def whatsapp_webhook():
                 return "OK", 200
 
             # קבע מצב תשובה = אודיו (ללא הוספת placeholder מיותר לבאפר)
-            with buffer_lock:
-                buffer_reply_mode[sender] = "audio"
+            if distributed_buffer is not None:
+                distributed_buffer.set_reply_mode(sender, "audio")
+            else:
+                with buffer_lock:
+                    buffer_reply_mode[sender] = "audio"
 
-            # תמלול ברקע כדי לא לחסום את ה-webhook ולהימנע מריטריים
-            threading.Thread(target=process_voice_message_async, args=(payload, sender), daemon=True).start()
+            # תמלול ברקע בנתיב של השולח - ה-flush שאחריו יראה את התמלול
+            if not turn_lanes.submit(sender, process_voice_message_async, payload, sender):
+                print(f"⚠️ נתיבי השולחים מלאים ({turn_lanes.backlog()}) – משיל הודעה קולית מ-{sender}")
+                return "Busy", INGEST_SHED_STATUS
             return "OK", 200
 
         # בדוק מסמכים/קבצים
@@ -2085,7 +2517,7 @@ def whatsapp_webhook():
             print("📄 הודעת קובץ/מסמך – נכנסת ל-buffer")
             caption = payload.get("caption", "")
             update_last_message_time(sender)
-            check_for_auto_summary_by_message_count(sender)
+            turn_lanes.submit(sender, check_for_auto_summary_by_message_count, sender)
             if not is_bot_active(sender):
                 print(f"🤖 בוט לא פעיל עבור {sender}, דולג על צבירה")
                 return "OK", 200
@@ -2099,11 +2531,8 @@ def whatsapp_webhook():
         message = payload.get("body", "")
         if not message:
             print("⚠️ הודעה חסרה.")
-            # חישוב עיכוב חכם לפני שליחת הודעת שגיאה
-            delay = calculate_smart_delay(50, "text")  # הודעת שגיאה בינונית
-            print(f"⏱️ ממתין {delay:.2f} שניות לפני שליחת הודעת שגיאה...")
-            time.sleep(delay)
-            send_whatsapp_message(sender, "לא הצלחתי לקרוא את ההודעה. נסה לשלוח אותה שוב.")
+            # עיכוב אנושי מזמן קבלת ההודעה, מתוזמן בלי לחסום thread
+            send_after_humanized_delay(received_at, 50, "text", send_whatsapp_message, sender, "לא הצלחתי לקרוא את ההודעה. נסה לשלוח אותה שוב.")
             return "Invalid", 400
                 
         print(f"📩 הודעת טקסט מ-{sender}: {message}")
@@ -2112,23 +2541,32 @@ def whatsapp_webhook():
         update_last_message_time(sender)
         
         # בדוק אם צריך לבצע סיכום אוטומטי לפי מספר הודעות
-        check_for_auto_summary_by_message_count(sender)
+        turn_lanes.submit(sender, check_for_auto_summary_by_message_count, sender)
         
-        # בדוק אם זו פקודת מנהל
-        admin_reply = handle_admin_commands(message, sender)
-        if admin_reply:
-            print(f"⚙️ פקודת מנהל זוהתה: {message}")
-            # חישוב עיכוב חכם לפני שליחת תשובת מנהל
-            delay = calculate_smart_delay(len(admin_reply), "text")
-            print(f"⏱️ ממתין {delay:.2f} שניות לפני שליחת תשובת מנהל...")
-            time.sleep(delay)
-            send_whatsapp_message(sender, admin_reply)
-            return "OK", 200
-        
-        # טיפול מיוחד למנהל - מספר 0523006544
-        if sender == "972523006544" or sender == "0523006544":
-            print(f"👑 מנהל זוהה: {sender}")
-            admin_menu = """👑 שלום מנהל! ברוך הבא לתפריט הניהול
+        # פקודות מנהל, בדיקת פעילות וצבירה רצות בנתיב של השולח, אחרי התורות הקודמים שלו
+        if not turn_lanes.submit(sender, process_text_turn, sender, message, received_at):
+            print(f"⚠️ נתיבי השולחים מלאים ({turn_lanes.backlog()}) – משיל הודעה מ-{sender}")
+            return "Busy", INGEST_SHED_STATUS
+        return "OK", 200
+
+    except Exception as e:
+        print(f"❌ שגיאה בטיפול בהודעה: {e}")
+        return "Error", 500
+
+def process_text_turn(sender, message, received_at):
+    """המשך טיפול בהודעת טקסט בתוך הנתיב של השולח: פקודות מנהל, בדיקת פעילות וצבירה"""
+    # בדוק אם זו פקודת מנהל
+    admin_reply = handle_admin_commands(message, sender)
+    if admin_reply:
+        print(f"⚙️ פקודת מנהל זוהתה: {message}")
+        # עיכוב אנושי מזמן קבלת ההודעה, מתוזמן בלי לחסום thread
+        send_after_humanized_delay(received_at, len(admin_reply), "text", send_whatsapp_message, sender, admin_reply)
+        return
+    
+    # טיפול מיוחד למנהל - מספר 0523006544
+    if sender == "972523006544" or sender == "0523006544":
+        print(f"👑 מנהל זוהה: {sender}")
+        admin_menu = """👑 שלום מנהל! ברוך הבא לתפריט הניהול
 
 📊 מה תרצה לעשות?
 
@@ -2146,25 +2584,21 @@ def whatsapp_webhook():
 - "עצור בוט 972123456789"
 
 איזה פעולה תרצה לבצע?"""
-            send_whatsapp_message(sender, admin_menu)
-            return "OK", 200
-        
-        # בדוק אם הבוט פעיל למשתמש זה
-        if not is_bot_active(sender):
-            print(f"🤖 בוט לא פעיל עבור {sender}, לא מעבד הודעה")
-            return "OK", 200  # לא שולח תשובה, אבל מקבל את ההודעה
-        
-        # הבוט פעיל - צבור את ההודעה וגשש טיימר לתגובה מרוכזת
-        print(f"🧲 צובר הודעת טקסט למאגָר עבור {sender}")
-        buffer_text_message(sender, message)
-        return "OK", 200
-
-    except Exception as e:
-        print(f"❌ שגיאה בטיפול בהודעה: {e}")
-        return "Error", 500
+        send_whatsapp_message(sender, admin_menu)
+        return
+    
+    # בדוק אם הבוט פעיל למשתמש זה
+    if not is_bot_active(sender):
+        print(f"🤖 בוט לא פעיל עבור {sender}, לא מעבד הודעה")
+        return  # לא שולח תשובה, אבל מקבל את ההודעה
+    
+    # הבוט פעיל - צבור את ההודעה וגשש טיימר לתגובה מרוכזת
+    print(f"🧲 צובר הודעת טקסט למאגָר עבור {sender}")
+    buffer_text_message(sender, message)
 
 def handle_voice_message(payload, sender):
     """טיפול בהודעה קולית - משודרג עם TTS nova, Cloudinary ו-UltraMsg"""
+    received_at = time.time()
     try:
         print(f"🎤 מתחיל טיפול בהודעה קולית מ: {sender}")
         print(f"🔍 Debug - payload keys: {list(payload.keys())}")
@@ -2225,11 +2659,8 @@ def handle_voice_message(payload, sender):
         transcribed_text = transcribe_voice_message(audio_url)
         if not transcribed_text:
             print("❌ תמלול נכשל, שולח הודעת טקסט...")
-            # חישוב עיכוב חכם לפני שליחת הודעת שגיאה
-            delay = calculate_smart_delay(50, "text")  # הודעת שגיאה בינונית
-            print(f"⏱️ ממתין {delay:.2f} שניות לפני שליחת הודעת שגיאה...")
-            time.sleep(delay)
-            send_whatsapp_message(sender, "לא הצלחתי לתמלל את ההקלטה. נסה לדבר יותר ברור או שלח הודעה בטקסט.")
+            # עיכוב אנושי מזמן קבלת ההודעה, מתוזמן בלי לחסום thread
+            send_after_humanized_delay(received_at, 50, "text", send_whatsapp_message, sender, "לא הצלחתי לתמלל את ההקלטה. נסה לדבר יותר ברור או שלח הודעה בטקסט.")
             return "Error", 500
         
         print(f"✅ תמלול הושלם: {transcribed_text}")
@@ -2251,11 +2682,6 @@ def handle_voice_message(payload, sender):
         reply = chat_with_gpt(transcribed_text, user_id=sender)
         print(f"💬 תשובת GPT: {reply}")
         
-        # חישוב עיכוב חכם לפני יצירת תגובת אודיו
-        delay = calculate_smart_delay(len(transcribed_text), "audio")
-        print(f"⏱️ ממתין {delay:.2f} שניות לפני יצירת תגובה קולית...")
-        time.sleep(delay)
-
         # 4. צור אודיו מתשובת GPT באמצעות ElevenLabs V3 ושלח דרך Cloudinary
         print("🎵 יוצר אודיו מתשובת GPT באמצעות ElevenLabs V3...")
         tts_audio = text_to_speech(reply, language="he")
@@ -2265,12 +2691,12 @@ def handle_voice_message(payload, sender):
                 cloud_url = upload_audio_to_cloudinary(tts_audio, "reply.mp3")
                 if cloud_url:
                     print("📤 שולח את קישור ה-Cloudinary כהודעת אודיו...")
-                    sent = send_audio_via_ultramsg_url(sender, cloud_url, caption="")
-                    if sent:
-                        print("✅ הודעת אודיו נשלחה בהצלחה (Cloudinary URL)")
-                        return "OK", 200
-                    else:
-                        print("⚠️ שליחת האודיו נכשלה, חוזר לטקסט")
+                    # זמן התמלול, GPT, TTS וההעלאה כבר מקוזז מהעיכוב האנושי
+                    send_after_humanized_delay(
+                        received_at, len(transcribed_text), "audio",
+                        deliver_audio_reply, sender, cloud_url, reply
+                    )
+                    return "OK", 200
                 else:
                     print("⚠️ העלאה ל-Cloudinary נכשלה, חוזר לטקסט")
             else:
@@ -2280,7 +2706,7 @@ def handle_voice_message(payload, sender):
 
         # אם הגענו לכאן, הייתה בעיה ביצירת/שליחת אודיו – נחזור לטקסט
         print("📝 שולח תשובה בטקסט כגיבוי...")
-        send_whatsapp_message(sender, reply)
+        send_after_humanized_delay(received_at, len(transcribed_text), "audio", send_whatsapp_message, sender, reply)
         return "OK", 200
         
     except Exception as e:
@@ -2291,16 +2717,12 @@ def handle_voice_message(payload, sender):
         # במקום לחזור הודעת שגיאה, נחזור תשובה בטקסט
         try:
             print("🔄 מנסה לחזור תשובה בטקסט במקום אודיו...")
-            # חישוב עיכוב חכם לפני שליחת טקסט
-            delay = calculate_smart_delay(len(reply) if 'reply' in locals() else 100, "text")
-            print(f"⏱️ ממתין {delay:.2f} שניות לפני שליחת תשובה בטקסט...")
-            time.sleep(delay)
-            
-            # נסה לשלוח את התשובה המקורית או הודעת ברירת מחדל
+            # נסה לשלוח את התשובה המקורית או הודעת ברירת מחדל, אחרי עיכוב אנושי מזמן קבלת ההודעה
             if 'reply' in locals() and reply:
-                send_whatsapp_message(sender, reply)
+                fallback_text = reply
             else:
-                send_whatsapp_message(sender, "אני מתנצל, לא הצלחתי לעבד את ההודעה הקולית. נסה לשלוח אותה שוב או שלח הודעה בטקסט.")
+                fallback_text = "אני מתנצל, לא הצלחתי לעבד את ההודעה הקולית. נסה לשלוח אותה שוב או שלח הודעה בטקסט."
+            send_after_humanized_delay(received_at, len(fallback_text), "text", send_whatsapp_message, sender, fallback_text)
         except Exception as fallback_error:
             print(f"❌ שגיאה גם בשליחת טקסט: {fallback_error}")
         
@@ -2308,6 +2730,7 @@ def handle_voice_message(payload, sender):
 
 def handle_image_message(payload, sender):
     """טיפול בתמונה"""
+    received_at = time.time()
     try:
         print(f"🔍 Debug - payload keys: {list(payload.keys())}")
         
@@ -2320,22 +2743,16 @@ def handle_image_message(payload, sender):
         
         if not image_url:
             print("⚠️ URL של תמונה חסר")
-            # חישוב עיכוב חכם לפני שליחת הודעת שגיאה
-            delay = calculate_smart_delay(50, "text")  # הודעת שגיאה בינונית
-            print(f"⏱️ ממתין {delay:.2f} שניות לפני שליחת הודעת שגיאה...")
-            time.sleep(delay)
-            send_whatsapp_message(sender, "לא הצלחתי לקבל את התמונה. נסה לשלוח אותה שוב.")
+            # עיכוב אנושי מזמן קבלת ההודעה, מתוזמן בלי לחסום thread
+            send_after_humanized_delay(received_at, 50, "text", send_whatsapp_message, sender, "לא הצלחתי לקבל את התמונה. נסה לשלוח אותה שוב.")
             return "Invalid", 400
         
         # הורד את התמונה
         print(f"🔄 מוריד תמונה מ: {image_url}")
         image_data = download_file(image_url)
         if not image_data:
-            # חישוב עיכוב חכם לפני שליחת הודעת שגיאה
-            delay = calculate_smart_delay(50, "text")  # הודעת שגיאה בינונית
-            print(f"⏱️ ממתין {delay:.2f} שניות לפני שליחת הודעת שגיאה...")
-            time.sleep(delay)
-            send_whatsapp_message(sender, "לא הצלחתי להוריד את התמונה. נסה לשלוח אותה שוב.")
+            # עיכוב אנושי מזמן קבלת ההודעה, מתוזמן בלי לחסום thread
+            send_after_humanized_delay(received_at, 50, "text", send_whatsapp_message, sender, "לא הצלחתי להוריד את התמונה. נסה לשלוח אותה שוב.")
             return "Error", 500
         
         print(f"✅ הורדתי תמונה: {len(image_data)} bytes")
@@ -2343,30 +2760,24 @@ def handle_image_message(payload, sender):
         # בדוק שהתמונה לא ריקה או קטנה מדי
         if len(image_data) < 1000:  # פחות מקילובייט
             print("⚠️ התמונה קטנה מדי או ריקה")
-            # חישוב עיכוב חכם לפני שליחת הודעת שגיאה
-            delay = calculate_smart_delay(60, "text")  # הודעת שגיאה בינונית
-            print(f"⏱️ ממתין {delay:.2f} שניות לפני שליחת הודעת שגיאה...")
-            time.sleep(delay)
-            send_whatsapp_message(sender, "התמונה קטנה מדי או לא תקינה. נסה לשלוח תמונה אחרת.")
+            # עיכוב אנושי מזמן קבלת ההודעה, מתוזמן בלי לחסום thread
+            send_after_humanized_delay(received_at, 60, "text", send_whatsapp_message, sender, "התמונה קטנה מדי או לא תקינה. נסה לשלוח תמונה אחרת.")
             return "Error", 500
         
         # נתח את התמונה
         print("🔍 מנתח תמונה...")
         image_analysis = analyze_image(image_data)
         if not image_analysis or "לא הצלחתי" in image_analysis:
-            # חישוב עיכוב חכם לפני שליחת הודעת שגיאה
-            delay = calculate_smart_delay(70, "text")  # הודעת שגיאה בינונית
-            print(f"⏱️ ממתין {delay:.2f} שניות לפני שליחת הודעת שגיאה...")
-            time.sleep(delay)
-            send_whatsapp_message(sender, "לא הצלחתי לנתח את התמונה. נסה לשלוח אותה שוב או תאר לי מה אתה רוצה.")
+            # עיכוב אנושי מזמן קבלת ההודעה, מתוזמן בלי לחסום thread
+            send_after_humanized_delay(received_at, 70, "text", send_whatsapp_message, sender, "לא הצלחתי לנתח את התמונה. נסה לשלוח אותה שוב או תאר לי מה אתה רוצה.")
             return "Error", 500
         
         print(f"🖼️ ניתוח תמונה: {image_analysis}")
         
         # הוסף את התמונה למערכת השיחות עם מידע נוסף
-        from chatbot import conversations
-        if sender not in conversations:
-            conversations[sender] = [{"role": "system", "content": "system_prompt"}]
+        from chatbot import append_message, ensure_system_prompt_for_user, refresh_conversation
+        refresh_conversation(sender)
+        ensure_system_prompt_for_user(sender)
         
         # שמור את התמונה כחלק מהשיחה עם מידע נוסף
         image_message = f"[תמונה] {image_analysis}"
@@ -2374,7 +2785,7 @@ def handle_image_message(payload, sender):
             image_message += f"\nכיתוב: {caption}"
         image_message += f"\n🔗 קישור לתמונה: {image_url}"
         
-        conversations[sender].append({"role": "user", "content": image_message})
+        append_message(sender, "user", image_message)
         
         # הכן הודעה עם ניתוח התמונה
         message_to_process = f"[תמונה] {image_analysis}"
@@ -2390,16 +2801,17 @@ def handle_image_message(payload, sender):
         check_for_auto_summary_by_message_count(sender)
         
         # עבד את ההודעה
-        reply = chat_with_gpt(message_to_process, user_id=sender)
+        early = EarlyReplySender(sender)
+        reply = chat_with_gpt(message_to_process, user_id=sender, on_early_chunk=early)
         print(f"💬 תשובת GPT: {reply}")
         
-        # חישוב עיכוב חכם לפי אורך ההודעה וסוג התמונה
-        delay = calculate_smart_delay(len(message_to_process), "image")
-        print(f"⏱️ ממתין {delay:.2f} שניות לפני שליחת תשובה לתמונה...")
-        time.sleep(delay)
-        
-        # שלח תשובת טקסט רגילה
-        send_whatsapp_message(sender, reply)
+        if early.sent:
+            remainder = early.remainder(reply)
+            if remainder:
+                send_in_order(sender, time.time(), send_whatsapp_message, sender, remainder)
+        else:
+            # שלח תשובת טקסט רגילה - זמן ההורדה, הניתוח ו-GPT כבר מקוזז מהעיכוב האנושי
+            send_after_humanized_delay(received_at, len(message_to_process), "image", send_whatsapp_message, sender, reply)
         
         return "OK", 200
         
@@ -2407,15 +2819,19 @@ def handle_image_message(payload, sender):
         print(f"❌ שגיאה בטיפול בתמונה: {e}")
         import traceback
         traceback.print_exc()
-        # חישוב עיכוב חכם לפני שליחת הודעת שגיאה
-        delay = calculate_smart_delay(80, "text")  # הודעת שגיאה ארוכה
-        print(f"⏱️ ממתין {delay:.2f} שניות לפני שליחת הודעת שגיאה...")
-        time.sleep(delay)
-        send_whatsapp_message(sender, "אירעה שגיאה בטיפול בתמונה. נסה לשלוח אותה שוב או תאר לי מה אתה רוצה.")
+        # עיכוב אנושי מזמן קבלת ההודעה, מתוזמן בלי לחסום thread
+        send_after_humanized_delay(received_at, 80, "text", send_whatsapp_message, sender, "אירעה שגיאה בטיפול בתמונה. נסה לשלוח אותה שוב או תאר לי מה אתה רוצה.")
         return "Error", 500
 
 def send_whatsapp_message(to, message):
-    """שלח הודעת טקסט"""
+    """שלח הודעת טקסט (דרך תור השליחה היוצא, אם פעיל)"""
+    if OUTBOUND_DISPATCHER:
+        outbound.enqueue(to, "text", post_whatsapp_text, to, message)
+    else:
+        post_whatsapp_text(to, message)
+
+def post_whatsapp_text(to, message):
+    """שליחת הודעת טקסט בפועל ל-UltraMsg; מחזיר True בהצלחה"""
     url = f"https://api.ultramsg.com/{INSTANCE_ID}/messages/chat"
     
     # הוסף את הטוקן כפרמטר GET
@@ -2428,8 +2844,15 @@ def send_whatsapp_message(to, message):
         "body": message
     }
     
-    response = requests.post(url, data=payload, params=params)
+    response = http_clients.post("ultramsg", url, data=payload, params=params)
     print("📤 הודעת טקסט נשלחה:", response.text)
+    if response.status_code != 200:
+        return False
+    try:
+        return "error" not in response.json()
+    except ValueError:
+        # תגובה 200 שאינה JSON - נניח שהשליחה הצליחה
+        return True
 
 def send_whatsapp_audio(to, audio_data):
     """שלח הודעה קולית - ללא קבצים זמניים"""
@@ -2464,7 +2887,7 @@ def send_whatsapp_audio(to, audio_data):
             'to': to
         }
         
-        response = requests.post(url, files=files, data=data, params=params)
+        response = http_clients.post("ultramsg", url, files=files, data=data, params=params)
         print("🎵 תגובת API:", response.text)
         
         # בדוק אם השליחה הצליחה
@@ -2540,7 +2963,7 @@ def check_voice_system_health():
                 print("🔗 בודק חיבור ל-UltraMsg...")
                 test_url = f"https://api.ultramsg.com/{instance_id}/instance/me"
                 test_params = {'token': token}
-                response = requests.get(test_url, params=test_params, timeout=10)
+                response = http_clients.get("ultramsg", test_url, params=test_params, timeout=10)
                 if response.status_code == 200:
                     print("✅ חיבור ל-UltraMsg תקין")
                     health_status["ultramsg_connection"] = "✅"
@@ -2633,7 +3056,7 @@ def send_audio_via_ultramsg_base64(to, audio_bytes, caption=""):
         print(f"🎵 Token: {TOKEN[:5]}*****")
         
         # שלח את הבקשה
-        response = requests.post(url, json=payload, params=params, headers=headers)
+        response = http_clients.post("ultramsg", url, json=payload, params=params, headers=headers)
         print(f"🎵 תגובת UltraMsg API: {response.status_code}")
         print(f"🎵 תוכן תגובה: {response.text}")
         
@@ -2694,7 +3117,7 @@ def send_audio_via_ultramsg_url(to, audio_url, caption=""):
         print(f"🎵 Token: {TOKEN[:5]}*****")
         
         # שלח את הבקשה
-        response = requests.post(url, json=payload, params=params, headers=headers)
+        response = http_clients.post("ultramsg", url, json=payload, params=params, headers=headers)
         print(f"🎵 תגובת UltraMsg API: {response.status_code}")
         print(f"🎵 תוכן תגובה: {response.text}")
         
@@ -2785,7 +3208,7 @@ def send_audio_via_ultramsg_official(to, audio_bytes, caption=""):
         }
         
         # שלח את הבקשה
-        response = requests.post(url, files=files, data=data, params=params, headers=headers)
+        response = http_clients.post("ultramsg", url, files=files, data=data, params=params, headers=headers)
         print(f"🎵 תגובת UltraMsg API: {response.status_code}")
         print(f"🎵 תוכן תגובה: {response.text}")
         
@@ -2839,7 +3262,7 @@ def health_check():
         try:
             test_url = f"https://api.ultramsg.com/{INSTANCE_ID}/instance/me"
             params = {'token': TOKEN}
-            response = requests.get(test_url, params=params, timeout=10)
+            response = http_clients.get("ultramsg", test_url, params=params, timeout=10)
             if response.status_code == 200:
                 health_status["ultramsg"]["connection"] = "✅"
             else:
@@ -2860,11 +3283,30 @@ def health_check():
         else:
             health_status["cloudinary"]["connection"] = "⚠️ לא זמין"
         
+        # מצב תור הקליטה
+        health_status["ingest"] = {"ack_first": WEBHOOK_ACK_FIRST, **ingest_queue.stats()}
+        health_status["http_clients"] = http_clients.stats()
+        health_status["outbound"] = {"enabled": OUTBOUND_DISPATCHER, **outbound.stats()}
+        health_status["turns"] = turn_lanes.stats()
+        health_status["persistence"] = {"write_behind": PERSIST_WRITE_BEHIND, **conversation_persistence.stats()}
+        health_status["state_backend"] = state_backend.stats()
+        health_status["debounce"] = ({"backend": "mongo", **distributed_buffer.stats()}
+                                     if distributed_buffer is not None else {"backend": "local"})
+        health_status["conversation_cache"] = conversations.stats()
+        health_status["summaries"] = summary_pool.stats()
+        health_status["scheduler_leader"] = scheduler_leader.current()
+        health_status["prompt_version"] = prompt_registry.current_version
+        
         return jsonify(health_status), 200
         
     except Exception as e:
         return jsonify({"status": "unhealthy", "error": str(e)}), 500
 
+@app.route("/metrics")
+def metrics_endpoint():
+    """מדדי ביצועים פנימיים (תורים, מונים וזמני תגובה)"""
+    return jsonify(metrics.snapshot()), 200
+
 @app.route("/test_ultramsg")
 def test_ultramsg_api():
     """בדוק את ה-API של UltraMsg עם פרמטרים שונים"""
@@ -2875,7 +3317,7 @@ def test_ultramsg_api():
         try:
             doc_url = f"https://api.ultramsg.com/{INSTANCE_ID}/instance/me"
             params = {'token': TOKEN}
-            response = requests.get(doc_url, params=params, timeout=10)
+            response = http_clients.get("ultramsg", doc_url, params=params, timeout=10)
             test_results["instance_info"] = {
                 "status_code": response.status_code,
                 "response": response.text[:200] + "..." if len(response.text) > 200 else response.text
@@ -2886,7 +3328,7 @@ def test_ultramsg_api():
         # בדוק את התיעוד של ה-API
         try:
             doc_url = "https://docs.ultramsg.com/api/send/audio"
-            response = requests.get(doc_url, timeout=10)
+            response = http_clients.get("ultramsg", doc_url, timeout=10)
             test_results["documentation"] = {
                 "status_code": response.status_code,
                 "available": response.status_code == 200
@@ -2907,7 +3349,7 @@ def test_ultramsg_audio_format():
         # בדוק את התיעוד הרשמי
         try:
             doc_url = "https://docs.ultramsg.com/api/send/audio"
-            response = requests.get(doc_url, timeout=10)
+            response = http_clients.get("ultramsg", doc_url, timeout=10)
             if response.status_code == 200:
                 print("✅ תיעוד UltraMsg זמין")
                 # חפש מידע על פורמט הבקשה
@@ -2927,7 +3369,7 @@ def test_ultramsg_audio_format():
         try:
             test_url = f"https://api.ultramsg.com/{INSTANCE_ID}/instance/me"
             params = {'token': TOKEN}
-            response = requests.get(test_url, params=params, timeout=10)
+            response = http_clients.get("ultramsg", test_url, params=params, timeout=10)
             if response.status_code == 200:
                 print("✅ חיבור ל-UltraMsg תקין")
                 print(f"📊 תגובה: {response.text[:100]}...")
@@ -2949,18 +3391,18 @@ def test_ultramsg_api_format():
         params = {'token': TOKEN}
         
         # נסה עם בקשה ריקה
-        response = requests.post(test_url, params=params, timeout=10)
+        response = http_clients.post("ultramsg", test_url, params=params, timeout=10)
         print(f"📊 תגובה לבקשה ריקה: {response.status_code}")
         print(f"📊 תוכן תגובה: {response.text}")
         
         # נסה עם JSON ריק
         headers = {'Content-Type': 'application/json'}
-        response = requests.post(test_url, json={}, params=params, headers=headers, timeout=10)
+        response = http_clients.post("ultramsg", test_url, json={}, params=params, headers=headers, timeout=10)
         print(f"📊 תגובה ל-JSON ריק: {response.status_code}")
         print(f"📊 תוכן תגובה: {response.text}")
         
         # נסה עם multipart/form-data ריק
-        response = requests.post(test_url, params=params, timeout=10)
+        response = http_clients.post("ultramsg", test_url, params=params, timeout=10)
         print(f"📊 תגובה ל-multipart ריק: {response.status_code}")
         print(f"📊 תוכן תגובה: {response.text}")
         
@@ -2977,7 +3419,7 @@ def test_ultramsg_api_parameters():
         params = {'token': TOKEN}
         data = {'to': '972527044505@c.us'}
         
-        response = requests.post(test_url, data=data, params=params, timeout=10)
+        response = http_clients.post("ultramsg", test_url, data=data, params=params, timeout=10)
         print(f"📊 תגובה עם 'to' בלבד: {response.status_code}")
         print(f"📊 תוכן תגובה: {response.text}")
         
@@ -2987,13 +3429,13 @@ def test_ultramsg_api_parameters():
         empty_audio.name = "empty.mp3"
         files = {'audio': ('empty.mp3', empty_audio, 'audio/mpeg')}
         
-        response = requests.post(test_url, files=files, params=params, timeout=10)
+        response = http_clients.post("ultramsg", test_url, files=files, params=params, timeout=10)
         print(f"📊 תגובה עם 'audio' בלבד: {response.status_code}")
         print(f"📊 תוכן תגובה: {response.text}")
         
         # בדוק עם שני הפרמטרים
         data = {'to': '972527044505@c.us'}
-        response = requests.post(test_url, files=files, data=data, params=params, timeout=10)
+        response = http_clients.post("ultramsg", test_url, files=files, data=data, params=params, timeout=10)
         print(f"📊 תגובה עם שני הפרמטרים: {response.status_code}")
         print(f"📊 תוכן תגובה: {response.text}")
         
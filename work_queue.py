@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+תור עבודה חסום עם מאגר workers קבוע - מאפשר לקבל עבודה מהר ולהשיל עומס כשהתור מלא
+"""
+
+import queue
+import threading
+import traceback
+from typing import Callable, Dict, List
+
+from metrics import metrics
+
+
+class BoundedWorkQueue:
+    def __init__(self, name: str, maxsize: int, workers: int):
+        """אתחול תור חסום; ה-workers עולים בפעם הראשונה שנשלחת עבודה"""
+        self.name = name
+        self.maxsize = max(1, int(maxsize))
+        self.workers = max(1, int(workers))
+        self._queue = queue.Queue(maxsize=self.maxsize)
+        self._threads: List[threading.Thread] = []
+        self._start_lock = threading.Lock()
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+        self._max_depth = 0
+
+        metrics.register_gauge(f"{name}.depth", self.depth)
+        metrics.register_gauge(f"{name}.in_flight", lambda: self._in_flight)
+
+    def start(self) -> None:
+        """הפעל את ה-workers (פעם אחת בלבד)"""
+        with self._start_lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker_loop, name=f"{self.name}-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            print(f"🧵 תור {self.name}: הופעלו {self.workers} workers (קיבולת {self.maxsize})")
+
+    def submit(self, fn: Callable, *args, **kwargs) -> bool:
+        """הכנס עבודה לתור; מחזיר False אם התור מלא והעבודה נזרקה"""
+        if not self._threads:
+            self.start()
+        try:
+            self._queue.put_nowait((fn, args, kwargs))
+        except queue.Full:
+            metrics.incr(f"{self.name}.shed")
+            return False
+
+        metrics.incr(f"{self.name}.accepted")
+        depth = self._queue.qsize()
+        if depth > self._max_depth:
+            self._max_depth = depth
+        return True
+
+    def depth(self) -> int:
+        """מספר פריטים שממתינים בתור"""
+        return self._queue.qsize()
+
+    def free_slots(self) -> int:
+        """כמה workers פנויים (לא עסוקים ואין עבודה שממתינה להם)"""
+        return max(0, self.workers - self._in_flight - self.depth())
+
+    def stats(self) -> Dict:
+        """סטטיסטיקות תור לצורך ניטור"""
+        return {
+            "depth": self.depth(),
+            "max_depth": self._max_depth,
+            "capacity": self.maxsize,
+            "workers": self.workers,
+            "in_flight": self._in_flight,
+            "accepted": metrics.get(f"{self.name}.accepted"),
+            "processed": metrics.get(f"{self.name}.processed"),
+            "failed": metrics.get(f"{self.name}.failed"),
+            "shed": metrics.get(f"{self.name}.shed"),
+        }
+
+    def _worker_loop(self) -> None:
+        while True:
+            fn, args, kwargs = self._queue.get()
+            with self._in_flight_lock:
+                self._in_flight += 1
+            try:
+                fn(*args, **kwargs)
+                metrics.incr(f"{self.name}.processed")
+            except Exception as e:
+                metrics.incr(f"{self.name}.failed")
+                print(f"❌ שגיאה בעבודה מתור {self.name}: {e}")
+                traceback.print_exc()
+            finally:
+                with self._in_flight_lock:
+                    self._in_flight -= 1
+                self._queue.task_done()
@@ -6,8 +6,10 @@ Minimal Background Worker for Render
 נדרש שהפונקציה run_auto_summary_scheduler תוגדר בקובץ whatsapp_webhook.py.
 
 הערות:
-- אל תגדיר ENABLE_SCHEDULER=1 בשירות ה-Web כדי שלא ירוץ שם גם.
+- אל תגדיר ENABLE_SCHEDULER=1 בשירות ה-Web כדי שלא ירוץ שם גם (אם כן - המשימות המחזוריות
+  ירוצו רק בתהליך שמחזיק בחכירת המוביל ב-wa_leader, ו-worker אחר יחליף אותו תוך LEADER_LEASE_SEC).
 - ודא שכל משתני הסביבה (Mongo/OpenAI/UltraMsg וכו') קיימים גם בשירות ה-Worker.
+- אפשר להריץ כמה מופעים: כל סשן נתפס בחכירה אטומית ב-Mongo ומסוכם פעם אחת.
 """
 
 import os
@@ -19,7 +21,7 @@ os.environ.setdefault("ENABLE_SCHEDULER", "0")
 
 try:
     # נייבא את פונקציית הסקד'ולר מתוך הקוד הקיים שלך
-    from whatsapp_webhook import run_auto_summary_scheduler
+    from whatsapp_webhook import run_auto_summary_scheduler, scheduler_leader
 except Exception:
     print("[worker_min] ERROR: failed to import run_auto_summary_scheduler from whatsapp_webhook.py", file=sys.stderr)
     print(traceback.format_exc(), file=sys.stderr)
@@ -37,6 +39,11 @@ def main() -> None:
     except Exception:
         print("[worker_min] ERROR: scheduler crashed", file=sys.stderr)
         print(traceback.format_exc(), file=sys.stderr)
+        # לוותר על ההובלה כדי שמופע אחר ייכנס מיד ולא אחרי שהחכירה תפוג
+        try:
+            scheduler_leader.resign()
+        except Exception:
+            pass
         # ב־Render, יציאה בקוד שגיאה תגרום לריסטארט אוטומטי של ה־Worker
         sys.exit(1)
 
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+שמירה ברקע (write-behind): שינוי רק מסמן את המפתח (משתמש) כמלוכלך, ו-thread יחיד
+שומר כל מפתח מלוכלך לכל היותר פעם אחת בכל מרווח - כך שכמה שמירות ברצף באותו סבב
+מתאחדות לכתיבה אחת, והתשובה ללקוח לא מחכה לדיסק. בסגירת התהליך הכל נשמר (atexit).
+"""
+
+import atexit
+import threading
+import time
+import traceback
+from typing import Callable, Dict
+
+from metrics import metrics
+
+
+class WriteBehindFlusher:
+    def __init__(self, name: str, flush_fn: Callable[[str], None], interval_sec: float):
+        """flush_fn(key) שומר את המצב הנוכחי של המפתח; נקרא רק מה-thread של השומר או בסגירה"""
+        self.name = name
+        self.flush_fn = flush_fn
+        self.interval_sec = max(0.05, float(interval_sec))
+        self._lock = threading.Lock()
+        # מפתח -> מתי סומן כמלוכלך לראשונה מאז השמירה האחרונה
+        self._dirty: Dict[str, float] = {}
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stopped = False
+
+        metrics.register_gauge(f"{name}.dirty", lambda: len(self._dirty))
+        metrics.register_gauge(f"{name}.oldest_dirty_sec", self.oldest_dirty_sec)
+
+    def start(self) -> None:
+        """הפעל את ה-thread (פעם אחת בלבד) ורשום שמירה בסגירה"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name=f"{self.name}-flusher", daemon=True)
+            self._thread.start()
+        atexit.register(self.shutdown)
+        print(f"💾 שמירה ברקע ({self.name}): כל {self.interval_sec:g}s")
+
+    def mark_dirty(self, key: str) -> None:
+        """סמן שהמפתח השתנה; יישמר בסבב הבא של השומר"""
+        if self._thread is None:
+            self.start()
+        with self._lock:
+            self._dirty.setdefault(key, time.time())
+        metrics.incr(f"{self.name}.marked")
+
+    def is_dirty(self, key: str) -> bool:
+        with self._lock:
+            return key in self._dirty
+
+    def flush(self, key: str) -> None:
+        """שמור מפתח אחד עכשיו (אם מלוכלך) - למשל לפני פינוי מהזיכרון"""
+        with self._lock:
+            dirty_since = self._dirty.pop(key, None)
+        if dirty_since is not None:
+            self._flush_one(key, dirty_since)
+
+    def flush_all(self) -> int:
+        """שמור את כל המפתחות המלוכלכים; מחזיר כמה נשמרו"""
+        with self._lock:
+            batch, self._dirty = self._dirty, {}
+        for key, dirty_since in batch.items():
+            self._flush_one(key, dirty_since)
+        return len(batch)
+
+    def shutdown(self) -> None:
+        """עצור את השומר ושמור את מה שנשאר"""
+        if self._stopped:
+            return
+        self._stopped = True
+        self._wakeup.set()
+        flushed = self.flush_all()
+        if flushed:
+            print(f"💾 שמירה ברקע ({self.name}): נשמרו {flushed} בסגירה")
+
+    def oldest_dirty_sec(self) -> float:
+        """כמה זמן המפתח הוותיק ביותר מחכה לשמירה"""
+        with self._lock:
+            oldest = min(self._dirty.values(), default=None)
+        return round(time.time() - oldest, 3) if oldest is not None else 0.0
+
+    def stats(self) -> Dict:
+        """סטטיסטיקות לניטור"""
+        return {
+            "interval_sec": self.interval_sec,
+            "dirty": len(self._dirty),
+            "oldest_dirty_sec": self.oldest_dirty_sec(),
+            "flushed": metrics.get(f"{self.name}.flushed"),
+            "failed": metrics.get(f"{self.name}.failed"),
+            "flush_lag_sec": metrics.distribution(f"{self.name}.flush_lag_sec"),
+        }
+
+    def _loop(self) -> None:
+        while not self._stopped:
+            self._wakeup.wait(self.interval_sec)
+            if self._stopped:
+                return
+            self.flush_all()
+
+    def _flush_one(self, key: str, dirty_since: float) -> None:
+        # שמירה אחת בכל פעם לכל השומר: ה-thread והסגירה לא כותבים במקביל
+        with self._flush_lock:
+            try:
+                self.flush_fn(key)
+                metrics.incr(f"{self.name}.flushed")
+                metrics.observe(f"{self.name}.flush_lag_sec", time.time() - dirty_since)
+            except Exception as e:
+                metrics.incr(f"{self.name}.failed")
+                print(f"❌ שגיאה בשמירה ברקע של {key} ({self.name}): {e}")
+                traceback.print_exc()
+                # יינסה שוב בסבב הבא
+                with self._lock:
+                    self._dirty.setdefault(key, dirty_since)